@@ -0,0 +1,264 @@
+import logging
+import select
+import sys
+import time
+import timeit
+
+import config
+import member
+import member_address
+import message
+import service
+import state
+import util
+import vector_clock
+
+# Micro-benchmarks of the hot code paths.
+#
+# Usage:
+#   python benchmark.py [name ...]
+#
+# Without arguments all benchmarks are run.
+
+def create_member(i):
+    address = member_address.Address.from_string(f'10.0.{i // 250}.{i % 250 + 1}:{7000 + i % 1000}')
+    return member.Member(uid=i % 10000, address=address)
+
+def codec_messages():
+    this_member = create_member(1)
+
+    hello = message.Hello(message.MESSAGE_HELLO_TYPE, 1)
+    hello.this_member = this_member
+
+    welcome = message.Welcome(message.MESSAGE_WELCOME_TYPE, 2)
+    welcome.hello_sequence_num = 1
+    welcome.this_member = this_member
+
+    member_list = message.MemberList(message.MESSAGE_MEMBER_LIST_TYPE, 3)
+    member_list.members = [create_member(i) for i in range(8)]
+
+    ack = message.Ack(message.MESSAGE_ACK_TYPE, 4)
+    ack.ack_sequence_num = 3
+
+    data = message.Data(message.MESSAGE_DATA_TYPE, 5)
+    data.data_version = vector_clock.VectorRecord(42, vector_clock.create_member_id(this_member))
+    data.data = bytes('x' * 64, config.FORMAT)
+
+    status = message.Status(message.MESSAGE_STATUS_TYPE, 6)
+    for i in range(8):
+        status.data_version.set_sequence_number_for_member(create_member(i), i + 1)
+
+    return [hello, welcome, member_list, ack, data, status]
+
+def bench_codec(number=2000):
+    print('codec: encode/decode cost per message and message size')
+    print(f'{"message":<12}{"codec":<8}{"size":>6}{"encode us":>12}{"decode us":>12}')
+    codecs = [('text', config.PROTOCOL_VERSION_MIN), ('binary', config.PROTOCOL_VERSION_BINARY)]
+    for msg in codec_messages():
+        for codec_name, version in codecs:
+            buffer = message.encode_message(msg, version)
+            encode_time = timeit.timeit(lambda: message.encode_message(msg, version), number=number)
+            decode_time = timeit.timeit(
+                lambda: message.decode_message(type(msg)(msg.message_type, 0), buffer),
+                number=number)
+            print(f'{type(msg).__name__:<12}{codec_name:<8}{len(buffer):>6}'
+                  f'{encode_time / number * 1e6:>12.2f}{decode_time / number * 1e6:>12.2f}')
+
+def create_clock(size, offset=0):
+    clock = vector_clock.VectorClock()
+    clock.capacity = sys.maxsize
+    for i in range(size):
+        clock.set_sequence_number_by_id(f'/ip4/10.0.0.1/udp/{i}/uid/1', i + offset)
+
+    return clock
+
+def bench_vector_clock(sizes=(1000, 5000, 10000), number=20):
+    print('vector_clock: compare and compare_with_record')
+    print(f'{"records":>8}{"compare ms":>14}{"record us":>12}')
+    for size in sizes:
+        clock = create_clock(size)
+        other = create_clock(size, 1)
+        records = list(other.records.values())
+        compare_time = timeit.timeit(lambda: clock.compare(other, False), number=number)
+        record_time = timeit.timeit(
+            lambda: [clock.compare_with_record(record, False) for record in records],
+            number=number)
+        print(f'{size:>8}{compare_time / number * 1e3:>14.3f}'
+              f'{record_time / number / size * 1e6:>12.3f}')
+
+def bench_member_list(size=10000, number=1000):
+    print('member_list: joins, lookups, sampling and removals')
+    members = [create_member(i) for i in range(size)]
+
+    member_list = member.MemberList()
+    put_time = timeit.timeit(lambda: [member_list.put([m]) for m in members], number=1)
+    find_time = timeit.timeit(lambda: [member_list.find_by_addr(m.address) for m in members], number=1)
+    sample_time = timeit.timeit(lambda: member_list.random_members(config.MESSAGE_RUMOR_FACTOR), number=number)
+    sample_all_time = timeit.timeit(lambda: member_list.random_members(size), number=10)
+    remove_time = timeit.timeit(lambda: [member_list.remove_by_addr(m.address) for m in members], number=1)
+
+    print(f'{"members":>8}{"put us":>10}{"find us":>10}{"remove us":>12}{"sample us":>12}{"sample all ms":>16}')
+    print(f'{size:>8}{put_time / size * 1e6:>10.3f}{find_time / size * 1e6:>10.3f}'
+          f'{remove_time / size * 1e6:>12.3f}{sample_time / number * 1e6:>12.3f}'
+          f'{sample_all_time / 10 * 1e3:>16.3f}')
+
+def create_service():
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.WARNING)
+    address = member_address.Address.from_string('127.0.0.1:0')
+    gossip_service = service.GossipService(self_address=address, data_receiver=None, logger=logger)
+    gossip_service.state = state.STATE_CONNECTED
+    return gossip_service
+
+def bench_outbound_queue(size=10000, number=1000):
+    print('outbound_queue: send() and acknowledgements with in-flight messages')
+    gossip_service = create_service()
+    gossip_service.outbound_messages.capacity = size
+    recipients = [create_member(i).address for i in range(size)]
+
+    enqueue_time = timeit.timeit(
+        lambda: [gossip_service.enqueue_to_outbound(b'x', config.MESSAGE_RETRY_ATTEMPTS, recipient, i + 1)
+                 for i, recipient in enumerate(recipients)],
+        number=1)
+
+    # Pretend everything was sent once and is waiting for an ack.
+    current_ts = util.get_time()
+    for env in gossip_service.outbound_messages.due(current_ts):
+        env.attempt_num = 1
+        env.attempt_ts = current_ts
+        gossip_service.outbound_messages.schedule(env, current_ts + config.MESSAGE_RETRY_INTERVAL)
+
+    send_time = timeit.timeit(gossip_service.send, number=number)
+    ack_time = timeit.timeit(
+        lambda: [gossip_service.acknowledge_envolope(gossip_service.find_envolope_by_sequence_num(i + 1, recipient))
+                 for i, recipient in enumerate(recipients)],
+        number=1)
+    gossip_service.stop()
+
+    print(f'{"in-flight":>10}{"enqueue us":>12}{"idle send us":>14}{"ack us":>10}')
+    print(f'{size:>10}{enqueue_time / size * 1e6:>12.3f}{send_time / number * 1e6:>14.3f}'
+          f'{ack_time / size * 1e6:>10.3f}')
+
+def create_cluster(size, base_port):
+    nodes = []
+    for i in range(size):
+        address = member_address.Address.from_string(f'127.0.0.1:{base_port + i}')
+        gossip_service = service.GossipService(self_address=address, data_receiver=None,
+                                               logger=logging.getLogger('benchmark'))
+        gossip_service.join([nodes[0].self_address] if nodes else [])
+        nodes.append(gossip_service)
+
+    return nodes
+
+# Deliver the datagrams and run the Gossip ticks of all nodes.
+def pump_cluster(nodes, timeout=0.002):
+    sockets = {gossip_service.socket_fd(): gossip_service for gossip_service in nodes}
+    readable, _, _ = select.select(list(sockets), [], [], timeout)
+    for sock in readable:
+        sockets[sock].receive_batch()
+
+    for gossip_service in nodes:
+        if gossip_service.current_state() == state.STATE_CONNECTED:
+            gossip_service.tick()
+        gossip_service.send()
+
+def bench_rumor(size=30, rumors=10, tick_interval=20, base_port=17000):
+    print('rumor: infection time and Data messages per rumor by the rumor stop policy, or along the broadcast tree')
+    logging.getLogger('benchmark').setLevel(logging.ERROR)
+    config.GOSSIP_TICK_INTERVAL = tick_interval
+    policies = [('none', config.RUMOR_STOP_NONE, 0, 3),
+                ('none', config.RUMOR_STOP_NONE, 0, 1),
+                ('counter', config.RUMOR_STOP_COUNTER, 1, 1),
+                ('counter', config.RUMOR_STOP_COUNTER, 2, 1),
+                ('counter', config.RUMOR_STOP_COUNTER, 2, 2),
+                ('counter', config.RUMOR_STOP_COUNTER, 2, 3),
+                ('probability', config.RUMOR_STOP_PROBABILITY, 2, 1),
+                ('probability', config.RUMOR_STOP_PROBABILITY, 4, 1),
+                ('plumtree', config.RUMOR_STOP_NONE, 0, 0)]
+    print(f'{"policy":<14}{"k":>3}{"fanout":>8}{"ticks":>8}{"data msgs":>11}{"duplicates":>12}')
+    for i, (name, stop, stop_k, fanout) in enumerate(policies):
+        nodes = create_cluster(size, base_port + i * size)
+        for gossip_service in nodes:
+            gossip_service.rumor_stop = stop
+            gossip_service.rumor_stop_k = stop_k or 1
+            gossip_service.rumor_fanout = fanout
+            gossip_service.epidemic_tree = name == 'plumtree'
+
+        # Let the membership settle.
+        deadline = time.time() + 10
+        while time.time() < deadline and any(n.members.get_size() < size - 1 for n in nodes):
+            pump_cluster(nodes)
+        for _ in range(50):
+            pump_cluster(nodes)
+
+        ticks = 0
+        for gossip_service in nodes:
+            gossip_service.rumor_counters = dict.fromkeys(gossip_service.rumor_counters, 0)
+        for r in range(rumors):
+            # A single originator, the vector clock holds a few records only.
+            origin = nodes[0]
+            origin.send_data(bytes(f'rumor {r}', config.FORMAT))
+            record = origin.data_version.find_record(origin.this_member)
+            start = time.time()
+            while any(n.data_version.compare_with_record(record, False) == vector_clock.VC_BEFORE for n in nodes):
+                pump_cluster(nodes)
+            ticks += (time.time() - start) * 1000 / tick_interval
+
+            # Let the rumor cool down before the next one.
+            for _ in range(config.RUMOR_MAX_ROUNDS * tick_interval // 2):
+                pump_cluster(nodes)
+
+        received = sum(n.rumor_counters['received'] + n.rumor_counters['duplicates'] for n in nodes)
+        duplicates = sum(n.rumor_counters['duplicates'] for n in nodes)
+        for gossip_service in nodes:
+            gossip_service.stop()
+
+        print(f'{name:<14}{stop_k:>3}{fanout:>8}{ticks / rumors:>8.1f}{received / rumors:>11.1f}{duplicates / rumors:>12.1f}')
+
+def bench_joins(joins=500, members=100):
+    print(f'joins: seed work for {joins} simultaneous joins into a cluster of {members} members')
+    hellos = []
+    for i in range(joins):
+        hello = message.Hello(message.MESSAGE_HELLO_TYPE, i + 1)
+        hello.this_member = create_member(members + i)
+        hellos.append((message.encode_message(hello, config.PROTOCOL_VERSION_MIN), hello.this_member.address))
+
+    print(f'{"piggyback":>10}{"batched":>9}{"ms":>9}{"encodes":>9}{"envolopes":>11}')
+    for piggyback in (False, True):
+        for batched in (False, True):
+            gossip_service = create_service()
+            gossip_service.outbound_messages.capacity = 10 ** 7
+            gossip_service.members.put([create_member(i) for i in range(members)])
+            gossip_service.piggyback_membership = piggyback
+            gossip_service.join_batch_window = 10 ** 9 if batched else 0
+
+            encodes = [0]
+            encode_message = gossip_service.encode_message
+            def counting_encode(msg, version=config.PROTOCOL_VERSION_MIN):
+                encodes[0] += 1
+                return encode_message(msg, version)
+            gossip_service.encode_message = counting_encode
+
+            start = time.perf_counter()
+            for buffer, sender in hellos:
+                gossip_service.handle_datagram(buffer, sender)
+            gossip_service.flush_joins()
+            elapsed = time.perf_counter() - start
+
+            envolopes = gossip_service.outbound_messages.stats()['envolopes']
+            gossip_service.stop()
+            print(f'{str(piggyback):>10}{str(batched):>9}{elapsed * 1000:>9.1f}{encodes[0]:>9}{envolopes:>11}')
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'vector_clock': bench_vector_clock,
+    'member_list': bench_member_list,
+    'outbound_queue': bench_outbound_queue,
+    'rumor': bench_rumor,
+    'joins': bench_joins,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import sys
+import threading
+import time
+
+import config
+import demo_member
+import member_address
+
+# Load and latency benchmark of a real cluster on localhost UDP ports.
+#
+# 'nodes' GossipService nodes are spread over 'workers' processes, every
+# node runs the DemoMember run-loop in a thread of its own. Node 0 is the
+# seed. After 'warmup' seconds for the joins, the first 'senders' nodes
+# call 'send_data' 'rate' times per second in total for 'duration'
+# seconds, then the cluster has 'drain' seconds to spread the rest.
+#
+# A payload carries its origin and send time. The first 'data_receiver'
+# call on every other node gives its delivery latency, the last of them
+# its dissemination latency. The bytes all the sockets sent from the start
+# of the send phase are divided by the delivered payloads.
+#
+# Usage:
+#   python benchmark_cluster.py [--nodes N] [--rate R] [--output results.json] ...
+#
+# The results are printed as JSON.
+
+PAYLOAD_SEPARATOR = b'|'
+
+class BenchmarkMember(demo_member.DemoMember):
+    def __init__(self, index, address, seed_addresses, logger, plan):
+        demo_member.DemoMember.__init__(self, address, seed_addresses, None, logger)
+        self.index = index
+        self.plan = plan
+
+        # Senders send one payload every 'send_interval' seconds, spread
+        # over the interval, so they don't send at the same moment.
+        self.is_sender = index < plan['senders']
+        self.send_interval = plan['senders'] / plan['rate']
+        self.next_send_ts = plan['send_start_ts'] + self.send_interval * index / plan['senders']
+        self.sequence_num = 0
+
+        self.sent = {}         # map<payload id, send ts>
+        self.rejected = 0      # payloads the service refused
+        self.received = {}     # map<payload id, (send ts, first receive ts)>
+        self.counters = None   # socket counters at the start of the send phase
+        self.members = 0       # members known at the start of the send phase
+
+    def data_receiver(self, data):
+        received_ts = time.time()
+        origin, sequence_num, send_ts, _ = data.split(PAYLOAD_SEPARATOR, 3)
+        payload_id = f'{int(origin)}:{int(sequence_num)}'
+        if payload_id not in self.received:
+            self.received[payload_id] = (float(send_ts), received_ts)
+
+    def create_payload(self, send_ts):
+        payload = PAYLOAD_SEPARATOR.join([bytes(str(self.index), config.FORMAT),
+                                          bytes(str(self.sequence_num), config.FORMAT),
+                                          bytes(repr(send_ts), config.FORMAT),
+                                          b''])
+        return payload + b'x' * max(0, self.plan['payload_size'] - len(payload))
+
+    def run_helper(self):
+        current_ts = time.time()
+        if self.counters is None and current_ts >= self.plan['send_start_ts']:
+            self.counters = dict(self.gossip_daemon.messaging_service.counters)
+            self.members = self.gossip_daemon.members.get_size()
+
+        if current_ts >= self.plan['stop_ts']:
+            self.running = False
+            return
+
+        next_ts = self.plan['send_start_ts'] if self.counters is None else self.plan['stop_ts']
+        if self.is_sender:
+            while self.next_send_ts <= current_ts and self.next_send_ts < self.plan['send_end_ts']:
+                self.sequence_num += 1
+                if self.gossip_daemon.send_data(self.create_payload(current_ts)):
+                    self.sent[f'{self.index}:{self.sequence_num}'] = current_ts
+                else:
+                    self.rejected += 1
+                self.next_send_ts += self.send_interval
+
+            if self.next_send_ts < self.plan['send_end_ts']:
+                next_ts = min(next_ts, self.next_send_ts)
+
+        # Wake up in time for the next payload or phase, not only for the
+        # next Gossip tick.
+        self.poll_interval = max(0, min(self.poll_interval, math.ceil((next_ts - current_ts) * 1000)))
+
+    def result(self):
+        counters = self.gossip_daemon.messaging_service.counters
+        baseline = self.counters or counters
+        return {
+            'index': self.index,
+            'members': self.members,
+            'sent': self.sent,
+            'rejected': self.rejected,
+            'received': self.received,
+            'counters': {name: counters[name] - baseline[name] for name in counters},
+        }
+
+# Run the nodes 'indexes' till the end of the plan, then report their
+# results to the 'results' queue.
+def run_worker(indexes, plan, results):
+    logger = logging.getLogger('benchmark_cluster')
+    logger.setLevel(logging.ERROR)
+    seed_address = member_address.Address.from_string(f'127.0.0.1:{plan["base_port"]}')
+
+    members = []
+    for index in indexes:
+        address = member_address.Address.from_string(f'127.0.0.1:{plan["base_port"] + index}')
+        members.append(BenchmarkMember(index, address, [seed_address] if index else [], logger, plan))
+
+    time.sleep(max(0, plan['start_ts'] - time.time()))
+    threads = [threading.Thread(target=member.start, daemon=True) for member in members]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for member in members:
+        member.gossip_daemon.stop()
+        results.put(member.result())
+
+# The 'p' percentile (nearest rank) of the sorted 'values', in milliseconds.
+def percentile(values, p):
+    if not values:
+        return None
+    return round(values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000, 3)
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': percentile(values, 100),
+    }
+
+def summarize(plan, reports):
+    nodes = plan['nodes']
+    sent = {}
+    for report in reports:
+        sent.update(report['sent'])
+
+    deliveries = []                                           # latency of every delivery
+    last_delivery = {payload_id: 0.0 for payload_id in sent}  # latency of the last delivery of a payload
+    receivers = {payload_id: 0 for payload_id in sent}        # nodes which received a payload
+    for report in reports:
+        for payload_id, (send_ts, received_ts) in report['received'].items():
+            if payload_id not in sent:
+                continue
+            deliveries.append(received_ts - send_ts)
+            receivers[payload_id] += 1
+            last_delivery[payload_id] = max(last_delivery[payload_id], received_ts - send_ts)
+
+    complete = [payload_id for payload_id, count in receivers.items() if count == nodes - 1]
+    counters = {name: sum(report['counters'][name] for report in reports) for name in reports[0]['counters']}
+    members = [report['members'] for report in reports]
+    window = plan['duration'] + plan['drain']
+
+    return {
+        'config': {name: plan[name] for name in ('nodes', 'workers', 'senders', 'rate', 'duration',
+                                                 'warmup', 'drain', 'payload_size')},
+        'protocol_version': config.PROTOCOL_VERSION,
+        'members': {'min': min(members), 'mean': round(sum(members) / len(members), 2)},
+        'payloads': {
+            'sent': len(sent),
+            'rejected': sum(report['rejected'] for report in reports),
+            'complete': len(complete),
+            'deliveries': len(deliveries),
+            'expected_deliveries': len(sent) * (nodes - 1),
+        },
+        'throughput': {
+            'sent_per_s': round(len(sent) / plan['duration'], 2),
+            'complete_per_s': round(len(complete) / plan['duration'], 2),
+            'deliveries_per_s': round(len(deliveries) / plan['duration'], 2),
+        },
+        'latency_ms': {
+            'delivery': latency_summary(deliveries),
+            'dissemination': latency_summary([last_delivery[payload_id] for payload_id in complete]),
+        },
+        'wire': {
+            'datagrams': counters['sent'],
+            'bytes': counters['bytes'],
+            'bytes_per_s': round(counters['bytes'] / window, 2),
+            'bytes_per_payload': round(counters['bytes'] / len(sent), 2) if sent else None,
+            'bytes_per_delivery': round(counters['bytes'] / len(deliveries), 2) if deliveries else None,
+            'datagrams_per_delivery': round(counters['sent'] / len(deliveries), 3) if deliveries else None,
+        },
+    }
+
+def run(nodes=16, workers=None, senders=1, rate=20.0, duration=10.0, warmup=5.0, drain=5.0,
+        payload_size=64, base_port=19000, startup=1.0):
+    workers = max(1, min(nodes, workers or multiprocessing.cpu_count()))
+    senders = max(1, min(nodes, senders))
+    start_ts = time.time() + startup + 0.05 * workers
+    plan = {
+        'nodes': nodes,
+        'workers': workers,
+        'senders': senders,
+        'rate': rate,
+        'duration': duration,
+        'warmup': warmup,
+        'drain': drain,
+        'payload_size': payload_size,
+        'base_port': base_port,
+        'start_ts': start_ts,
+        'send_start_ts': start_ts + warmup,
+        'send_end_ts': start_ts + warmup + duration,
+        'stop_ts': start_ts + warmup + duration + drain,
+    }
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(list(range(worker, nodes, workers)), plan, results))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+
+    # Drain the queue before joining, a worker can't exit with its results
+    # still in the pipe.
+    reports = [results.get() for _ in range(nodes)]
+    for process in processes:
+        process.join()
+
+    return summarize(plan, reports)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and latency benchmark of a localhost UDP cluster.')
+    parser.add_argument('--nodes', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None, help='processes, the number of CPUs by default')
+    parser.add_argument('--senders', type=int, default=1, help='nodes calling send_data')
+    parser.add_argument('--rate', type=float, default=20.0, help='payloads per second, of all senders')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of sending')
+    parser.add_argument('--warmup', type=float, default=5.0, help='seconds for the joins')
+    parser.add_argument('--drain', type=float, default=5.0, help='seconds to spread the last payloads')
+    parser.add_argument('--payload-size', type=int, default=64)
+    parser.add_argument('--base-port', type=int, default=19000)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    summary = run(args.nodes, args.workers, args.senders, args.rate, args.duration, args.warmup,
+                  args.drain, args.payload_size, args.base_port)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
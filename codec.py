@@ -0,0 +1,74 @@
+import socket
+import struct
+
+import config
+
+# The first byte of every binary encoded message has this bit set,
+# text encoded messages always start with an ASCII digit.
+BINARY_MARKER = 0x80
+
+PORT_FORMAT = struct.Struct('!H')   # 2-byte port number
+
+SINGLE_BYTES = [bytes([value]) for value in range(0x80)]
+
+def is_binary(buffer):
+    return len(buffer) > 0 and (buffer[0] & BINARY_MARKER) != 0
+
+# A zero-padded 'width'-digit field of the text codec. A value which doesn't
+# fit would shift every field after it, so it's refused instead.
+def encode_text_number(value, width=4):
+    if not 0 <= value < 10 ** width:
+        raise ValueError(f'{value} does not fit into a {width}-digit text field')
+    return bytes(f'{value:>0{width}}', config.FORMAT)
+
+def encode_varint(value):
+    if value < 0x80:
+        return SINGLE_BYTES[value]
+
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+# Returns the decoded value and the offset right after it.
+def decode_varint(buffer, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+def encode_bytes(value):
+    return encode_varint(len(value)) + value
+
+def decode_bytes(buffer, offset):
+    size, offset = decode_varint(buffer, offset)
+    return bytes(buffer[offset:offset+size]), offset + size
+
+def encode_string(value):
+    return encode_bytes(bytes(value, config.FORMAT))
+
+def decode_string(buffer, offset):
+    size, offset = decode_varint(buffer, offset)
+    return str(buffer[offset:offset+size], config.FORMAT), offset + size
+
+# 1-byte length of the packed IP address, the address itself and 2-byte port.
+def encode_address(ip, port):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    packed_ip = socket.inet_pton(family, ip)
+    return bytes([len(packed_ip)]) + packed_ip + PORT_FORMAT.pack(port)
+
+def decode_address(buffer, offset):
+    size = buffer[offset]
+    offset += 1
+    family = socket.AF_INET6 if size == 16 else socket.AF_INET
+    ip = socket.inet_ntop(family, bytes(buffer[offset:offset+size]))
+    offset += size
+    port, = PORT_FORMAT.unpack_from(buffer, offset)
+    return ip, port, offset + PORT_FORMAT.size
@@ -1,5 +1,35 @@
 # the protocol version
-PROTOCOL_VERSION = 0x01
+PROTOCOL_VERSION = 0x0A
+
+# The oldest protocol version, assumed for peers we know nothing about.
+PROTOCOL_VERSION_MIN = 0x01
+
+# The first protocol version that understands bundled messages.
+PROTOCOL_VERSION_BUNDLE = 0x02
+
+# The first protocol version that understands the compact binary codec.
+PROTOCOL_VERSION_BINARY = 0x03
+
+# The first protocol version that understands delta Status messages.
+PROTOCOL_VERSION_DELTA = 0x04
+
+# The first protocol version that understands digest Status messages.
+PROTOCOL_VERSION_DIGEST = 0x05
+
+# The first protocol version that understands selective acknowledgements.
+PROTOCOL_VERSION_SACK = 0x06
+
+# The first protocol version that understands IHave, Graft and Prune messages.
+PROTOCOL_VERSION_PLUMTREE = 0x07
+
+# The first protocol version that understands Ping, PingReq and MemberState messages.
+PROTOCOL_VERSION_SWIM = 0x08
+
+# The first protocol version that takes membership events piggybacked on other messages.
+PROTOCOL_VERSION_PIGGYBACK = 0x09
+
+# The first protocol version that understands View messages.
+PROTOCOL_VERSION_PARTIAL_VIEW = 0x0A
 
 # The interval in milliseconds between retry attempts.
 MESSAGE_RETRY_INTERVAL = 10000
@@ -7,15 +37,184 @@ MESSAGE_RETRY_INTERVAL = 10000
 # The maximum number of attempts to deliver a message.
 MESSAGE_RETRY_ATTEMPTS = 3
 
+# Derive the retry interval from the round-trip times measured for each
+# member. 'MESSAGE_RETRY_INTERVAL' is used until the first sample.
+MESSAGE_ADAPTIVE_RETRY = True
+
+# Bounds of the adaptive retry interval in milliseconds.
+RETRY_TIMEOUT_MIN = 200
+RETRY_TIMEOUT_MAX = 60000
+
+# The clock granularity in milliseconds, the least variation added to the round-trip time.
+RETRY_CLOCK_GRANULARITY = 10
+
+# The maximum number of members with a round-trip time estimate.
+RTT_TABLE_SIZE = 1024
+
 # The number of members that are used for further gossip propagation.
 MESSAGE_RUMOR_FACTOR  = 3
 
 # The maximum supported size of the message including a protocol overhead.
 MESSAGE_MAX_SIZE     = 512
 
+# Use the compact binary codec with members that support it.
+MESSAGE_BINARY_CODEC = True
+
+# The number of senders which are not members, but sent binary datagrams,
+# remembered to answer them in the binary codec.
+BINARY_SENDERS_SIZE = 1024
+
+# Gossip only the data versions changed since the Status last acknowledged by a member.
+STATUS_DELTA = True
+
+# Gossip a constant-size digest of the vector clock instead of the full clock.
+STATUS_DIGEST = True
+
+# Every 'STATUS_FULL_INTERVAL'-th Status gossiped to a member carries the
+# digest, or the full clock, even when a delta is known. It repairs the
+# data a member learned about from a delta but never received.
+STATUS_FULL_INTERVAL = 8
+
+# Acknowledge all messages received from a member since the last flush
+# of the outbound queue with a single selective acknowledgement.
+MESSAGE_ACK_AGGREGATION = True
+
+# When to stop spreading a new Data message to random members:
+# forward it once, keep pushing it on every Gossip tick until 'RUMOR_STOP_K'
+# members answered they already had it, or stop with the probability
+# 1/'RUMOR_STOP_K' on every such answer.
+RUMOR_STOP_NONE = 0
+RUMOR_STOP_COUNTER = 1
+RUMOR_STOP_PROBABILITY = 2
+RUMOR_STOP = RUMOR_STOP_NONE
+RUMOR_STOP_K = 2
+
+# The number of random members a rumor is pushed to at once.
+RUMOR_FANOUT = 3
+
+# Data which made this many hops is not forwarded anymore, 0 for no limit.
+RUMOR_MAX_HOPS = 0
+
+# The maximum number of Gossip ticks a rumor stays hot.
+RUMOR_MAX_ROUNDS = 10
+
+# The maximum number of hot rumors, the oldest ones stop first.
+RUMOR_MAX_HOT = 64
+
+# Trace when every rumor (Data message) was first seen, the hops it made
+# and the duplicates received, see 'tracing.RumorTracer'.
+RUMOR_TRACING = False
+
+# The maximum number of traced rumors, the oldest ones are forgotten first.
+RUMOR_TRACE_SIZE = 1024
+
+# Detect failed members with SWIM probes instead of evicting the members
+# which didn't acknowledge a message.
+FAILURE_DETECTOR = True
+
+# The SWIM protocol period in milliseconds, one member is probed per period.
+SWIM_PROBE_INTERVAL = 1000
+
+# The time in milliseconds to wait for the Ping ack before other members are asked to probe.
+SWIM_PING_TIMEOUT = 300
+
+# The number of members asked to probe a member which didn't answer the Ping.
+SWIM_INDIRECT_PROBES = 3
+
+# The time in milliseconds a suspect member has to refute the suspicion.
+SWIM_SUSPECT_TIMEOUT = 3000
+
+# The time in milliseconds a dead member is remembered, so stale news
+# doesn't bring it back. Only news with a higher incarnation number does.
+SWIM_TOMBSTONE_TIMEOUT = 60000
+
+# Piggyback membership events (join, suspect, dead) on the datagrams sent
+# anyway, instead of sending MemberList and MemberState messages of their own.
+MEMBERSHIP_PIGGYBACK = True
+
+# Every membership event is piggybacked this many times log10 of the cluster size.
+PIGGYBACK_RETRANSMIT_FACTOR = 4
+
+# The maximum number of membership events waiting to be piggybacked, the oldest are dropped first.
+PIGGYBACK_MAX_EVENTS = 1024
+
+# Every event is piggybacked only a few times, so a member may miss one.
+# While events are piggybacked, every node pushes a random sample of its
+# member list to a random member every 'MEMBER_LIST_SYNC_INTERVAL' milliseconds.
+MEMBER_LIST_SYNC_INTERVAL = 5000
+
+# Spread new Data along an epidemic broadcast tree (Plumtree) instead of
+# pushing it to random members, the other peers only get IHave announcements.
+PLUMTREE = False
+
+# The number of peers Data is pushed to, and announced to, before the tree is formed.
+PLUMTREE_EAGER_PEERS = 3
+PLUMTREE_LAZY_PEERS = 3
+
+# The time in milliseconds to wait for announced Data before it's requested with a Graft.
+PLUMTREE_GRAFT_TIMEOUT = 500
+
+# The maximum number of announcements in one IHave message.
+PLUMTREE_IHAVE_BATCH = 8
+
+# The maximum number of announced Data we wait for.
+PLUMTREE_MAX_MISSING = 256
+
+# Keep only a partial view of the cluster (HyParView): a small active view
+# the messages are spread to, and a larger passive view of backup members.
+# Every node of the cluster must enable it.
+PARTIAL_VIEW = False
+
+# The maximum number of members in the active and passive views.
+PARTIAL_VIEW_ACTIVE_SIZE = 5
+PARTIAL_VIEW_PASSIVE_SIZE = 30
+
+# The length of the random walk of a ForwardJoin, and the hop of the walk
+# at which the joining member is added to the passive view.
+PARTIAL_VIEW_ACTIVE_WALK = 6
+PARTIAL_VIEW_PASSIVE_WALK = 3
+
+# The interval in milliseconds between shuffles of the passive view, and
+# the number of active and passive members sent in a shuffle.
+PARTIAL_VIEW_SHUFFLE_INTERVAL = 5000
+PARTIAL_VIEW_SHUFFLE_ACTIVE = 3
+PARTIAL_VIEW_SHUFFLE_PASSIVE = 4
+
+# Pack several messages for the same recipient into a single datagram.
+MESSAGE_COALESCING = True
+
 # The maximum number of unique messages that can be stored in the outbound message queue.
 MAX_OUTPUT_MESSAGES   = 100
 
+# What to do with a new message when the outbound message queue is full:
+# drop the oldest queued Data or Status message, drop the oldest of the
+# lower priority messages, or reject the new message.
+OVERFLOW_DROP_OLDEST_RUMOR = 0
+OVERFLOW_DROP_LOWEST_PRIORITY = 1
+OVERFLOW_REJECT = 2
+OUTPUT_OVERFLOW_POLICY = OVERFLOW_DROP_LOWEST_PRIORITY
+
+# The maximum number of datagrams read from the socket in one batched receive.
+RECEIVE_BATCH_SIZE = 64
+
+# How the received payloads get to 'data_receiver': called right in the
+# message handler, or queued for worker threads or an asyncio task. A full
+# queue makes the node refuse new Data, so the senders retry it later.
+DELIVERY_INLINE = 0
+DELIVERY_THREADS = 1
+DELIVERY_ASYNCIO = 2
+DELIVERY_MODE = DELIVERY_INLINE
+
+# The maximum number of payloads waiting for 'data_receiver'.
+DELIVERY_QUEUE_SIZE = 1024
+
+# The maximum number of payloads per 'data_receiver' call. Above 1, the
+# receiver is called with a list of payloads.
+DELIVERY_BATCH_SIZE = 1
+
+# The number of worker threads of 'DELIVERY_THREADS'.
+DELIVERY_WORKERS = 1
+
 # The time interval in milliseconds that determines how often the Gossip tick event should be triggered.
 GOSSIP_TICK_INTERVAL  = 1000
 
@@ -29,7 +228,12 @@ MAX_MEMBER_ADDRESS_SIZE = len(MULTI_ADDR_FORMAT)
 CLUSTER_MEMBER_SIZE = (4 + 4 + MAX_MEMBER_ADDRESS_SIZE)
 
 # Membership list can grop really big.
-MEMBER_LIST_SYNC_SIZE = (MESSAGE_MAX_SIZE / CLUSTER_MEMBER_SIZE)
+MEMBER_LIST_SYNC_SIZE = (MESSAGE_MAX_SIZE - 8 - 4) // CLUSTER_MEMBER_SIZE
+
+# The time in milliseconds a seed collects newcomers before it announces
+# them together and sends them a shared member list snapshot, 0 to handle
+# every Hello right away.
+JOIN_BATCH_WINDOW = 100
 
 DATA_LOG_SIZE  = 25
 
@@ -41,4 +245,8 @@ GOSSIP_BROADCAST = 2
 
 FORMAT = 'utf-8'
 
-LOG_FORMATTING = '%(asctime)-15s [%(levelname)s] %(message)s'
\ No newline at end of file
+LOG_FORMATTING = '%(asctime)-15s [%(levelname)s] %(message)s'
+
+# Log every message sent, received and handled at the INFO level. It's
+# costly on the hot path, 'GossipService.metrics' counts the same traffic.
+LOG_MESSAGES = False
\ No newline at end of file
@@ -8,7 +8,8 @@ import member_address
 class DataLogRecord:
     def __init__(self):
         self.version = vector_clock.VectorRecord()
-        self.data = []
+        self.data = b''
+        self.buffers = {}  # map<wire version, encoded Data message>
 
     def create_data_message(self):
         data = message.Data(message.MESSAGE_DATA_TYPE, 0)
@@ -23,19 +24,29 @@ class DataLog:
         self.records = []  # DataLogRecord
         self.current_idx = 0
 
+    def find_by_member_id(self, member_id):
+        for record in self.records:
+            if (record.version.member_id == member_id):
+                return record
+
+        return False
+
+    # Returns the record holding the data message.
     def add_data_log(self, data_message):
         for record in self.records:
             if (record.version.member_id == data_message.data_version.member_id):
                 # Save only the latest data message from each originator.
                 record.data = data_message.data
                 record.version.sequence_number = data_message.data_version.sequence_number
-                return
+                record.buffers = {}
+                return record
 
         # The data message with the same originator was not found.
         record = DataLogRecord()
         record.data = data_message.data
         record.version.copy(data_message.data_version)
         self.records.append(record)
+        return record
 
 
 def test():
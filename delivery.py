@@ -0,0 +1,179 @@
+import asyncio
+import inspect
+import queue
+import threading
+
+import config
+
+# The base of the queued deliveries. Payloads accepted by the node wait in
+# a queue of at most 'capacity' payloads for the consumer, which calls
+# 'receiver' with a single payload, or with a list of up to 'batch_size'
+# payloads when 'batch_size' is above 1. The node checks 'is_full' before
+# it accepts new data, so a consumer which falls behind slows the senders
+# down instead of losing data.
+class Delivery:
+    def __init__(self, receiver, capacity, batch_size):
+        self.receiver = receiver
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.counters = {
+            'queued': 0,        # payloads accepted for delivery
+            'delivered': 0,     # payloads passed to the receiver
+            'batches': 0,       # receiver calls
+            'errors': 0,        # receiver calls which raised an exception
+            'backpressure': 0,  # new payloads refused because the queue was full
+            'peak': 0,          # the deepest the queue got
+        }
+
+    def __len__(self):
+        return 0
+
+    def is_full(self):
+        return len(self) >= self.capacity
+
+    # Queue the payload for the receiver. Returns False if the queue is full.
+    def offer(self, payload):
+        return False
+
+    # The node refused new data because the queue was full.
+    def refused(self):
+        self.counters['backpressure'] += 1
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['depth'] = len(self)
+        stats['capacity'] = self.capacity
+        return stats
+
+    def close(self):
+        pass
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    # Count the batch and pass it to the receiver.
+    def deliver(self, batch):
+        self.count('batches')
+        self.count('delivered', len(batch))
+        return self.receiver(batch if self.batch_size > 1 else batch[0])
+
+# Delivery from a pool of 'workers' threads. The receiver must be thread-safe
+# when there are more workers than one.
+class ThreadDelivery(Delivery):
+    def __init__(self, receiver, logger, capacity=config.DELIVERY_QUEUE_SIZE, batch_size=config.DELIVERY_BATCH_SIZE,
+                 workers=config.DELIVERY_WORKERS):
+        Delivery.__init__(self, receiver, capacity, batch_size)
+        self.logger = logger
+        self.payloads = queue.Queue(capacity)
+        self.lock = threading.Lock()  # guards the counters updated by the workers
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def __len__(self):
+        return self.payloads.qsize()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def offer(self, payload):
+        try:
+            self.payloads.put_nowait(payload)
+        except queue.Full:
+            return False
+
+        self.counters['queued'] += 1  # only the node's thread updates these two
+        self.counters['peak'] = max(self.counters['peak'], len(self))
+        return True
+
+    # Take up to 'batch_size' payloads, waiting only for the first one.
+    def work(self):
+        while True:
+            batch = [self.payloads.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.payloads.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopped = batch[-1] is None
+            if stopped:
+                batch.pop()
+            if batch:
+                try:
+                    self.deliver(batch)
+                except Exception as e:
+                    self.count('errors')
+                    self.logger.warning('[ThreadDelivery] Data receiver failed. %s', str(e))
+            if stopped:
+                return
+
+    # Deliver the queued payloads, then stop the workers.
+    def close(self):
+        for _ in self.workers:
+            self.payloads.put(None)
+        for worker in self.workers:
+            worker.join()
+
+# Delivery from an asyncio task on the running event loop. The receiver may
+# be a coroutine function, the next batch waits until it returns. All calls
+# have to be made from the event loop thread, as with 'GossipService.run'.
+# The consumer task starts right away, so the delivery has to be created
+# on the running loop, a node driven by a 'select' loop can't use it.
+class AsyncioDelivery(Delivery):
+    def __init__(self, receiver, logger, capacity=config.DELIVERY_QUEUE_SIZE, batch_size=config.DELIVERY_BATCH_SIZE):
+        Delivery.__init__(self, receiver, capacity, batch_size)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError('DELIVERY_ASYNCIO needs a running event loop, '
+                               'create the GossipService from a coroutine and drive it with run()') from None
+
+        self.logger = logger
+        self.payloads = asyncio.Queue(capacity)
+        self.task = loop.create_task(self.work())
+
+    def __len__(self):
+        return self.payloads.qsize()
+
+    def offer(self, payload):
+        try:
+            self.payloads.put_nowait(payload)
+        except asyncio.QueueFull:
+            return False
+
+        self.counters['queued'] += 1  # only the node's thread updates these two
+        self.counters['peak'] = max(self.counters['peak'], len(self))
+        return True
+
+    async def work(self):
+        while True:
+            batch = [await self.payloads.get()]
+            while len(batch) < self.batch_size and not self.payloads.empty():
+                batch.append(self.payloads.get_nowait())
+
+            try:
+                result = self.deliver(batch)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.count('errors')
+                self.logger.warning('[AsyncioDelivery] Data receiver failed. %s', str(e))
+
+    # Stop the consumer, the payloads still queued are not delivered.
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+# The delivery for the 'mode', None for the inline delivery.
+def create(mode, receiver, logger):
+    if receiver is None or mode == config.DELIVERY_INLINE:
+        return None
+    if mode == config.DELIVERY_THREADS:
+        return ThreadDelivery(receiver, logger)
+    if mode == config.DELIVERY_ASYNCIO:
+        return AsyncioDelivery(receiver, logger)
+
+    raise ValueError(f'Unknown delivery mode {mode}')
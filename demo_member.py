@@ -5,14 +5,16 @@ import sys
 import config
 import util
 import service
+import state
 
 class DemoMember:
-    def __init__(self, my_address, seed_addresses, log_file):
+    def __init__(self, my_address, seed_addresses, log_file, logger=None):
         self.my_address = my_address
         self.seed_addresses = seed_addresses
-        self.logger = util.create_logger(config.LOG_FORMATTING, log_file)
+        self.logger = logger or util.create_logger(config.LOG_FORMATTING, log_file)
         self.poll_interval = config.GOSSIP_TICK_INTERVAL
         self.gossip_daemon = None
+        self.running = True  # the run-loop exits once it's cleared
 
     def data_receiver(self, data):
         pass
@@ -53,8 +55,8 @@ class DemoMember:
         # Retrieve the socket descriptor.
         daemon_fd = self.gossip_daemon.socket_fd()
 
-        # infinite loop to perform I/O:
-        while True:
+        # loop to perform I/O till the member is told to stop:
+        while self.running:
             endpoints = [daemon_fd]
             poll_internal_in_seconds = self.poll_interval / 1000
             read, _, error = select.select(endpoints, [], [], poll_internal_in_seconds)
@@ -62,9 +64,9 @@ class DemoMember:
             for sock in read:
                 if sock is daemon_fd:
                     try:
-                        # Tell server to read a message from the socket.
-                        recv_result = self.gossip_daemon.receive()
-                        if not recv_result:
+                        # Tell server to read all pending messages from the socket.
+                        recv_result = self.gossip_daemon.receive_batch()
+                        if recv_result is False:
                             self.logger.warning("Receive failed.")
                             return False
 
@@ -76,18 +78,21 @@ class DemoMember:
                 self.logger.warning("Socket closed - %s.", sock)
                 sock.close() 
 
-            # Try to trigger the Gossip tick event and recalculate
-            # the poll interval.
-            self.poll_interval = self.gossip_daemon.tick()
-            if (self.poll_interval < 0):
-                self.logger.warning('Poll interval has expired.')
-                return False
+            # Try to trigger the Gossip tick event.
+            if self.gossip_daemon.current_state() == state.STATE_CONNECTED:
+                self.gossip_daemon.tick()
 
-            # Just call before send takes place.
+            # Just call before send takes place. The helper may shorten
+            # the poll interval.
+            self.poll_interval = config.GOSSIP_TICK_INTERVAL
             self.run_helper()
 
             # Tell service to write existing messages to the socket.
             send_result = self.gossip_daemon.send()
-            if not send_result:
+            if send_result is False:
                 self.logger.warning('Send has failed %s', send_result)
                 # return False
+
+            # Sleep till the next deadline of the service: the Gossip tick,
+            # a retransmission, a probe timeout or the join batch window.
+            self.poll_interval = min(self.poll_interval, self.gossip_daemon.time_till_next_event())
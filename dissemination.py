@@ -0,0 +1,76 @@
+import collections
+import math
+
+import config
+
+# The news about a member waiting to be piggybacked, see 'message.MemberState'.
+class MembershipEvent:
+    def __init__(self, member_state, news_member, incarnation, sequence_num):
+        self.member_state = member_state
+        self.member = news_member
+        self.incarnation = incarnation
+        self.sequence_num = sequence_num
+        self.transmissions = 0  # datagrams the event was piggybacked on
+        self.buffers = {}       # map<wire version, encoded MemberState message>
+
+# Dissemination buffer of the membership events (infection style, as in
+# SWIM). The events ride along the datagrams sent anyway, the ones sent
+# the fewest times first, and every event is dropped after it was sent
+# 'retransmit_factor' times log10 of the cluster size. A newer event
+# about a member replaces the older one. The events are kept in buckets
+# by their transmission count, so the next candidates are found without
+# sorting all events for every datagram.
+class DisseminationBuffer:
+    def __init__(self, retransmit_factor=config.PIGGYBACK_RETRANSMIT_FACTOR, max_events=config.PIGGYBACK_MAX_EVENTS):
+        self.retransmit_factor = retransmit_factor
+        self.max_events = max_events
+        self.events = collections.OrderedDict()  # map<address key, MembershipEvent>, oldest first
+        self.buckets = {}  # map<transmissions, OrderedDict<address key, MembershipEvent>>
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, member_state, news_member, incarnation, sequence_num):
+        address_key = news_member.address.key()
+        replaced = self.events.pop(address_key, None)
+        if replaced is not None:
+            self.unbucket(address_key, replaced)
+
+        event = self.events[address_key] = MembershipEvent(member_state, news_member, incarnation, sequence_num)
+        self.buckets.setdefault(0, collections.OrderedDict())[address_key] = event
+        while len(self.events) > self.max_events:
+            self.unbucket(*self.events.popitem(last=False))
+
+    # The events to piggyback, the ones sent the fewest times first. The
+    # events are yielded lazily, so the caller stops when the datagram is
+    # full, and must not call 'transmitted' before it's done iterating.
+    def candidates(self):
+        for transmissions in sorted(self.buckets):
+            yield from self.buckets[transmissions].values()
+
+    # The event was piggybacked on a datagram in a cluster of 'members_num' members.
+    def transmitted(self, event, members_num):
+        address_key = event.member.address.key()
+        if self.events.get(address_key) is not event:
+            event.transmissions += 1
+            return
+
+        self.unbucket(address_key, event)
+        event.transmissions += 1
+        if event.transmissions >= self.retransmit_limit(members_num):
+            del self.events[address_key]
+        else:
+            self.buckets.setdefault(event.transmissions, collections.OrderedDict())[address_key] = event
+
+    def unbucket(self, address_key, event):
+        bucket = self.buckets[event.transmissions]
+        del bucket[address_key]
+        if not bucket:
+            del self.buckets[event.transmissions]
+
+    def retransmit_limit(self, members_num):
+        return self.retransmit_factor * max(1, math.ceil(math.log10(members_num + 1)))
+
+    def clear(self):
+        self.events.clear()
+        self.buckets.clear()
@@ -11,10 +11,15 @@ class MessageEnvolopeOut:
                  sequence_number,
                  buffer,
                  max_attempts,
-                 recipient):
+                 recipient,
+                 message_type=0,
+                 priority=0):
         self.sequence_num = sequence_number
         self.attempt_num = 0
         self.attempt_ts = 0
+        self.deadline = 0  # when the message is due next
         self.buffer = buffer
         self.recipient = recipient
         self.max_attempts = max_attempts
+        self.message_type = message_type
+        self.priority = priority  # see message_queue.message_priority
@@ -0,0 +1,192 @@
+import heapq
+import random
+
+import config
+
+# Member states of the failure detector, see 'message.MemberState'.
+MEMBER_ALIVE = 1
+MEMBER_SUSPECT = 2
+MEMBER_DEAD = 3
+
+class MemberHealth:
+    def __init__(self, incarnation=0, state=MEMBER_ALIVE):
+        self.incarnation = incarnation
+        self.state = state
+        self.deadline = 0  # when a suspect member is declared dead, or a dead one forgotten
+
+# The probe of a member in the current protocol period.
+class Probe:
+    def __init__(self, target, sequence_num, start_ts):
+        self.target = target                  # address of the probed member
+        self.sequence_nums = {sequence_num}   # Ping and PingReq messages, any ack will do
+        self.start_ts = start_ts
+        self.indirect = False                 # PingReq messages were sent
+        self.acked = False
+
+# SWIM failure detector (Das et al.). Every protocol period one member,
+# picked in a randomized round-robin order, is pinged. If it doesn't answer
+# in time, a few other members are asked to ping it (PingReq). A member
+# without an answer till the end of the period becomes a suspect, and it's
+# declared dead unless it refutes the suspicion in time with a higher
+# incarnation number. A dead member is kept as a tombstone for
+# 'tombstone_timeout', only news with a higher incarnation revives it.
+class FailureDetector:
+    def __init__(self,
+                 probe_interval=config.SWIM_PROBE_INTERVAL,
+                 ping_timeout=config.SWIM_PING_TIMEOUT,
+                 indirect_probes=config.SWIM_INDIRECT_PROBES,
+                 suspect_timeout=config.SWIM_SUSPECT_TIMEOUT,
+                 tombstone_timeout=config.SWIM_TOMBSTONE_TIMEOUT):
+        self.probe_interval = probe_interval
+        self.ping_timeout = ping_timeout
+        self.indirect_probes = indirect_probes
+        self.suspect_timeout = suspect_timeout
+        self.tombstone_timeout = tombstone_timeout
+
+        self.incarnation = 0    # incarnation number of this node
+        self.health = {}        # map<address key, MemberHealth>
+        self.deadlines = []     # heap of (deadline, address key) of the suspects and tombstones, stale entries are skipped
+        self.probe = None       # Probe of the current period
+        self.next_probe_ts = 0  # start of the next protocol period
+        self.probe_order = []   # addresses left to probe in this round
+        self.relays = {}        # map<sequence number, (requester address, requester sequence number, ts)>
+
+    # The next member to probe. Every round visits the members, of at
+    # least 'min_version', in a new random order.
+    def next_target(self, members, min_version):
+        while True:
+            if not self.probe_order:
+                self.probe_order = [member.address for member in members.get_set() if member.version >= min_version]
+                random.shuffle(self.probe_order)
+                if not self.probe_order:
+                    return None
+
+            address = self.probe_order.pop()
+            if members.find_by_addr(address):
+                return address
+
+    def start_probe(self, target, sequence_num, current_ts):
+        self.probe = Probe(target, sequence_num, current_ts)
+        self.next_probe_ts = current_ts + self.probe_interval
+
+    # The ping to the probed member timed out.
+    def is_ping_late(self, current_ts):
+        return (self.probe is not None and not self.probe.acked and not self.probe.indirect and
+                current_ts >= self.probe.start_ts + self.ping_timeout)
+
+    # The probed member didn't answer during the protocol period.
+    def is_probe_failed(self, current_ts):
+        return (self.probe is not None and not self.probe.acked and
+                current_ts >= self.probe.start_ts + self.probe_interval)
+
+    # Our Ping sent on behalf of another member (PingReq).
+    def add_relay(self, sequence_num, requester, requester_sequence_num, current_ts):
+        self.relays[sequence_num] = (requester, requester_sequence_num, current_ts)
+        for relay_sequence_num, relay in list(self.relays.items()):
+            if relay[2] + self.probe_interval < current_ts:
+                del self.relays[relay_sequence_num]
+
+    # An ack of the message 'sequence_num' arrived. Returns the requester
+    # and its sequence number, if the ack is for a relayed Ping.
+    def acknowledge(self, sequence_num):
+        if self.probe is not None and sequence_num in self.probe.sequence_nums:
+            self.probe.acked = True
+
+        relay = self.relays.pop(sequence_num, None)
+        if relay is None:
+            return None
+
+        return relay[0], relay[1]
+
+    def health_of(self, address_key):
+        return self.health.get(address_key) or MemberHealth()
+
+    def is_dead(self, address_key):
+        health = self.health.get(address_key)
+        return health is not None and health.state == MEMBER_DEAD
+
+    def set_deadline(self, address_key, health, deadline):
+        health.deadline = deadline
+        heapq.heappush(self.deadlines, (deadline, address_key))
+
+    # The heap entry is the current deadline of a suspect or tombstone.
+    def is_pending(self, deadline, address_key):
+        health = self.health.get(address_key)
+        return health is not None and health.state != MEMBER_ALIVE and health.deadline == deadline
+
+    # Apply the news about the member's 'state' with the 'incarnation'.
+    # Returns True if the news changed what we know about the member.
+    def update(self, address_key, state, incarnation, current_ts):
+        health = self.health.get(address_key)
+        if health is None:
+            health = self.health[address_key] = MemberHealth(incarnation)
+            if state == MEMBER_ALIVE:
+                return True
+
+        if state == MEMBER_ALIVE:
+            if incarnation <= health.incarnation:
+                return False
+
+            health.incarnation = incarnation
+            health.state = MEMBER_ALIVE
+            return True
+
+        if state == MEMBER_SUSPECT:
+            if (incarnation < health.incarnation or
+                (incarnation == health.incarnation and health.state != MEMBER_ALIVE)):
+                return False
+
+            health.incarnation = incarnation
+            health.state = MEMBER_SUSPECT
+            self.set_deadline(address_key, health, current_ts + self.suspect_timeout)
+            return True
+
+        if state == MEMBER_DEAD:
+            if (incarnation < health.incarnation or
+                (incarnation == health.incarnation and health.state == MEMBER_DEAD)):
+                return False
+
+            health.incarnation = incarnation
+            health.state = MEMBER_DEAD
+            self.set_deadline(address_key, health, current_ts + self.tombstone_timeout)
+            return True
+
+        return False
+
+    # The addresses of the suspects which didn't refute the suspicion in
+    # time. The expired tombstones are forgotten on the way.
+    def expired_suspects(self, current_ts):
+        expired = []
+        while self.deadlines and self.deadlines[0][0] <= current_ts:
+            deadline, address_key = heapq.heappop(self.deadlines)
+            if not self.is_pending(deadline, address_key):
+                continue
+
+            if self.health[address_key].state == MEMBER_SUSPECT:
+                expired.append(address_key)
+            else:
+                del self.health[address_key]
+
+        return expired
+
+    # Forget the member, but keep its tombstone if it's dead.
+    def remove(self, address_key):
+        if not self.is_dead(address_key):
+            self.health.pop(address_key, None)
+        if self.probe is not None and self.probe.target.key() == address_key:
+            self.probe = None
+
+    # The time of the next probe step or suspicion timeout.
+    def next_deadline(self):
+        deadlines = [self.next_probe_ts]
+        if self.probe is not None and not self.probe.acked:
+            if not self.probe.indirect:
+                deadlines.append(self.probe.start_ts + self.ping_timeout)
+            deadlines.append(self.probe.start_ts + self.probe_interval)
+
+        while self.deadlines and not self.is_pending(*self.deadlines[0]):
+            heapq.heappop(self.deadlines)
+        if self.deadlines:
+            deadlines.append(self.deadlines[0][0])
+
+        return min(deadlines)
@@ -1,6 +1,8 @@
+import collections
 import random
 
 import util
+import codec
 import config
 import member_address
 
@@ -9,10 +11,10 @@ MEMBERS_EXTENSION_FACTOR = 2
 MEMBERS_LOAD_FACTOR = 0.75
 
 class Member:
-    def __init__(self, uid=0, version=config.PROTOCOL_VERSION, address=member_address.Address()):
-        self.version = config.PROTOCOL_VERSION
+    def __init__(self, uid=0, version=config.PROTOCOL_VERSION, address=None):
+        self.version = version
         self.uid = uid
-        self.address = address
+        self.address = address if address is not None else member_address.Address()
 
     def copy(self, member):
         member.version = self.version
@@ -40,13 +42,28 @@ class Member:
         composit_encoded_message = encoded_version + encoded_uid + encoded_address
         return composit_encoded_message
 
+    def decode_binary(self, buffer):
+        self.version, offset = codec.decode_varint(buffer, 0)
+        self.uid, offset = codec.decode_varint(buffer, offset)
+        offset += self.address.decode_binary(buffer[offset:])
+        return offset
+
+    def encode_binary(self):
+        return (codec.encode_varint(self.version) +
+                codec.encode_varint(self.uid) +
+                self.address.encode_binary())
+
     @staticmethod
     def create(address):
-        return Member(uid=util.get_time()/1000, address=address)
+        # The uid is the start time in seconds, it must fit into a 4-byte field.
+        return Member(uid=int(util.get_time() / 1000) % 10000, address=address)
 
 class MemberList:
     def __init__(self):
-        self.set = []
+        self.set = []          # Member, in no particular order
+        self.positions = {}    # map<address key, index in set>
+        self.identities = {}   # map<(uid, address key), Member>
+        self.versions = collections.Counter()  # map<protocol version, members>
 
     def get_set(self):
         return self.set
@@ -54,6 +71,10 @@ class MemberList:
     def get_size(self):
         return len(self.set)
 
+    # The lowest protocol version of the members, None without members.
+    def min_version(self):
+        return min(self.versions) if self.versions else None
+
     def encode(self):
         encoded_size = bytes(f'{self.get_size():>04}', config.FORMAT)    # 4-byte
         composit_encoded_message = encoded_size
@@ -73,48 +94,90 @@ class MemberList:
             i += 1
             member = Member()
             offset += member.decode(buffer[offset:])
-            self.set.append(member)
+            self.put([member])
 
         return offset
 
-    def put(self, new_members):
-        members = []
+    def encode_binary(self):
+        composit_encoded_message = codec.encode_varint(self.get_size())
+        for member in self.set:
+            composit_encoded_message += member.encode_binary()
+
+        return composit_encoded_message
+
+    def decode_binary(self, buffer):
+        size, offset = codec.decode_varint(buffer, 0)
+        for _ in range(size):
+            member = Member()
+            offset += member.decode_binary(buffer[offset:])
+            self.put([member])
 
+        return offset
+
+    def put(self, new_members):
         for new_member in new_members:
-            exists = False
-            for cur in self.set:
-                if (cur.equals(new_member)):
-                    exists = True
-                    break
-
-            if not exists:
-                members.append(new_member)
-        
-        for candidate in members:
-            self.set.append(candidate)
+            address_key = new_member.address.key()
+            identity = (new_member.uid, address_key)
+            cur = self.identities.get(identity)
+            if cur is not None:
+                # Known member, it may have been upgraded since.
+                self.count_version(cur.version, -1)
+                cur.version = new_member.version
+                self.count_version(cur.version, 1)
+                continue
+
+            position = self.positions.get(address_key)
+            if position is not None:
+                # A new uid on a known address: the node was restarted,
+                # the new instance replaces the old one.
+                old_member = self.set[position]
+                del self.identities[(old_member.uid, address_key)]
+                self.count_version(old_member.version, -1)
+                self.set[position] = new_member
+            else:
+                self.positions[address_key] = len(self.set)
+                self.set.append(new_member)
+
+            self.identities[identity] = new_member
+            self.count_version(new_member.version, 1)
+
+    def count_version(self, version, amount):
+        self.versions[version] += amount
+        if not self.versions[version]:
+            del self.versions[version]
 
     def remove(self, member):
-        exists = False
-        for cur in self.set:
-            if (cur.equals(member)):
-                exists = True
-                break
-        
-        if exists:
-            self.set.remove(member)
+        address_key = member.address.key()
+        if (member.uid, address_key) in self.identities:
+            self.remove_at(self.positions[address_key])
 
     def find_by_addr(self, addr):
-        for cur in self.set:
-            if cur.address.equals(addr):
-                return cur
-        
-        return False
+        return self.find_by_key(addr.key())
+
+    def find_by_key(self, address_key):
+        position = self.positions.get(address_key)
+        if position is None:
+            return False
+
+        return self.set[position]
 
     def remove_by_addr(self, addr):
-        for cur in self.set:
-            if cur.address.equals(addr):
-                self.set.remove(cur)
-                break
+        position = self.positions.get(addr.key())
+        if position is not None:
+            self.remove_at(position)
+
+    # Move the last member into the freed slot, so removal is O(1).
+    def remove_at(self, position):
+        member = self.set[position]
+        last = self.set.pop()
+        if last is not member:
+            self.set[position] = last
+            self.positions[last.address.key()] = position
+
+        address_key = member.address.key()
+        del self.positions[address_key]
+        del self.identities[(member.uid, address_key)]
+        self.count_version(member.version, -1)
 
     def random_members(self, count):
         if (self.get_size() == 0):
@@ -124,15 +187,10 @@ class MemberList:
         if (self.get_size() < count):
             n = self.get_size()
 
-        members = []
-        selectedIndexes = set()
-        while len(selectedIndexes) < n:
-            selectedIndexes.add(random.randint(0, self.get_size()-1))
-        
-        for i in selectedIndexes:
-            members.append(self.set[i])
-
-        return members
+        return random.sample(self.set, n)
 
     def destroy(self):
         self.set = []
+        self.positions = {}
+        self.identities = {}
+        self.versions = collections.Counter()
@@ -1,3 +1,4 @@
+import codec
 import config
 import util
 
@@ -9,6 +10,9 @@ class Address:
     def equals(self, other):
         return self.ip == other.ip and self.port == other.port
 
+    def key(self):
+        return (self.ip, self.port)
+
     def copy(self, other):
         self.ip = other.ip
         self.port = other.port
@@ -24,10 +28,19 @@ class Address:
         addr_length = int(buffer[:4].decode(config.FORMAT).strip()) # 4-bytes
         multi_addr = buffer[4:addr_length+4].decode(config.FORMAT)  # addr_length-bytes
         address = Address.from_multiaddr(multi_addr)
+        if not address:
+            raise ValueError(f'invalid address {multi_addr!r}')
         self.ip = address.ip
         self.port = address.port
         return addr_length + 4
 
+    def encode_binary(self):
+        return codec.encode_address(self.ip, self.port)
+
+    def decode_binary(self, buffer):
+        self.ip, self.port, offset = codec.decode_address(buffer, 0)
+        return offset
+
     def to_string(self):
         return f'{self.ip}:{self.port}'
 
@@ -1,3 +1,6 @@
+import struct
+
+import codec
 import config
 import vector_clock
 import member_address
@@ -10,10 +13,78 @@ MESSAGE_MEMBER_LIST_TYPE = 0x03
 MESSAGE_ACK_TYPE = 0x04
 MESSAGE_DATA_TYPE = 0x05
 MESSAGE_STATUS_TYPE = 0x06
+MESSAGE_BUNDLE_TYPE = 0x07
+MESSAGE_SACK_TYPE = 0x08
+MESSAGE_IHAVE_TYPE = 0x09
+MESSAGE_GRAFT_TYPE = 0x0A
+MESSAGE_PRUNE_TYPE = 0x0B
+MESSAGE_PING_TYPE = 0x0C
+MESSAGE_PING_REQ_TYPE = 0x0D
+MESSAGE_MEMBER_STATE_TYPE = 0x0E
+MESSAGE_VIEW_TYPE = 0x0F
+
+# Message type names, used by the metrics.
+MESSAGE_TYPE_NAMES = {
+    MESSAGE_HELLO_TYPE: 'hello',
+    MESSAGE_WELCOME_TYPE: 'welcome',
+    MESSAGE_MEMBER_LIST_TYPE: 'member_list',
+    MESSAGE_ACK_TYPE: 'ack',
+    MESSAGE_DATA_TYPE: 'data',
+    MESSAGE_STATUS_TYPE: 'status',
+    MESSAGE_BUNDLE_TYPE: 'bundle',
+    MESSAGE_SACK_TYPE: 'sack',
+    MESSAGE_IHAVE_TYPE: 'ihave',
+    MESSAGE_GRAFT_TYPE: 'graft',
+    MESSAGE_PRUNE_TYPE: 'prune',
+    MESSAGE_PING_TYPE: 'ping',
+    MESSAGE_PING_REQ_TYPE: 'ping_req',
+    MESSAGE_MEMBER_STATE_TYPE: 'member_state',
+    MESSAGE_VIEW_TYPE: 'view',
+}
 
 MESSAGE_MIN_SIZE = 8
 MESSAGE_MAX_SIZE = 1024
 
+# 1-byte type, at least 1-byte reserved and 1-byte sequence number.
+MESSAGE_BINARY_MIN_SIZE = 3
+
+# Sequence numbers must fit into the 4-byte text field while any peer
+# speaks the text codec.
+MESSAGE_MAX_SEQUENCE_NUM = 9999
+
+# Sequence numbers of the binary codec, a varint of at most 5 bytes.
+MESSAGE_MAX_BINARY_SEQUENCE_NUM = 0xFFFFFFFF
+
+# Status 'reserved' flag: the message carries only a part of the vector clock.
+STATUS_FLAG_DELTA = 0x01
+
+# Status 'reserved' flag: the message carries the vector clock digest instead of the clock.
+STATUS_FLAG_DIGEST = 0x02
+
+# Status 'reserved' flag: the message carries all records of the buckets in its mask.
+STATUS_FLAG_BUCKETS = 0x04
+
+# Ack 'reserved' flag: the acknowledged Data message was a duplicate, the rumor is getting old.
+ACK_FLAG_DUPLICATE = 0x01
+
+# Sack 'reserved' flag: the message carries the ranges of duplicate Data messages.
+SACK_FLAG_DUPLICATES = 0x01
+
+# Data 'reserved' field counts the hops of the data, it must fit into the 2-byte text field.
+DATA_MAX_HOPS = 99
+
+DIGEST_FORMAT = struct.Struct(f'!{vector_clock.DIGEST_BUCKETS}I')  # 4-bytes per bucket
+
+# Header + 4-byte number of messages.
+BUNDLE_HEADER_SIZE = MESSAGE_MIN_SIZE + 4
+
+# 4-byte size in front of every bundled message.
+BUNDLE_ENTRY_HEADER_SIZE = 4
+
+# Header + 4-byte number of ranges (twice with duplicates), then 4-byte
+# first and last sequence number per range.
+SACK_MAX_RANGES = (config.MESSAGE_MAX_SIZE - MESSAGE_MIN_SIZE - 8) // 8
+
 class Message:
     def __init__(self, message_type, sequence_num):
         self.message_type = message_type
@@ -21,17 +92,28 @@ class Message:
         self.sequence_num = sequence_num
 
     def decode(self, buffer):
-        self.message_type = int(buffer[:2].decode(config.FORMAT).strip()) # 2-byte
-        self.reserved = int(buffer[2:4].decode(config.FORMAT).strip())    # 2-bytes
-        self.sequence_num = int(buffer[4:8].decode(config.FORMAT).strip()) # 4-bytes
+        self.message_type = int(str(buffer[:2], config.FORMAT).strip()) # 2-byte
+        self.reserved = int(str(buffer[2:4], config.FORMAT).strip())    # 2-bytes
+        self.sequence_num = int(str(buffer[4:8], config.FORMAT).strip()) # 4-bytes
         return 2 + 2 + 4
 
     def encode(self):
         encoded_message_type = bytes(f'{self.message_type:>02}', config.FORMAT)  # 2-byte
         encoded_reserved = bytes(f'{self.reserved:>02}', config.FORMAT)          # 2-byte
-        encoded_sequence_num = bytes(f'{self.sequence_num:>04}', config.FORMAT)  # 4-byte
+        encoded_sequence_num = codec.encode_text_number(self.sequence_num)  # 4-byte
         return encoded_message_type + encoded_reserved + encoded_sequence_num
 
+    def decode_binary(self, buffer):
+        self.message_type = buffer[0] & ~codec.BINARY_MARKER                # 1-byte
+        self.reserved, offset = codec.decode_varint(buffer, 1)            # varint
+        self.sequence_num, offset = codec.decode_varint(buffer, offset)   # varint
+        return offset
+
+    def encode_binary(self):
+        return (bytes([codec.BINARY_MARKER | self.message_type]) +
+                codec.encode_varint(self.reserved) +
+                codec.encode_varint(self.sequence_num))
+
     def destroy(self):
         pass
     
@@ -52,6 +134,15 @@ class Hello(Message):
         bytes_decoded += self.this_member.decode(buffer[bytes_decoded:])
         return bytes_decoded
 
+    def encode_binary(self):
+        return Message.encode_binary(self) + self.this_member.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.this_member = member.Member()
+        bytes_decoded += self.this_member.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
 class Welcome(Message):
     def __init__(self, message_type, sequence_num):
         Message.__init__(self, message_type, sequence_num)
@@ -60,7 +151,7 @@ class Welcome(Message):
 
     def encode(self):
         encoded_message = Message.encode(self)
-        encoded_sequence_num = bytes(f'{self.hello_sequence_num:>04}', config.FORMAT)  # 4-byte
+        encoded_sequence_num = codec.encode_text_number(self.hello_sequence_num)  # 4-byte
         encoded_member = self.this_member.encode()
         return encoded_message + encoded_sequence_num + encoded_member
 
@@ -72,6 +163,18 @@ class Welcome(Message):
         bytes_decoded += self.this_member.decode(buffer[bytes_decoded:])
         return bytes_decoded
 
+    def encode_binary(self):
+        return (Message.encode_binary(self) +
+                codec.encode_varint(self.hello_sequence_num) +
+                self.this_member.encode_binary())
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.hello_sequence_num, bytes_decoded = codec.decode_varint(buffer, bytes_decoded)
+        self.this_member = member.Member()
+        bytes_decoded += self.this_member.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
 class MemberList(Message):
     def __init__(self, message_type, sequence_num):
         Message.__init__(self, message_type, sequence_num)
@@ -101,6 +204,23 @@ class MemberList(Message):
         
         return offset
 
+    def encode_binary(self):
+        encoded_composit_message = Message.encode_binary(self) + codec.encode_varint(len(self.members))
+        for mbr in self.members:
+            encoded_composit_message += mbr.encode_binary()
+
+        return encoded_composit_message
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        members_length, offset = codec.decode_varint(buffer, bytes_decoded)
+        for _ in range(members_length):
+            mbr = member.Member()
+            offset += mbr.decode_binary(buffer[offset:])
+            self.members.append(mbr)
+
+        return offset
+
 class Ack(Message):
     def __init__(self,message_type, sequence_num):
         Message.__init__(self, message_type, sequence_num)
@@ -108,7 +228,7 @@ class Ack(Message):
 
     def encode(self):
         encoded_message = Message.encode(self)
-        encoded_ack_sequence_num = bytes(f'{self.ack_sequence_num:>04}', config.FORMAT)  # 4-byte
+        encoded_ack_sequence_num = codec.encode_text_number(self.ack_sequence_num)  # 4-byte
         return encoded_message + encoded_ack_sequence_num
 
     def decode(self, buffer):
@@ -116,6 +236,14 @@ class Ack(Message):
         self.ack_sequence_num = int(buffer[bytes_decoded:].decode(config.FORMAT).strip()) # 4-bytes
         return bytes_decoded + 4
 
+    def encode_binary(self):
+        return Message.encode_binary(self) + codec.encode_varint(self.ack_sequence_num)
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.ack_sequence_num, bytes_decoded = codec.decode_varint(buffer, bytes_decoded)
+        return bytes_decoded
+
 class Data(Message):
     def __init__(self, message_type, sequence_num):
         Message.__init__(self, message_type, sequence_num)
@@ -125,36 +253,472 @@ class Data(Message):
     def encode(self):
         encoded_message = Message.encode(self)
         encoded_data_version = self.data_version.encode()
-        encoded_data = bytes(f'{self.data}', config.FORMAT)             
+        encoded_data = bytes(self.data)                                  # opaque payload
         encoded_data_size = bytes(f'{len(encoded_data):>04}', config.FORMAT)  # 4-byte
         return encoded_message + encoded_data_version + encoded_data_size + encoded_data
 
     def decode(self, buffer):
+        bytes_decoded = self.decode_version(buffer)
+        return self.decode_payload(buffer, bytes_decoded)
+
+    # Decode the header and the data version only.
+    # Returns the offset of the payload.
+    def decode_version(self, buffer):
         bytes_decoded = Message.decode(self, buffer)
         self.data_version = vector_clock.VectorRecord()
         bytes_decoded += self.data_version.decode(buffer[bytes_decoded:])
-        data_size = int(buffer[bytes_decoded:bytes_decoded+4].decode(config.FORMAT).strip()) # 4-bytes
-        bytes_decoded += 4
-        self.data = buffer[bytes_decoded:data_size+bytes_decoded].decode(config.FORMAT)
-        return bytes_decoded + data_size
+        return bytes_decoded
+
+    def decode_payload(self, buffer, offset):
+        data_size = int(str(buffer[offset:offset+4], config.FORMAT).strip()) # 4-bytes
+        offset += 4
+        self.data = bytes(buffer[offset:data_size+offset])
+        if len(self.data) != data_size:
+            return False  # truncated
+
+        return offset + data_size
+
+    def encode_binary(self):
+        return (Message.encode_binary(self) +
+                self.data_version.encode_binary() +
+                codec.encode_bytes(bytes(self.data)))
+
+    def decode_binary(self, buffer):
+        bytes_decoded = self.decode_version_binary(buffer)
+        return self.decode_payload_binary(buffer, bytes_decoded)
+
+    def decode_version_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.data_version = vector_clock.VectorRecord()
+        bytes_decoded += self.data_version.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+    def decode_payload_binary(self, buffer, offset):
+        self.data, offset = codec.decode_bytes(buffer, offset)
+        if offset > len(buffer):
+            return False  # truncated
+
+        return offset
 
 class Status(Message):
     def __init__(self, message_type, sequence_num):
         Message.__init__(self, message_type, sequence_num)
         self.data_version = vector_clock.VectorClock()
+        self.digest = []   # with STATUS_FLAG_DIGEST
+        self.buckets = 0   # with STATUS_FLAG_BUCKETS
 
     def encode(self):
         encoded_message = Message.encode(self)
+        if self.reserved & STATUS_FLAG_DIGEST:
+            for bucket_hash in self.digest:
+                encoded_message += bytes(f'{bucket_hash:08x}', config.FORMAT)  # 8-byte
+            return encoded_message
+
+        if self.reserved & STATUS_FLAG_BUCKETS:
+            encoded_message += bytes(f'{self.buckets:04x}', config.FORMAT)  # 4-byte
+
         encoded_data_version = self.data_version.encode()
         return encoded_message + encoded_data_version
 
     def decode(self, buffer):
         bytes_decoded = Message.decode(self, buffer)
+        if self.reserved & STATUS_FLAG_DIGEST:
+            self.digest = []
+            for _ in range(vector_clock.DIGEST_BUCKETS):
+                self.digest.append(int(str(buffer[bytes_decoded:bytes_decoded+8], config.FORMAT), 16)) # 8-bytes
+                bytes_decoded += 8
+            return bytes_decoded
+
+        if self.reserved & STATUS_FLAG_BUCKETS:
+            self.buckets = int(str(buffer[bytes_decoded:bytes_decoded+4], config.FORMAT), 16) # 4-bytes
+            bytes_decoded += 4
+
+        self.data_version = vector_clock.VectorClock()
+        bytes_decoded += self.data_version.decode(buffer[bytes_decoded:])
+        return bytes_decoded
+
+    def encode_binary(self):
+        encoded_message = Message.encode_binary(self)
+        if self.reserved & STATUS_FLAG_DIGEST:
+            return encoded_message + DIGEST_FORMAT.pack(*self.digest)
+
+        if self.reserved & STATUS_FLAG_BUCKETS:
+            encoded_message += codec.encode_varint(self.buckets)
+
+        return encoded_message + self.data_version.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        if self.reserved & STATUS_FLAG_DIGEST:
+            self.digest = list(DIGEST_FORMAT.unpack_from(buffer, bytes_decoded))
+            return bytes_decoded + DIGEST_FORMAT.size
+
+        if self.reserved & STATUS_FLAG_BUCKETS:
+            self.buckets, bytes_decoded = codec.decode_varint(buffer, bytes_decoded)
+
+        self.data_version = vector_clock.VectorClock()
+        bytes_decoded += self.data_version.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+class Bundle(Message):
+    def __init__(self, message_type, sequence_num):
+        Message.__init__(self, message_type, sequence_num)
+        self.messages = []  # encoded messages
+
+    def encode(self):
+        encoded_message = Message.encode(self)
+        encoded_messages_length = bytes(f'{len(self.messages):>04}', config.FORMAT)  # 4-byte
+        encoded_composit_message = encoded_message + encoded_messages_length
+        for buffer in self.messages:
+            encoded_size = bytes(f'{len(buffer):>04}', config.FORMAT)  # 4-byte
+            encoded_composit_message += encoded_size + buffer
+
+        return encoded_composit_message
+
+    def decode(self, buffer):
+        bytes_decoded = Message.decode(self, buffer)
+        messages_length = int(buffer[bytes_decoded:bytes_decoded+4].decode(config.FORMAT).strip()) # 4-bytes
+
+        i = 0
+        offset = bytes_decoded + 4
+        while(i < messages_length):
+            i += 1
+            size = int(buffer[offset:offset+4].decode(config.FORMAT).strip()) # 4-bytes
+            offset += 4
+            self.messages.append(buffer[offset:offset+size])
+            offset += size
+
+        return offset
+
+    def encode_binary(self):
+        encoded_composit_message = Message.encode_binary(self) + codec.encode_varint(len(self.messages))
+        for buffer in self.messages:
+            encoded_composit_message += codec.encode_bytes(buffer)
+
+        return encoded_composit_message
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        messages_length, offset = codec.decode_varint(buffer, bytes_decoded)
+        for _ in range(messages_length):
+            encoded_message, offset = codec.decode_bytes(buffer, offset)
+            self.messages.append(encoded_message)
+
+        return offset
+
+    # Split the encoded messages into datagrams of at most 'max_size' bytes.
+    # A message which doesn't fit together with others is sent as is.
+    @staticmethod
+    def pack(buffers, max_size, version=config.PROTOCOL_VERSION_MIN):
+        datagrams = []
+        pending = []
+        pending_size = BUNDLE_HEADER_SIZE
+        for buffer in buffers:
+            size = BUNDLE_ENTRY_HEADER_SIZE + len(buffer)
+            if pending and pending_size + size > max_size:
+                datagrams.append(Bundle.wrap(pending, version))
+                pending = []
+                pending_size = BUNDLE_HEADER_SIZE
+
+            pending.append(buffer)
+            pending_size += size
+
+        if pending:
+            datagrams.append(Bundle.wrap(pending, version))
+
+        return datagrams
+
+    @staticmethod
+    def wrap(buffers, version=config.PROTOCOL_VERSION_MIN):
+        if len(buffers) == 1:
+            return buffers[0]
+
+        bundle = Bundle(MESSAGE_BUNDLE_TYPE, 0)
+        bundle.messages = buffers
+        return encode_message(bundle, version)
+
+# Selective acknowledgement of several messages, as ranges of their sequence numbers.
+class Sack(Message):
+    def __init__(self, message_type, sequence_num):
+        Message.__init__(self, message_type, sequence_num)
+        self.ranges = []      # (first, last) sequence numbers, inclusive
+        self.duplicates = []  # with SACK_FLAG_DUPLICATES, ranges of duplicate Data messages
+
+    def encode(self):
+        encoded_composit_message = Message.encode(self) + self.encode_ranges(self.ranges)
+        if self.reserved & SACK_FLAG_DUPLICATES:
+            encoded_composit_message += self.encode_ranges(self.duplicates)
+
+        return encoded_composit_message
+
+    def decode(self, buffer):
+        bytes_decoded = Message.decode(self, buffer)
+        self.ranges, bytes_decoded = self.decode_ranges(buffer, bytes_decoded)
+        if self.reserved & SACK_FLAG_DUPLICATES:
+            self.duplicates, bytes_decoded = self.decode_ranges(buffer, bytes_decoded)
+
+        return bytes_decoded
+
+    def encode_binary(self):
+        encoded_composit_message = Message.encode_binary(self) + self.encode_ranges_binary(self.ranges)
+        if self.reserved & SACK_FLAG_DUPLICATES:
+            encoded_composit_message += self.encode_ranges_binary(self.duplicates)
+
+        return encoded_composit_message
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.ranges, bytes_decoded = self.decode_ranges_binary(buffer, bytes_decoded)
+        if self.reserved & SACK_FLAG_DUPLICATES:
+            self.duplicates, bytes_decoded = self.decode_ranges_binary(buffer, bytes_decoded)
+
+        return bytes_decoded
+
+    def encode_ranges(self, ranges):
+        encoded_ranges = bytes(f'{len(ranges):>04}', config.FORMAT)  # 4-byte
+        for first, last in ranges:
+            encoded_ranges += codec.encode_text_number(first) + codec.encode_text_number(last)  # 4-byte + 4-byte
+
+        return encoded_ranges
+
+    def decode_ranges(self, buffer, offset):
+        ranges = []
+        ranges_length = int(str(buffer[offset:offset+4], config.FORMAT).strip()) # 4-bytes
+        offset += 4
+        for _ in range(ranges_length):
+            first = int(str(buffer[offset:offset+4], config.FORMAT).strip())  # 4-bytes
+            last = int(str(buffer[offset+4:offset+8], config.FORMAT).strip()) # 4-bytes
+            ranges.append((first, last))
+            offset += 8
+
+        return ranges, offset
+
+    def encode_ranges_binary(self, ranges):
+        encoded_ranges = codec.encode_varint(len(ranges))
+        for first, last in ranges:
+            encoded_ranges += codec.encode_varint(first) + codec.encode_varint(last - first)
+
+        return encoded_ranges
+
+    def decode_ranges_binary(self, buffer, offset):
+        ranges = []
+        ranges_length, offset = codec.decode_varint(buffer, offset)
+        for _ in range(ranges_length):
+            first, offset = codec.decode_varint(buffer, offset)
+            length, offset = codec.decode_varint(buffer, offset)
+            ranges.append((first, first + length))
+
+        return ranges, offset
+
+    # All the acknowledged sequence numbers, paired with whether the
+    # message was a duplicate.
+    def sequence_nums(self):
+        for first, last in self.ranges:
+            for sequence_num in range(first, last + 1):
+                yield sequence_num, False
+
+        for first, last in self.duplicates:
+            for sequence_num in range(first, last + 1):
+                yield sequence_num, True
+
+    # Collapse the sequence numbers into sorted ranges of consecutive numbers.
+    @staticmethod
+    def to_ranges(sequence_nums):
+        ranges = []
+        for sequence_num in sorted(set(sequence_nums)):
+            if ranges and ranges[-1][1] + 1 == sequence_num:
+                ranges[-1] = (ranges[-1][0], sequence_num)
+            else:
+                ranges.append((sequence_num, sequence_num))
+
+        return ranges
+
+# Announcement of the Data we have, as the data versions (IHave), or
+# the request of the announced Data (Graft).
+class IHave(Message):
+    def __init__(self, message_type, sequence_num):
+        Message.__init__(self, message_type, sequence_num)
         self.data_version = vector_clock.VectorClock()
+
+    def encode(self):
+        return Message.encode(self) + self.data_version.encode()
+
+    def decode(self, buffer):
+        bytes_decoded = Message.decode(self, buffer)
         bytes_decoded += self.data_version.decode(buffer[bytes_decoded:])
         return bytes_decoded
 
+    def encode_binary(self):
+        return Message.encode_binary(self) + self.data_version.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        bytes_decoded += self.data_version.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+class Graft(IHave):
+    pass
+
+# The sender won't push Data to us anymore, only announce it.
+class Prune(Message):
+    pass
+
+# Probe of the failure detector, answered with an Ack.
+class Ping(Message):
+    pass
+
+# Request to probe the 'target' member on behalf of the sender.
+class PingReq(Message):
+    def __init__(self, message_type, sequence_num):
+        Message.__init__(self, message_type, sequence_num)
+        self.target = member_address.Address()
+
+    def encode(self):
+        return Message.encode(self) + self.target.encode()
+
+    def decode(self, buffer):
+        bytes_decoded = Message.decode(self, buffer)
+        bytes_decoded += self.target.decode(buffer[bytes_decoded:])
+        return bytes_decoded
+
+    def encode_binary(self):
+        return Message.encode_binary(self) + self.target.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        bytes_decoded += self.target.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+# The state of the member (alive, suspect or dead) in 'reserved', with
+# the incarnation number the state applies to.
+class MemberState(Message):
+    def __init__(self, message_type, sequence_num):
+        Message.__init__(self, message_type, sequence_num)
+        self.member = member.Member()
+        self.incarnation = 0
+
+    def encode(self):
+        encoded_incarnation = codec.encode_text_number(self.incarnation)  # 4-byte
+        return Message.encode(self) + encoded_incarnation + self.member.encode()
+
+    def decode(self, buffer):
+        bytes_decoded = Message.decode(self, buffer)
+        self.incarnation = int(str(buffer[bytes_decoded:bytes_decoded+4], config.FORMAT).strip()) # 4-bytes
+        bytes_decoded += 4
+        bytes_decoded += self.member.decode(buffer[bytes_decoded:])
+        return bytes_decoded
+
+    def encode_binary(self):
+        return Message.encode_binary(self) + codec.encode_varint(self.incarnation) + self.member.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = Message.decode_binary(self, buffer)
+        self.incarnation, bytes_decoded = codec.decode_varint(buffer, bytes_decoded)
+        bytes_decoded += self.member.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+# Kinds of the View message, in 'reserved'.
+VIEW_FORWARD_JOIN = 1      # 'member' joined, random walk of 'ttl' more hops
+VIEW_NEIGHBOR = 2          # asks the recipient to take the sender into its active view
+VIEW_NEIGHBOR_PRIORITY = 3 # the same, but the sender has no active members left
+VIEW_NEIGHBOR_ACCEPT = 4   # the sender took the recipient into its active view
+VIEW_NEIGHBOR_REJECT = 5   # the sender's active view is full
+VIEW_DISCONNECT = 6        # the sender dropped the recipient from its active view
+VIEW_SHUFFLE = 7           # 'members' sampled by 'member', random walk of 'ttl' more hops
+VIEW_SHUFFLE_REPLY = 8     # 'members' sampled from the sender's passive view
+
+# Partial view maintenance (HyParView). The kind of the message is in
+# 'reserved', 'member' is the joining member, the originator of a shuffle
+# or the sender itself.
+class View(MemberList):
+    def __init__(self, message_type, sequence_num):
+        MemberList.__init__(self, message_type, sequence_num)
+        self.ttl = 0
+        self.member = member.Member()
+
+    def encode(self):
+        encoded_ttl = bytes(f'{self.ttl:>04}', config.FORMAT)  # 4-byte
+        return MemberList.encode(self) + encoded_ttl + self.member.encode()
+
+    def decode(self, buffer):
+        bytes_decoded = MemberList.decode(self, buffer)
+        self.ttl = int(str(buffer[bytes_decoded:bytes_decoded+4], config.FORMAT).strip()) # 4-bytes
+        bytes_decoded += 4
+        bytes_decoded += self.member.decode(buffer[bytes_decoded:])
+        return bytes_decoded
+
+    def encode_binary(self):
+        return MemberList.encode_binary(self) + codec.encode_varint(self.ttl) + self.member.encode_binary()
+
+    def decode_binary(self, buffer):
+        bytes_decoded = MemberList.decode_binary(self, buffer)
+        self.ttl, bytes_decoded = codec.decode_varint(buffer, bytes_decoded)
+        bytes_decoded += self.member.decode_binary(buffer[bytes_decoded:])
+        return bytes_decoded
+
+# Encode the message with the codec understood by the given protocol version.
+def encode_message(msg, version):
+    if version >= config.PROTOCOL_VERSION_BINARY:
+        return msg.encode_binary()
+
+    return msg.encode()
+
+# The protocol version of the codec an encoded message was encoded with.
+def wire_version(buffer):
+    if codec.is_binary(buffer):
+        return config.PROTOCOL_VERSION_BINARY
+
+    return config.PROTOCOL_VERSION_MIN
+
+# Replace the 'reserved' field in the header of an already encoded message.
+def stamp_reserved(buffer, reserved):
+    if codec.is_binary(buffer):
+        _, end = codec.decode_varint(buffer, 1)         # reserved
+        return buffer[:1] + codec.encode_varint(reserved) + buffer[end:]
+
+    return buffer[:2] + bytes(f'{reserved:>02}', config.FORMAT) + buffer[4:]
+
+# Replace the sequence number in the header of an already encoded message.
+def stamp_sequence_num(buffer, sequence_num):
+    if codec.is_binary(buffer):
+        _, offset = codec.decode_varint(buffer, 1)      # reserved
+        _, end = codec.decode_varint(buffer, offset)    # sequence number
+        return buffer[:offset] + codec.encode_varint(sequence_num) + buffer[end:]
+
+    return buffer[:4] + codec.encode_text_number(sequence_num) + buffer[8:]
+
+# Decode the message with the codec it was encoded with.
+def decode_message(msg, buffer):
+    if codec.is_binary(buffer):
+        return msg.decode_binary(memoryview(buffer))
+
+    return msg.decode(buffer)
+
+# Decode only the header and the data version of a Data message, so a
+# duplicate can be rejected before its payload is parsed. The buffer is
+# wrapped into a memoryview, slicing it doesn't copy the payload.
+# Returns the offset of the payload for 'decode_data_payload'.
+def decode_data_version(data, buffer):
+    view = memoryview(buffer)
+    if codec.is_binary(view):
+        return data.decode_version_binary(view)
+
+    return data.decode_version(view)
+
+def decode_data_payload(data, buffer, offset):
+    view = memoryview(buffer)
+    if codec.is_binary(view):
+        return data.decode_payload_binary(view, offset)
+
+    return data.decode_payload(view, offset)
+
 def decode_type(buffer):
+    if codec.is_binary(buffer):
+        if (len(buffer) < MESSAGE_BINARY_MIN_SIZE):
+            return False
+
+        return buffer[0] & ~codec.BINARY_MARKER # 1-byte
+
     if (len(buffer) < MESSAGE_MIN_SIZE):
         return False
 
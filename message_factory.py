@@ -35,4 +35,31 @@ class MessageFactory:
         if message_type == message.MESSAGE_STATUS_TYPE:
             return message.Status(message_type, sequence_number)
 
+        if message_type == message.MESSAGE_BUNDLE_TYPE:
+            return message.Bundle(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_SACK_TYPE:
+            return message.Sack(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_IHAVE_TYPE:
+            return message.IHave(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_GRAFT_TYPE:
+            return message.Graft(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_PRUNE_TYPE:
+            return message.Prune(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_PING_TYPE:
+            return message.Ping(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_PING_REQ_TYPE:
+            return message.PingReq(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_MEMBER_STATE_TYPE:
+            return message.MemberState(message_type, sequence_number)
+
+        if message_type == message.MESSAGE_VIEW_TYPE:
+            return message.View(message_type, sequence_number)
+
         return False
@@ -18,31 +18,27 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if self.gossip_service.current_state() != state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle Hello message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Hello message.')
 
         # 1. Decode the message
         hello = message.Hello(message.MESSAGE_HELLO_TYPE, 0)
-        decode_bytes = hello.decode(envelope_in.buffer)
+        decode_bytes = message.decode_message(hello, envelope_in.buffer)
         if not decode_bytes:
             return False
         
         # 2. Send back a Welcome message.
         self.gossip_service.enqueue_welcome(hello.sequence_num, envelope_in.sender)
 
-        # 3. Send the list of known members to a newcomer node.
-        if self.gossip_service.members.get_size():
-            self.gossip_service.enqueue_member_list(envelope_in.sender)
+        # With a partial view only the active view takes the newcomer,
+        # random walks introduce it to other members.
+        if self.gossip_service.partial_view:
+            return self.gossip_service.join_partial_view(hello.this_member)
 
-        # 4. Notify other nodes about a newcomer.
-        member_list_msg = message.MemberList(message.MESSAGE_MEMBER_LIST_TYPE, 0)
-        member_list_msg.members.append(hello.this_member)
-        self.gossip_service.enqueue_message(member_list_msg,
-                                            None,
-                                            config.GOSSIP_BROADCAST)
-
-        # 5. Update our local storage with a new member.
-        self.gossip_service.members.put([hello.this_member])
-        return True
+        # 3. Send the list of known members to a newcomer node, notify other
+        # nodes about a newcomer and update our local storage with it. The
+        # newcomers of the join batch window are handled together.
+        return self.gossip_service.add_newcomer(hello.this_member)
 
 
     def handle_welcome(self, envelope_in):
@@ -50,11 +46,12 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if self.gossip_service.current_state() == state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle Welcome message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Welcome message.')
 
         # 1. Decode the welcome message
         welcome = message.Welcome(message.MESSAGE_WELCOME_TYPE, 0)
-        decode_bytes = welcome.decode(envelope_in.buffer)
+        decode_bytes = message.decode_message(welcome, envelope_in.buffer)
         if not decode_bytes:
             self.logger.warning("[MessageHandler] Decode for welcome message failed.")
             return False
@@ -69,11 +66,11 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         self.gossip_service.members.put([welcome.this_member])
 
         # 3. Remove the hello message from the outbound queue.
-        env = self.gossip_service.find_envolope_by_sequence_num(welcome.sequence_num)
+        env = self.gossip_service.find_envolope_by_sequence_num(welcome.hello_sequence_num, envelope_in.sender)
         if not env:
-            self.logger.warning("[MessageHandler] Sequence number didn't match. Received %s", welcome.sequence_num)
+            self.logger.warning("[MessageHandler] Sequence number didn't match. Received %s", welcome.hello_sequence_num)
         else:
-            self.gossip_service.dequeue_envolope(env)
+            self.gossip_service.acknowledge_envolope(env)
 
         return True
 
@@ -83,18 +80,49 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if self.gossip_service.current_state() != state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle Ack message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Ack message.')
 
         # 1. Decode the membership list message
         ack = message.Ack(message.MESSAGE_ACK_TYPE, 0)
-        decoded_bytes = ack.decode(envelope_in.buffer)
+        decoded_bytes = message.decode_message(ack, envelope_in.buffer)
         if not decoded_bytes:
             return False
 
         # 2. Removing the processed message from the outbound queue.
-        ack_envelope = self.gossip_service.find_envolope_by_sequence_num(ack.ack_sequence_num)
+        ack_envelope = self.gossip_service.find_envolope_by_sequence_num(ack.ack_sequence_num, envelope_in.sender)
         if ack_envelope:
-            self.gossip_service.dequeue_envolope(ack_envelope)
+            duplicate = bool(ack.reserved & message.ACK_FLAG_DUPLICATE)
+            self.gossip_service.acknowledge_envolope(ack_envelope, duplicate)
+        else:
+            # Pings are sent once, only the failure detector waits for their acks.
+            self.handle_probe_ack(ack.ack_sequence_num)
+
+        return True
+
+
+    # Handles the acknowledgement of several messages at once
+    def handle_sack(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Sack message.')
+
+        # 1. Decode the selective acknowledgement
+        sack = message.Sack(message.MESSAGE_SACK_TYPE, 0)
+        decoded_bytes = message.decode_message(sack, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Removing all the acknowledged messages from the outbound queue.
+        for sequence_num, duplicate in sack.sequence_nums():
+            ack_envelope = self.gossip_service.find_envolope_by_sequence_num(sequence_num, envelope_in.sender)
+            if ack_envelope:
+                self.gossip_service.acknowledge_envolope(ack_envelope, duplicate)
+            else:
+                self.handle_probe_ack(sequence_num)
 
         return True
 
@@ -104,33 +132,64 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if self.gossip_service.current_state() != state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle Data message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Data message.')
 
-        # 1. Decode the data list message
+        # 1. Decode the header and the data version only,
+        #    the payload is decoded once we know the data is new.
         data = message.Data(message.MESSAGE_DATA_TYPE, 0)
-        decoded_bytes = data.decode(envelope_in.buffer)
-        if not decoded_bytes:
+        payload_offset = message.decode_data_version(data, envelope_in.buffer)
+        if not payload_offset:
             return False
 
-        # 2. Send ACK message back to sender.
-        self.gossip_service.enqueue_ack(data.sequence_num, envelope_in.sender)
+        # 2. Verify whether we saw the arrived message before. While the
+        #    delivery queue is full, new data is neither merged nor acknowledged,
+        #    so the sender retries it and the Status exchange brings it again.
+        delivery = self.gossip_service.delivery
+        res = self.gossip_service.data_version.compare_with_record(data.data_version, False)
+        if res == vector_clock.VC_BEFORE:
+            if delivery is not None and delivery.is_full():
+                delivery.refused()
+                self.gossip_service.metrics.deferred.inc()
+                return True
 
-        # 3. Verify whether we saw the arrived message before.
-        res = self.gossip_service.data_version.compare_with_record(data.data_version, True)
+            # 2a. Merge the version only once the payload is decoded, a truncated
+            #     message is neither merged nor acknowledged, so it's sent again.
+            decoded_bytes = message.decode_data_payload(data, envelope_in.buffer, payload_offset)
+            if not decoded_bytes:
+                return False
 
-        if (res == vector_clock.VC_BEFORE):
-            # 3a. Add the data to our internal log.
-            self.gossip_service.data_log.add_data_log(data)
+            self.gossip_service.data_version.compare_with_record(data.data_version, True)
+
+        # 3. Send ACK message back to sender, telling whether we already had the data.
+        duplicate = res != vector_clock.VC_BEFORE
+        self.gossip_service.enqueue_ack(data.sequence_num, envelope_in.sender, duplicate)
+
+        if self.gossip_service.rumor_tracing:
+            self.gossip_service.tracer.seen(data.data_version, data.reserved, envelope_in.sender, util.get_time())
 
-            if (self.gossip_service.data_receiver):
+        if (res == vector_clock.VC_BEFORE):
+            # 3a. Add the data to our internal log. Keep the received buffer,
+            # so the message is forwarded without being encoded again.
+            record = self.gossip_service.data_log.add_data_log(data)
+            record.buffers[message.wire_version(envelope_in.buffer)] = envelope_in.buffer
+
+            if delivery is not None:
+                # 3b. Queue the data for the data receiver callback specified by the user.
+                delivery.offer(data.data)
+            elif (self.gossip_service.data_receiver):
                 # 3b. Invoke the data receiver callback specified by the user.
                 self.gossip_service.data_receiver(data.data)
             
-            # 3c. Enqueue the same message to send it to N random members later.
-            self.gossip_service.enqueue_message(data,
-                                                None,
-                                                config.GOSSIP_RANDOM)
-        
+            # 3c. Spread the same message to random members.
+            self.gossip_service.rumor_counters['received'] += 1
+            self.gossip_service.enqueue_rumor(record, data.reserved, envelope_in.sender)
+        else:
+            self.gossip_service.rumor_counters['duplicates'] += 1
+            if self.gossip_service.epidemic_tree:
+                # 3d. The sender is a redundant link of the broadcast tree.
+                self.gossip_service.prune_tree_peer(envelope_in.sender)
+
         return True
 
 
@@ -139,17 +198,24 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if self.gossip_service.current_state() != state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle Status message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Status message.')
 
         # 1. Decode the status message
         status = message.Status(message.MESSAGE_STATUS_TYPE, 0)
-        decoded_bytes = status.decode(envelope_in.buffer)
+        decoded_bytes = message.decode_message(status, envelope_in.buffer)
         if not decoded_bytes:
             return False
 
         # 2. Acknowledge the arrived Status message.
         self.gossip_service.enqueue_ack(status.sequence_num, envelope_in.sender)
 
+        if status.reserved & message.STATUS_FLAG_DIGEST:
+            return self.handle_status_digest(status, envelope_in.sender)
+
+        if status.reserved & message.STATUS_FLAG_DELTA:
+            return self.handle_status_delta(status, envelope_in.sender)
+
         result = self.gossip_service.data_version.compare(status.data_version, False)
         if result == vector_clock.VC_AFTER:
             # The remote node is missing some of the data messages.
@@ -174,31 +240,304 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         return True
 
 
+    # A delta Status carries only some of the sender's records,
+    # the records missing from it say nothing.
+    def handle_status_delta(self, status, sender):
+        data_version = self.gossip_service.data_version
+        requested = vector_clock.VectorClock()
+        newer = False
+        for record in status.data_version.records.values():
+            found = data_version.find_by_member_id(record.member_id)
+            if not found or found.sequence_number < record.sequence_number:
+                # This node is behind, request the data with our own version.
+                sequence_number = found.sequence_number if found else 0
+                requested.add_record(vector_clock.VectorRecord(sequence_number, record.member_id))
+
+            elif found.sequence_number > record.sequence_number:
+                newer = True
+
+        if status.reserved & message.STATUS_FLAG_BUCKETS and not newer:
+            # The sender has all its records of these buckets in the message,
+            # so it misses the ones we have on top.
+            for record in data_version.records_in_buckets(status.buckets).records.values():
+                if not status.data_version.find_by_member_id(record.member_id):
+                    newer = True
+                    break
+
+        if newer:
+            # The remote node is missing some of the data messages.
+            self.gossip_service.enqueue_data_log(status.data_version, sender, True, status.buckets)
+
+        if requested.records:
+            # Send back a delta Status with the records we need.
+            self.gossip_service.enqueue_status(sender, requested)
+
+        return True
+
+
+    # A digest Status carries the hashes of the sender's clock buckets.
+    # Nodes in sync stop here, otherwise only the differing buckets are sent back.
+    def handle_status_digest(self, status, sender):
+        data_version = self.gossip_service.data_version
+        mask = data_version.digest_mask(status.digest)
+        if not mask:
+            return True
+
+        self.gossip_service.enqueue_status(sender, data_version.records_in_buckets(mask), mask)
+        return True
+
+
     # Handles the new incoming message
     def handle_member_list(self, envelope_in):
         # Proceed only if connected
         if self.gossip_service.current_state() != state.STATE_CONNECTED:
             return False
 
-        self.logger.info('[MessageHandler] Handle MemberList message.')
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle MemberList message.')
 
         # 1. Decode the membership list message
         membership_list = message.MemberList(message.MESSAGE_MEMBER_LIST_TYPE, 0)
-        decoded_bytes = membership_list.decode(envelope_in.buffer)
+        decoded_bytes = message.decode_message(membership_list, envelope_in.buffer)
         if not decoded_bytes:
             return False
 
         # 2. Update our local collection of members with arrived records.
-        self.gossip_service.members.put(membership_list.members)
+        # A member list snapshot sent to newcomers includes the recipient.
+        # With a partial view they are only backups for the active view.
+        # Members known to be dead are left out, the list may be stale.
+        detector = self.gossip_service.failure_detector
+        new_members = [new_member for new_member in membership_list.members
+                       if not new_member.address.equals(self.gossip_service.self_address) and
+                       not detector.is_dead(new_member.address.key())]
+        if self.gossip_service.partial_view:
+            for new_member in new_members:
+                self.gossip_service.view.add_passive(new_member,
+                                                     self.gossip_service.self_address,
+                                                     self.gossip_service.members)
+        else:
+            self.gossip_service.members.put(new_members)
 
         # 3. Send ACK message back to sender.
         self.gossip_service.enqueue_ack(membership_list.sequence_num, envelope_in.sender)
         return True
 
 
+    # Handles several messages packed into a single datagram
+    def handle_bundle(self, envelope_in):
+        # 1. Decode the bundle
+        bundle = message.Bundle(message.MESSAGE_BUNDLE_TYPE, 0)
+        decoded_bytes = message.decode_message(bundle, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Dispatch every message as if it arrived on its own. Bundles
+        # are never nested, a bundle inside of one is dropped unread.
+        for buffer in bundle.messages:
+            if message.decode_type(buffer) == message.MESSAGE_BUNDLE_TYPE:
+                self.logger.warning('[MessageHandler] Nested bundle from %s dropped.', envelope_in.sender.to_multiaddr())
+                continue
+
+            inner_envelope = envolope.MessageEnvolopeIn(buffer, envelope_in.sender)
+            if not self.handle_new_message(inner_envelope) and self.gossip_service.log_messages:
+                self.logger.warning('[MessageHandler] Bundled message was not handled.')
+
+        return True
+
+
+    # Handles the announcement of the Data the sender has
+    def handle_ihave(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle IHave message.')
+
+        # 1. Decode the announcement
+        ihave = message.IHave(message.MESSAGE_IHAVE_TYPE, 0)
+        decoded_bytes = message.decode_message(ihave, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Wait for the Data we don't have, and request it once it's late.
+        deadline = util.get_time() + config.PLUMTREE_GRAFT_TIMEOUT
+        for record in ihave.data_version.records.values():
+            res = self.gossip_service.data_version.compare_with_record(record, False)
+            if (res == vector_clock.VC_BEFORE):
+                self.gossip_service.plumtree.add_missing(record, envelope_in.sender, deadline)
+
+        return True
+
+
+    # Handles the request of the announced Data
+    def handle_graft(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Graft message.')
+
+        # 1. Decode the request
+        graft = message.Graft(message.MESSAGE_GRAFT_TYPE, 0)
+        decoded_bytes = message.decode_message(graft, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. The sender joins the broadcast tree through us.
+        self.gossip_service.plumtree.add_eager(envelope_in.sender)
+
+        # 3. Send the requested Data we have.
+        for requested in graft.data_version.records.values():
+            record = self.gossip_service.data_log.find_by_member_id(requested.member_id)
+            if record and record.version.sequence_number >= requested.sequence_number:
+                self.gossip_service.enqueue_repair(record, envelope_in.sender)
+
+        return True
+
+
+    # Handles the request to stop pushing Data to the sender
+    def handle_prune(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Prune message.')
+        self.gossip_service.plumtree.add_lazy(envelope_in.sender)
+        return True
+
+
+    # The ack of a Ping or PingReq message. The ack of a Ping sent on
+    # behalf of another member is passed on to it.
+    def handle_probe_ack(self, sequence_num):
+        relay = self.gossip_service.failure_detector.acknowledge(sequence_num)
+        if relay is not None:
+            requester, requester_sequence_num = relay
+            self.gossip_service.enqueue_ack(requester_sequence_num, requester)
+
+
+    # Handles the probe of the failure detector
+    def handle_ping(self, envelope_in):
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle Ping message.')
+
+        # 1. Decode the ping
+        ping = message.Ping(message.MESSAGE_PING_TYPE, 0)
+        decoded_bytes = message.decode_message(ping, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. We are alive.
+        self.gossip_service.enqueue_ack(ping.sequence_num, envelope_in.sender)
+        return True
+
+
+    # Handles the request to probe a member on behalf of the sender
+    def handle_ping_req(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle PingReq message.')
+
+        # 1. Decode the request
+        ping_req = message.PingReq(message.MESSAGE_PING_REQ_TYPE, 0)
+        decoded_bytes = message.decode_message(ping_req, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Ping the target, its ack is passed on to the sender.
+        sequence_num = self.gossip_service.enqueue_ping(ping_req.target)
+        if sequence_num:
+            self.gossip_service.failure_detector.add_relay(sequence_num,
+                                                           envelope_in.sender,
+                                                           ping_req.sequence_num,
+                                                           util.get_time())
+        return True
+
+
+    # Handles the news about the state of a member
+    def handle_member_state(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle MemberState message.')
+
+        # 1. Decode the member state
+        member_state = message.MemberState(message.MESSAGE_MEMBER_STATE_TYPE, 0)
+        decoded_bytes = message.decode_message(member_state, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Apply and spread the news.
+        return self.gossip_service.apply_member_state(member_state.reserved,
+                                                      member_state.incarnation,
+                                                      member_state.member)
+
+
+    # Handles the partial view maintenance
+    def handle_view(self, envelope_in):
+        # Proceed only if connected
+        if self.gossip_service.current_state() != state.STATE_CONNECTED:
+            return False
+
+        if self.gossip_service.log_messages:
+            self.logger.info('[MessageHandler] Handle View message.')
+
+        # 1. Decode the view message
+        view = message.View(message.MESSAGE_VIEW_TYPE, 0)
+        decoded_bytes = message.decode_message(view, envelope_in.buffer)
+        if not decoded_bytes:
+            return False
+
+        # 2. Send ACK message back to sender.
+        self.gossip_service.enqueue_ack(view.sequence_num, envelope_in.sender)
+
+        # 3. Update the views.
+        if view.reserved == message.VIEW_FORWARD_JOIN:
+            return self.gossip_service.forward_join(view.member, view.ttl, envelope_in.sender)
+
+        if view.reserved == message.VIEW_NEIGHBOR or view.reserved == message.VIEW_NEIGHBOR_PRIORITY:
+            return self.gossip_service.accept_neighbor(view.member,
+                                                      view.reserved == message.VIEW_NEIGHBOR_PRIORITY)
+
+        if view.reserved == message.VIEW_NEIGHBOR_ACCEPT:
+            return self.gossip_service.add_active(view.member)
+
+        if view.reserved == message.VIEW_NEIGHBOR_REJECT:
+            self.gossip_service.view.neighbor_answered(view.member.address.key())
+            return True
+
+        if view.reserved == message.VIEW_DISCONNECT:
+            self.gossip_service.remove_member(view.member.address)
+            self.gossip_service.view.add_passive(view.member,
+                                                 self.gossip_service.self_address,
+                                                 self.gossip_service.members)
+            return True
+
+        if view.reserved == message.VIEW_SHUFFLE:
+            return self.gossip_service.shuffle_view(view.member, view.ttl, view.members, envelope_in.sender)
+
+        if view.reserved == message.VIEW_SHUFFLE_REPLY:
+            for new_member in view.members:
+                self.gossip_service.view.add_passive(new_member,
+                                                     self.gossip_service.self_address,
+                                                     self.gossip_service.members)
+            return True
+
+        self.logger.warning('[MessageHandler] Unknown View message %s.', view.reserved)
+        return False
+
+
     def handle_new_message(self, envelope_in):
         # Read the message type form the incoming envolope.
         message_type = message.decode_type(envelope_in.buffer)
+        self.gossip_service.metrics.messages_received.inc(1, message_type)
 
         if message_type == message.MESSAGE_HELLO_TYPE:
             return self.handle_hello(envelope_in)
@@ -218,4 +557,31 @@ class MessageHandlerImpl(message_handler.MessageHandler):
         if message_type == message.MESSAGE_STATUS_TYPE:
             return self.handle_status(envelope_in)
 
+        if message_type == message.MESSAGE_BUNDLE_TYPE:
+            return self.handle_bundle(envelope_in)
+
+        if message_type == message.MESSAGE_SACK_TYPE:
+            return self.handle_sack(envelope_in)
+
+        if message_type == message.MESSAGE_IHAVE_TYPE:
+            return self.handle_ihave(envelope_in)
+
+        if message_type == message.MESSAGE_GRAFT_TYPE:
+            return self.handle_graft(envelope_in)
+
+        if message_type == message.MESSAGE_PRUNE_TYPE:
+            return self.handle_prune(envelope_in)
+
+        if message_type == message.MESSAGE_PING_TYPE:
+            return self.handle_ping(envelope_in)
+
+        if message_type == message.MESSAGE_PING_REQ_TYPE:
+            return self.handle_ping_req(envelope_in)
+
+        if message_type == message.MESSAGE_MEMBER_STATE_TYPE:
+            return self.handle_member_state(envelope_in)
+
+        if message_type == message.MESSAGE_VIEW_TYPE:
+            return self.handle_view(envelope_in)
+
         return False
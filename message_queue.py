@@ -1,16 +1,203 @@
+import collections
+import heapq
+
+import config
 import message
-import envolope
-import service
 
+# Message priorities, the lower priority messages are dropped first
+# when the queue is full.
+PRIORITY_STATUS = 0      # regenerated on every Gossip tick
+PRIORITY_DATA = 1        # Data and MemberList messages
+PRIORITY_MEMBERSHIP = 2  # Hello and View messages
+PRIORITY_CONTROL = 3     # Ack, Sack and Welcome messages, never retried
+
+# Rumors are spread to random members and can be recovered by the Status exchange.
+RUMOR_TYPES = (message.MESSAGE_DATA_TYPE, message.MESSAGE_STATUS_TYPE)
+
+def message_priority(message_type):
+    if message_type == message.MESSAGE_STATUS_TYPE:
+        return PRIORITY_STATUS
+    if message_type == message.MESSAGE_HELLO_TYPE or message_type == message.MESSAGE_VIEW_TYPE:
+        return PRIORITY_MEMBERSHIP
+    if (message_type == message.MESSAGE_ACK_TYPE or message_type == message.MESSAGE_SACK_TYPE or
+        message_type == message.MESSAGE_WELCOME_TYPE):
+        return PRIORITY_CONTROL
+
+    return PRIORITY_DATA
+
+# Outbound message queue. Envolopes are indexed by sequence number and
+# recipient, and scheduled on a heap ordered by the time they are due next.
+# Heap entries of removed or rescheduled envolopes are skipped lazily.
+#
+# The queue holds at most 'capacity' unique messages, all the envolopes of
+# a message share its sequence number. Once full, 'overflow_policy' decides
+# whether a queued message is dropped to make room or the new one is rejected.
 class MessageQueue:
-    def __init__(self):
-        self.messages = []
+    def __init__(self, capacity=config.MAX_OUTPUT_MESSAGES, overflow_policy=config.OUTPUT_OVERFLOW_POLICY):
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.sequences = collections.OrderedDict()  # map<sequence number, map<address key, MessageEnvolopeOut>>, oldest first
+        self.recipients = {}  # map<address key, map<sequence number, MessageEnvolopeOut>>
+        self.deadlines = []   # heap of (deadline, order, MessageEnvolopeOut)
+        self.order = 0
+        self.size = 0         # number of envolopes
+
+        # Queue depth counters.
+        self.peak_messages = 0  # the most unique messages queued at once
+        self.dropped = 0        # messages dropped to make room for new ones
+        self.rejected = 0       # messages rejected because the queue was full
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter([env for envs in self.sequences.values() for env in envs.values()])
+
+    # Add the message to the queue, it's due right away. Returns False
+    # if the queue is full, see 'make_room'.
+    def enque(self, env):
+        envs = self.sequences.get(env.sequence_num)
+        if envs is None:
+            if self.is_full():
+                self.rejected += 1
+                return False
+
+            envs = self.sequences[env.sequence_num] = {}
+            self.peak_messages = max(self.peak_messages, len(self.sequences))
+
+        recipient_key = env.recipient.key()
+        if recipient_key not in envs:
+            self.size += 1
+        envs[recipient_key] = env
+        self.recipients.setdefault(recipient_key, {})[env.sequence_num] = env
+        self.schedule(env, 0)
+        return True
+
+    def deque(self, env):
+        recipient_key = env.recipient.key()
+        envs = self.sequences.get(env.sequence_num)
+        if envs is None or envs.get(recipient_key) is not env:
+            return False
+
+        del envs[recipient_key]
+        if not envs:
+            del self.sequences[env.sequence_num]
+        self.size -= 1
+
+        recipient_messages = self.recipients[recipient_key]
+        del recipient_messages[env.sequence_num]
+        if not recipient_messages:
+            del self.recipients[recipient_key]
+
+        return True
+
+    def has_sequence_num(self, sequence_num):
+        return sequence_num in self.sequences
+
+    def find(self, sequence_num, recipient_key):
+        return self.sequences.get(sequence_num, {}).get(recipient_key, False)
+
+    # All messages queued for the recipient.
+    def find_by_recipient(self, recipient_key):
+        return list(self.recipients.get(recipient_key, {}).values())
+
+    def is_full(self):
+        return len(self.sequences) >= self.capacity
+
+    # Whether a new message of 'message_type' would be accepted.
+    def admits(self, message_type):
+        return not self.is_full() or self.select_victim(message_type) is not None
+
+    # The sequence number of the queued message to drop in favour of
+    # a new message of 'message_type', or None if it must be rejected.
+    def select_victim(self, message_type):
+        if self.overflow_policy == config.OVERFLOW_DROP_OLDEST_RUMOR:
+            for sequence_num, envs in self.sequences.items():
+                if next(iter(envs.values())).message_type in RUMOR_TYPES:
+                    return sequence_num
+
+        elif self.overflow_policy == config.OVERFLOW_DROP_LOWEST_PRIORITY:
+            # The oldest of the lowest priority messages, only if it's
+            # less important than the new one.
+            victim = None
+            victim_priority = message_priority(message_type)
+            for sequence_num, envs in self.sequences.items():
+                priority = next(iter(envs.values())).priority
+                if priority < victim_priority:
+                    victim = sequence_num
+                    victim_priority = priority
+
+            return victim
+
+        return None
+
+    # Drop a queued message, if the overflow policy allows it, so the new
+    # message 'env' fits into the queue. Returns the dropped envolopes.
+    def make_room(self, env):
+        if env.sequence_num in self.sequences or not self.is_full():
+            return []
+
+        sequence_num = self.select_victim(env.message_type)
+        if sequence_num is None:
+            return []
+
+        dropped_envs = list(self.sequences[sequence_num].values())
+        for dropped_env in dropped_envs:
+            self.deque(dropped_env)
+
+        self.dropped += 1
+        return dropped_envs
+
+    # The message becomes due at 'deadline' (in milliseconds).
+    def schedule(self, env, deadline):
+        env.deadline = deadline
+        self.order += 1
+        heapq.heappush(self.deadlines, (deadline, self.order, env))
+
+        # Dropped and rescheduled messages leave stale entries behind,
+        # don't let them pile up until they are due.
+        if len(self.deadlines) > 2 * self.size + 64:
+            self.deadlines = [entry for entry in self.deadlines if self.is_scheduled(entry[2], entry[0])]
+            heapq.heapify(self.deadlines)
+
+    # Remove from the schedule and return the messages due at 'current_ts'.
+    # They stay in the queue until they are rescheduled or dequeued.
+    def due(self, current_ts):
+        due_messages = []
+        while self.deadlines and self.deadlines[0][0] <= current_ts:
+            deadline, _, env = heapq.heappop(self.deadlines)
+            if self.is_scheduled(env, deadline):
+                due_messages.append(env)
+
+        return due_messages
 
-    def enque(self, msg):
-        pass
+    # The time the next message is due, or None if the queue is empty.
+    def next_deadline(self):
+        while self.deadlines:
+            deadline, _, env = self.deadlines[0]
+            if self.is_scheduled(env, deadline):
+                return deadline
+            heapq.heappop(self.deadlines)
 
-    def deque(self, msg):
-        pass
+        return None
 
+    def is_scheduled(self, env, deadline):
+        return (env.deadline == deadline and
+                self.find(env.sequence_num, env.recipient.key()) is env)
 
+    # Queue depth counters.
+    def stats(self):
+        return {
+            'envolopes': self.size,
+            'messages': len(self.sequences),
+            'capacity': self.capacity,
+            'peak_messages': self.peak_messages,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+        }
 
+    def clear(self):
+        self.sequences = collections.OrderedDict()
+        self.recipients = {}
+        self.deadlines = []
+        self.size = 0
@@ -1,3 +1,7 @@
+import asyncio
+import collections
+import heapq
+import random
 import socket
 
 import config
@@ -17,6 +21,9 @@ class MessageService:
     def recv_from(self):
         pass
 
+    def recv_many(self, budget):
+        pass
+
     def send_to(self, message, address):
         pass
 
@@ -26,14 +33,39 @@ class MessageService:
     def get_sock_name(self):
         pass
 
+    async def attach(self, on_datagram):
+        pass
+
+class UDPDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, logger, on_datagram):
+        asyncio.DatagramProtocol.__init__(self)
+        self.logger = logger
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data, address):
+        sender = member_address.Address()
+        sender.ip = address[0]
+        sender.port = int(address[1])
+        self.on_datagram(data, sender)
+
+    def error_received(self, exc):
+        self.logger.warning('[UDPDatagramProtocol] Socket error. %s', str(exc))
+
 class UDPMessageService(MessageService):
     def __init__(self, logger):
         MessageService.__init__(self)
         self.logger = logger
+        self.log_messages = config.LOG_MESSAGES  # log every datagram sent
         self.logger.info('[UDPMessageService] Ctor.')
         self.fd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.fd.setblocking(0)
+        self.counters = {
+            'sent': 0,            # datagrams sent
+            'bytes': 0,           # bytes sent
+            'received': 0,        # datagrams received
+            'received_bytes': 0,  # bytes received
+        }
 
     def bind(self, address):
         self.logger.info('[UDPMessageService] Bind to: %s', address.to_multiaddr())
@@ -42,6 +74,8 @@ class UDPMessageService(MessageService):
     def recv_from(self):
         try:
             data, address = self.fd.recvfrom(1024)
+            self.counters['received'] += 1
+            self.counters['received_bytes'] += len(data)
             sender = member_address.Address()
             sender.ip = address[0]
             sender.port = int(address[1])
@@ -50,13 +84,34 @@ class UDPMessageService(MessageService):
             self.logger.warning('[UDPMessageService] Socket read faild. %s', str(e))
             raise e
 
+    # Read up to 'budget' datagrams until the socket would block.
+    def recv_many(self, budget):
+        datagrams = []
+        while len(datagrams) < budget:
+            try:
+                data, address = self.fd.recvfrom(1024)
+            except BlockingIOError:
+                break
+
+            self.counters['received'] += 1
+            self.counters['received_bytes'] += len(data)
+            sender = member_address.Address()
+            sender.ip = address[0]
+            sender.port = int(address[1])
+            datagrams.append((data, sender))
+
+        return datagrams
+
     def send_to(self, message, address):
         if not util.is_valid_ip_address(address.ip):
             self.logger.warning('[UDPMessageService] Send failed - IP address is invalid.')
             return False
         try:
             bytes_sent = self.fd.sendto(message, (address.ip, address.port))
-            self.logger.info('[UDPMessageService] Socket sent: %s', bytes_sent)
+            self.counters['sent'] += 1
+            self.counters['bytes'] += bytes_sent
+            if self.log_messages:
+                self.logger.info('[UDPMessageService] Socket sent: %s', bytes_sent)
             return True
         except Exception as e:
             self.logger.warning('[UDPMessageService] Socket send faild. %s', str(e))
@@ -69,4 +124,136 @@ class UDPMessageService(MessageService):
         return self.fd.getsockname()
 
     def socket_fd(self):
-        return self.fd
\ No newline at end of file
+        return self.fd
+
+    # Hand the socket over to the running asyncio event loop. Every received
+    # datagram is passed to 'on_datagram(buffer, sender)'. Sending still goes
+    # through 'send_to', closing the returned transport closes the socket.
+    async def attach(self, on_datagram):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: UDPDatagramProtocol(self.logger, on_datagram),
+            sock=self.fd)
+        return transport
+
+# In-memory network of 'LoopbackMessageService' endpoints. A datagram is
+# delivered after a random latency of 'latency' (min, max) milliseconds,
+# unless it's lost with the 'loss' probability or its endpoints are in
+# different partitions. Time is read from 'util.get_time', so the network
+# runs on the simulator's virtual clock, see 'simulator.Simulator'.
+class LoopbackNetwork:
+    def __init__(self, loss=0.0, latency=(1, 1), rng=None):
+        self.loss = loss
+        self.latency = latency
+        self.rng = rng if rng is not None else random.Random()
+        self.endpoints = {}   # map<address key, LoopbackMessageService>
+        self.partitions = {}  # map<address key, partition>, unlisted endpoints are in partition 0
+        self.in_flight = []   # heap of (delivery ts, order, buffer, sender, recipient key)
+        self.order = 0
+        self.counters = {
+            'sent': 0,         # datagrams sent
+            'bytes': 0,        # bytes sent
+            'delivered': 0,    # datagrams put into an inbox
+            'lost': 0,         # datagrams dropped due to 'loss'
+            'partitioned': 0,  # datagrams between partitions
+            'unreachable': 0,  # datagrams to closed or unknown endpoints
+        }
+
+    def register(self, address, endpoint):
+        self.endpoints[address.key()] = endpoint
+
+    def unregister(self, address):
+        self.endpoints.pop(address.key(), None)
+
+    # Split the network: every group of addresses becomes a partition of
+    # its own, the other endpoints stay in partition 0.
+    def partition(self, *groups):
+        self.partitions = {}
+        for partition_num, group in enumerate(groups, 1):
+            for address in group:
+                self.partitions[address.key()] = partition_num
+
+    def heal(self):
+        self.partitions = {}
+
+    def transmit(self, buffer, sender, recipient):
+        self.counters['sent'] += 1
+        self.counters['bytes'] += len(buffer)
+        recipient_key = recipient.key()
+        if self.partitions.get(sender.key(), 0) != self.partitions.get(recipient_key, 0):
+            self.counters['partitioned'] += 1
+            return
+
+        if self.loss and self.rng.random() < self.loss:
+            self.counters['lost'] += 1
+            return
+
+        delivery_ts = util.get_time() + self.rng.randint(self.latency[0], self.latency[1])
+        self.order += 1
+        heapq.heappush(self.in_flight, (delivery_ts, self.order, buffer, sender, recipient_key))
+
+    # The time the next datagram arrives, or None if nothing is in flight.
+    def next_delivery(self):
+        if not self.in_flight:
+            return None
+
+        return self.in_flight[0][0]
+
+    # Move the datagrams due by 'current_ts' into the inboxes of their
+    # recipients. Returns the endpoints which got datagrams.
+    def deliver(self, current_ts):
+        endpoints = []
+        while self.in_flight and self.in_flight[0][0] <= current_ts:
+            _, _, buffer, sender, recipient_key = heapq.heappop(self.in_flight)
+            endpoint = self.endpoints.get(recipient_key)
+            if endpoint is None:
+                self.counters['unreachable'] += 1
+                continue
+
+            endpoint.inbox.append((buffer, sender))
+            endpoints.append(endpoint)
+            self.counters['delivered'] += 1
+
+        return endpoints
+
+# MessageService over a 'LoopbackNetwork'. It has no socket, the endpoints
+# are driven by the simulator instead of 'GossipService.run'.
+class LoopbackMessageService(MessageService):
+    def __init__(self, network, logger):
+        MessageService.__init__(self)
+        self.network = network
+        self.logger = logger
+        self.address = None
+        self.inbox = collections.deque()  # (buffer, sender address)
+
+    def bind(self, address):
+        self.address = address
+        self.network.register(address, self)
+
+    def recv_from(self):
+        if not self.inbox:
+            raise BlockingIOError('[LoopbackMessageService] No datagram to read.')
+
+        return self.inbox.popleft()
+
+    def recv_many(self, budget):
+        datagrams = []
+        while self.inbox and len(datagrams) < budget:
+            datagrams.append(self.inbox.popleft())
+
+        return datagrams
+
+    def send_to(self, message, address):
+        if self.address is None:
+            self.logger.warning('[LoopbackMessageService] Send failed - not bound.')
+            return False
+
+        self.network.transmit(message, self.address, address)
+        return True
+
+    def close(self):
+        if self.address is not None:
+            self.network.unregister(self.address)
+
+    def get_sock_name(self):
+        return (self.address.ip, self.address.port)
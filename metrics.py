@@ -0,0 +1,186 @@
+import bisect
+import collections
+import http.server
+import os
+import threading
+
+import message
+
+# Handler latency buckets, in seconds.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+# A monotonic count, optionally split by the value of a single label.
+# Counting is a dictionary update, cheap enough for every datagram. The
+# label values are translated with 'value_names' only when read.
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label=None, value_names=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.value_names = value_names or {}
+        self.values = collections.defaultdict(int)  # map<label value, count>, None without a label
+
+    def inc(self, amount=1, label_value=None):
+        self.values[label_value] += amount
+
+    def snapshot(self):
+        if self.label is None:
+            return self.values.get(None, 0)
+        return {str(self.value_names.get(label_value, label_value)): value
+                for label_value, value in list(self.values.items())}
+
+    def samples(self):
+        if self.label is None:
+            return [(self.name, '', self.values.get(None, 0))]
+        return [(self.name, f'{{{self.label}="{label_value}"}}', value)
+                for label_value, value in sorted(self.snapshot().items())]
+
+# A value which goes up and down. It's either set, or read from 'function'
+# whenever the registry is read, so the hot path doesn't pay for it.
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        return [(self.name, '', self.snapshot())]
+
+# The distribution of observed values over cumulative 'buckets' (upper
+# bounds), with their sum and count.
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one counts values above all the buckets
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+    def samples(self):
+        snapshot = self.snapshot()
+        samples = [(f'{self.name}_bucket', f'{{le="{bound}"}}', count) for bound, count in snapshot['buckets'].items()]
+        samples.append((f'{self.name}_sum', '', snapshot['sum']))
+        samples.append((f'{self.name}_count', '', snapshot['count']))
+        return samples
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = bytes(self.server.registry.prometheus_text(), 'utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# A set of named metrics, read with 'snapshot' or exported in the
+# Prometheus text format.
+class Registry:
+    def __init__(self):
+        self.metrics = collections.OrderedDict()  # map<name, Counter, Gauge or Histogram>
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label=None, value_names=None):
+        return self.register(Counter(name, help_text, label, value_names))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    # The current values: a number per counter (a map per label value for
+    # labelled ones) and gauge, a map of count, sum and buckets per histogram.
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def prometheus_text(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {value}' for name, labels, value in metric.samples())
+
+        return '\n'.join(lines) + '\n'
+
+    # Write the Prometheus text to 'path', for example for the node
+    # exporter's textfile collector. The file is replaced atomically.
+    def dump(self, path):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as output:
+            output.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    # Serve the Prometheus text over HTTP on a local port, from a daemon
+    # thread. Call 'shutdown' on the returned server to stop it.
+    def serve(self, port, host='127.0.0.1'):
+        server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.daemon_threads = True
+        server.registry = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# The metrics of a GossipService node.
+class NodeMetrics(Registry):
+    def __init__(self, gossip_service):
+        Registry.__init__(self)
+        self.messages_received = self.counter('gossip_messages_received_total',
+                                              'Messages received, bundled ones included.',
+                                              'type', message.MESSAGE_TYPE_NAMES)
+        self.messages_sent = self.counter('gossip_messages_sent_total',
+                                          'Messages sent, retries included.',
+                                          'type', message.MESSAGE_TYPE_NAMES)
+        self.datagrams_received = self.counter('gossip_datagrams_received_total', 'Datagrams received.')
+        self.datagrams_sent = self.counter('gossip_datagrams_sent_total', 'Datagrams sent.')
+        self.bytes_received = self.counter('gossip_received_bytes_total', 'Bytes received.')
+        self.bytes_sent = self.counter('gossip_sent_bytes_total', 'Bytes sent.')
+        self.retries = self.counter('gossip_retries_total', 'Messages sent again for lack of an acknowledgement.')
+        self.piggybacked = self.counter('gossip_piggybacked_events_total',
+                                        'Membership events piggybacked on datagrams.')
+        self.dropped = self.counter('gossip_messages_dropped_total',
+                                    'Messages dropped: overflow, rejected, expired or unreachable.', 'reason')
+        self.unhandled = self.counter('gossip_unhandled_datagrams_total', 'Datagrams which failed to be handled.')
+        self.malformed = self.counter('gossip_malformed_datagrams_total', 'Datagrams which failed to be decoded.')
+        self.deferred = self.counter('gossip_data_deferred_total', 'New Data refused while the delivery queue was full.')
+        self.handler_latency = self.histogram('gossip_handler_seconds', 'Time spent handling a datagram.')
+        self.gauge('gossip_outbound_messages', 'Messages in the outbound queue.',
+                   lambda: len(gossip_service.outbound_messages.sequences))
+        self.gauge('gossip_outbound_envolopes', 'Envolopes, one per recipient of a message, in the outbound queue.',
+                   lambda: len(gossip_service.outbound_messages))
+        self.gauge('gossip_delivery_queue', 'Payloads waiting for the data receiver.',
+                   lambda: len(gossip_service.delivery) if gossip_service.delivery is not None else 0)
+        self.gauge('gossip_members', 'Members known to the node.', lambda: gossip_service.members.get_size())
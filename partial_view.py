@@ -0,0 +1,88 @@
+import collections
+import random
+
+import config
+
+# Partial view membership (HyParView, Leitao et al.). The active view, the
+# service's member list, holds a few members the messages are spread to.
+# The passive view holds backup members which replace failed active
+# members, and it's refreshed by periodic shuffles with random members.
+# A joining member is introduced by random walks (ForwardJoin), so every
+# node keeps a bounded number of members however big the cluster is.
+class PartialView:
+    def __init__(self,
+                 active_size=config.PARTIAL_VIEW_ACTIVE_SIZE,
+                 passive_size=config.PARTIAL_VIEW_PASSIVE_SIZE,
+                 active_walk=config.PARTIAL_VIEW_ACTIVE_WALK,
+                 passive_walk=config.PARTIAL_VIEW_PASSIVE_WALK,
+                 shuffle_interval=config.PARTIAL_VIEW_SHUFFLE_INTERVAL):
+        self.active_size = active_size
+        self.passive_size = passive_size
+        self.active_walk = active_walk
+        self.passive_walk = passive_walk
+        self.shuffle_interval = shuffle_interval
+
+        self.passive = collections.OrderedDict()  # map<address key, Member>
+        self.shuffled = set()     # address keys sent in the last shuffle
+        self.next_shuffle_ts = 0
+        self.neighbor_request = None  # (address key, deadline) of the pending Neighbor request
+
+    def is_active_full(self, members):
+        return members.get_size() >= self.active_size
+
+    # Add the member to the passive view, unless it's this node or an
+    # active member. The members sent in the last shuffle are dropped
+    # first to make room, the peer keeps them.
+    def add_passive(self, new_member, self_address, members):
+        address_key = new_member.address.key()
+        if new_member.address.equals(self_address) or members.find_by_key(address_key):
+            return False
+
+        if address_key not in self.passive:
+            while len(self.passive) >= self.passive_size:
+                victim = next((key for key in self.passive if key in self.shuffled), None)
+                if victim is None:
+                    victim = random.choice(list(self.passive))
+
+                del self.passive[victim]
+                self.shuffled.discard(victim)
+
+        self.passive[address_key] = new_member
+        return True
+
+    def remove_passive(self, address_key):
+        self.passive.pop(address_key, None)
+        self.shuffled.discard(address_key)
+
+    def random_passive(self, count):
+        return random.sample(list(self.passive.values()), min(count, len(self.passive)))
+
+    # The members to send in a shuffle.
+    def shuffle_sample(self, members, active_count, passive_count, current_ts):
+        sample = list(members.random_members(active_count) or []) + self.random_passive(passive_count)
+        self.shuffled = {sampled.address.key() for sampled in sample}
+        self.next_shuffle_ts = current_ts + self.shuffle_interval
+        return sample
+
+    # A member to ask to join the active view, if it has room and no
+    # other request is pending.
+    def neighbor_candidate(self, members, current_ts):
+        if self.is_active_full(members) or not self.passive:
+            return None
+
+        if self.neighbor_request is not None and self.neighbor_request[1] > current_ts:
+            return None
+
+        candidate = random.choice(list(self.passive.values()))
+        self.neighbor_request = (candidate.address.key(), current_ts + self.shuffle_interval)
+        return candidate
+
+    # The Neighbor request to the member was answered, or the member is gone.
+    def neighbor_answered(self, address_key):
+        if self.neighbor_request is not None and self.neighbor_request[0] == address_key:
+            self.neighbor_request = None
+
+    def clear(self):
+        self.passive.clear()
+        self.shuffled = set()
+        self.neighbor_request = None
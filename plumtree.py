@@ -0,0 +1,129 @@
+import collections
+
+import config
+import vector_clock
+
+# Data announced by a lazy peer (IHave) which we haven't received yet.
+class MissingData:
+    def __init__(self, record, deadline):
+        self.record = record      # VectorRecord of the data
+        self.announcers = []      # addresses of the members which have the data
+        self.deadline = deadline  # when to ask the next announcer for it (Graft)
+
+# Epidemic broadcast tree (Plumtree, Leitao et al.). Data is pushed to the
+# eager peers, the lazy peers only get the announcement of it. A duplicate
+# Data moves its sender to the lazy peers (Prune), so the eager links
+# converge to a spanning tree. Data announced but not received in time is
+# requested from the announcer (Graft), which moves it back to the eager
+# peers and so repairs the tree.
+class Plumtree:
+    def __init__(self, eager_size=config.PLUMTREE_EAGER_PEERS, lazy_size=config.PLUMTREE_LAZY_PEERS):
+        self.eager_size = eager_size
+        self.lazy_size = lazy_size
+        self.eager_peers = {}  # map<address key, Address>
+        self.lazy_peers = {}   # map<address key, Address>
+        self.missing = collections.OrderedDict()  # map<(member_id, sequence number), MissingData>
+        self.pending_ihaves = {}  # map<address key, (Address, list of VectorRecord)>
+
+    # Drop the peers which are not members anymore and choose random
+    # members for the missing peers. Members older than 'min_version' don't
+    # understand IHave messages, they are only ever eager peers.
+    def refresh(self, members, min_version=config.PROTOCOL_VERSION_PLUMTREE):
+        for peers in (self.eager_peers, self.lazy_peers):
+            for address_key, address in list(peers.items()):
+                if not members.find_by_addr(address):
+                    del peers[address_key]
+
+        missing_num = self.eager_size + self.lazy_size - len(self.eager_peers) - len(self.lazy_peers)
+        if missing_num <= 0:
+            return
+
+        candidates = members.random_members(missing_num + len(self.eager_peers) + len(self.lazy_peers)) or []
+        for member in candidates:
+            address_key = member.address.key()
+            if address_key in self.eager_peers or address_key in self.lazy_peers:
+                continue
+
+            if len(self.eager_peers) < self.eager_size:
+                self.eager_peers[address_key] = member.address
+            elif len(self.lazy_peers) < self.lazy_size and member.version >= min_version:
+                self.lazy_peers[address_key] = member.address
+
+    def add_eager(self, address):
+        address_key = address.key()
+        self.lazy_peers.pop(address_key, None)
+        self.eager_peers[address_key] = address
+
+    def add_lazy(self, address):
+        address_key = address.key()
+        self.eager_peers.pop(address_key, None)
+        self.lazy_peers[address_key] = address
+
+    def remove_peer(self, address_key):
+        self.eager_peers.pop(address_key, None)
+        self.lazy_peers.pop(address_key, None)
+        self.pending_ihaves.pop(address_key, None)
+
+    # Announce the data to all lazy peers but 'exclude_key', see 'take_ihaves'.
+    def announce(self, record, exclude_key=None):
+        announced = vector_clock.VectorRecord()
+        announced.copy(record)
+        for address_key, address in self.lazy_peers.items():
+            if address_key != exclude_key:
+                self.pending_ihaves.setdefault(address_key, (address, []))[1].append(announced)
+
+    # The announcements collected since the last call.
+    def take_ihaves(self):
+        pending_ihaves = self.pending_ihaves
+        self.pending_ihaves = {}
+        return pending_ihaves.values()
+
+    # The 'sender' has the data of the 'record' we don't have yet.
+    def add_missing(self, record, sender, deadline):
+        missing_key = (record.member_id, record.sequence_number)
+        missing_data = self.missing.get(missing_key)
+        if missing_data is None:
+            missing_data = self.missing[missing_key] = MissingData(record, deadline)
+            while len(self.missing) > config.PLUMTREE_MAX_MISSING:
+                self.missing.popitem(last=False)
+
+        missing_data.announcers.append(sender)
+
+    # The data arrived, stop waiting for it and for its older versions.
+    def remove_missing(self, record):
+        for missing_key in list(self.missing):
+            member_id, sequence_number = missing_key
+            if member_id == record.member_id and sequence_number <= record.sequence_number:
+                del self.missing[missing_key]
+
+    # The (announcer address, VectorRecord) pairs of the data to request
+    # now. The next announcer is asked after 'timeout' milliseconds.
+    def due_grafts(self, current_ts, timeout):
+        grafts = []
+        for missing_key, missing_data in list(self.missing.items()):
+            if missing_data.deadline > current_ts:
+                continue
+
+            if not missing_data.announcers:
+                del self.missing[missing_key]
+                continue
+
+            grafts.append((missing_data.announcers.pop(0), missing_data.record))
+            missing_data.deadline = current_ts + timeout
+
+        return grafts
+
+    # The time the next Graft is due, or None if nothing is missing.
+    def next_deadline(self):
+        if not self.missing:
+            return None
+
+        return min(missing_data.deadline for missing_data in self.missing.values())
+
+# The clock holding the 'records', used by IHave and Graft messages.
+def records_clock(records):
+    clock = vector_clock.VectorClock()
+    for record in records:
+        clock.add_record(record)
+
+    return clock
@@ -0,0 +1,62 @@
+import collections
+
+import config
+
+# Round-trip time estimate of a member, in milliseconds.
+class RttRecord:
+    def __init__(self, sample):
+        self.srtt = sample        # smoothed round-trip time
+        self.rttvar = sample / 2  # round-trip time variation
+
+    def update(self, sample):
+        self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+        self.srtt = 0.875 * self.srtt + 0.125 * sample
+
+    def timeout(self):
+        return self.srtt + max(config.RETRY_CLOCK_GRANULARITY, 4 * self.rttvar)
+
+# Retry timeouts derived from the measured round-trip times (RFC 6298).
+# Members are kept in the least recently used order, once the table
+# holds 'capacity' members the least recently used one is dropped.
+class RttEstimator:
+    def __init__(self, capacity=config.RTT_TABLE_SIZE):
+        self.capacity = capacity
+        self.records = collections.OrderedDict()  # map<address key, RttRecord>
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, address_key):
+        return self.records.get(address_key, False)
+
+    # Add the round-trip 'sample' (in milliseconds) of the member.
+    # Only samples of messages sent once may be added (Karn's algorithm),
+    # the ack of a retried message can belong to any of the attempts.
+    def add_sample(self, address_key, sample):
+        record = self.records.get(address_key)
+        if record is None:
+            self.records[address_key] = RttRecord(sample)
+            while len(self.records) > self.capacity:
+                self.records.popitem(last=False)
+        else:
+            record.update(sample)
+            self.records.move_to_end(address_key)
+
+    # The time to wait for the ack after the 'attempt_num'-th attempt,
+    # doubled with every retry. Members without samples get the
+    # 'MESSAGE_RETRY_INTERVAL'.
+    def timeout(self, address_key, attempt_num=1):
+        record = self.records.get(address_key)
+        if record is None:
+            timeout = config.MESSAGE_RETRY_INTERVAL
+        else:
+            timeout = max(config.RETRY_TIMEOUT_MIN, record.timeout())
+
+        timeout *= 2 ** max(0, attempt_num - 1)
+        return int(min(timeout, config.RETRY_TIMEOUT_MAX))
+
+    def remove(self, address_key):
+        self.records.pop(address_key, None)
+
+    def clear(self):
+        self.records = collections.OrderedDict()
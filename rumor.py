@@ -0,0 +1,30 @@
+import random
+
+import config
+
+# A Data message this node keeps spreading (rumor mongering, Demers et al.).
+# The rumor stays hot, and is pushed to random members on every Gossip
+# tick, until enough members answer that they already had it.
+class Rumor:
+    def __init__(self, record, hops):
+        self.record = record        # DataLogRecord of the data
+        self.sequence_number = record.version.sequence_number
+        self.hops = hops            # hops the data made before reaching us
+        self.rounds = 0             # Gossip ticks the rumor was pushed in
+        self.duplicates = 0         # members which already had the data
+
+    # The data was replaced by a newer one from the same originator.
+    def is_obsolete(self):
+        return self.record.version.sequence_number != self.sequence_number
+
+    # Record the "already had it" feedback of a member. Returns True if
+    # the rumor should not be spread anymore.
+    def feedback(self, stop_mode, stop_k):
+        self.duplicates += 1
+        if stop_mode == config.RUMOR_STOP_COUNTER:
+            return self.duplicates >= stop_k
+
+        if stop_mode == config.RUMOR_STOP_PROBABILITY:
+            return random.random() < 1 / stop_k
+
+        return False
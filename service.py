@@ -1,4 +1,8 @@
-import queue
+import asyncio
+import collections
+import random
+import struct
+import time
 
 import config
 import state
@@ -12,13 +16,24 @@ import member_address
 import util
 import message
 import message_factory
+import message_queue
+import rtt_estimator
+import rumor
+import plumtree
+import failure_detector
+import dissemination
+import partial_view
+import metrics
+import codec
+import tracing
+import delivery
 
 class GossipService:
-    def __init__(self, self_address, data_receiver, logger):
+    def __init__(self, self_address, data_receiver, logger, messaging_service=None):
         self.logger = logger
         self.input_buffer = []
         self.output_buffer = []
-        self.outbound_messages = []
+        self.outbound_messages = message_queue.MessageQueue(config.MAX_OUTPUT_MESSAGES, config.OUTPUT_OVERFLOW_POLICY)
 
         self.sequence_num = 0
         self.data_counter = 0
@@ -33,91 +48,416 @@ class GossipService:
         self.last_gossip_ts = 0
         self.data_receiver = data_receiver
 
+        # Queue the received payloads for 'data_receiver', None calls it inline.
+        self.delivery = delivery.create(config.DELIVERY_MODE, data_receiver, self.logger)
+
+        # Pack messages for the same recipient into a single datagram.
+        self.coalesce_messages = config.MESSAGE_COALESCING
+
+        # Use the compact binary codec with members that support it.
+        self.binary_codec = config.MESSAGE_BINARY_CODEC
+        self.binary_senders = collections.OrderedDict()  # map<address key, True>, least recently heard first
+
+        # Delta Status messages: the clock version last acknowledged by each
+        # member and the clock version sent in each pending Status message.
+        self.delta_status = config.STATUS_DELTA
+        self.status_baselines = {}  # map<address key, clock version>
+        self.pending_statuses = {}  # map<(sequence number, address key), clock version>
+        self.status_deltas = {}  # map<address key, delta Statuses since the last digest or full clock>
+
+        # Gossip the vector clock digest, so members in sync stop right away.
+        self.digest_status = config.STATUS_DIGEST
+
+        # Acknowledge the messages received from a member since the last
+        # send with a single Sack message.
+        self.aggregate_acks = config.MESSAGE_ACK_AGGREGATION
+        self.pending_acks = {}  # map<address key, (address, list of sequence numbers)>
+
+        # Retry after the timeout estimated from the member's round-trip times.
+        self.adaptive_retry = config.MESSAGE_ADAPTIVE_RETRY
+        self.rtt = rtt_estimator.RttEstimator(config.RTT_TABLE_SIZE)
+
+        # Rumor mongering of the Data messages, see 'enqueue_rumor'.
+        self.rumor_stop = config.RUMOR_STOP
+        self.rumor_stop_k = config.RUMOR_STOP_K
+        self.rumor_fanout = config.RUMOR_FANOUT
+        self.rumor_max_hops = config.RUMOR_MAX_HOPS
+        self.rumor_max_rounds = config.RUMOR_MAX_ROUNDS
+        self.hot_rumors = collections.OrderedDict()  # map<member_id, Rumor>, oldest first
+        self.pending_rumors = {}  # map<sequence number, Rumor>
+        self.rumor_counters = {
+            'received': 0,    # new Data messages
+            'duplicates': 0,  # Data messages we already had
+            'pushed': 0,      # rumor messages sent to random members
+            'feedback': 0,    # members which already had a pushed rumor
+            'stopped': 0,     # rumors which stopped being hot
+            'expired': 0,     # rumors not forwarded due to the hop limit
+        }
+
+        # Trace the rumors for offline infection curves, see 'tracing.merge'.
+        self.rumor_tracing = config.RUMOR_TRACING
+        self.tracer = tracing.RumorTracer(config.RUMOR_TRACE_SIZE)
+
+        # Spread new Data along an epidemic broadcast tree, see 'enqueue_tree_data'.
+        self.epidemic_tree = config.PLUMTREE
+        self.plumtree = plumtree.Plumtree(config.PLUMTREE_EAGER_PEERS, config.PLUMTREE_LAZY_PEERS)
+
+        # Detect failed members with SWIM probes, see 'detect_failures'.
+        self.failure_detection = config.FAILURE_DETECTOR
+        self.failure_detector = failure_detector.FailureDetector(config.SWIM_PROBE_INTERVAL,
+                                                                 config.SWIM_PING_TIMEOUT,
+                                                                 config.SWIM_INDIRECT_PROBES,
+                                                                 config.SWIM_SUSPECT_TIMEOUT,
+                                                                 config.SWIM_TOMBSTONE_TIMEOUT)
+
+        # Piggyback membership events on the outgoing datagrams, see 'piggyback_events'.
+        self.piggyback_membership = config.MEMBERSHIP_PIGGYBACK
+        self.dissemination = dissemination.DisseminationBuffer(config.PIGGYBACK_RETRANSMIT_FACTOR,
+                                                               config.PIGGYBACK_MAX_EVENTS)
+        self.next_member_list_sync_ts = 0  # see 'sync_member_list'
+
+        # Newcomers collected by a seed within the join batch window, see 'add_newcomer'.
+        self.join_batch_window = config.JOIN_BATCH_WINDOW
+        self.pending_joins = collections.OrderedDict()  # map<address key, Member>
+        self.pending_snapshots = collections.OrderedDict()  # map<address key, Member>, waiting for the member list
+        self.join_batch_deadline = 0
+
+        # Keep only a partial view of the cluster, see 'maintain_view'. The
+        # member list holds the active view then.
+        self.partial_view = config.PARTIAL_VIEW
+        self.view = partial_view.PartialView(config.PARTIAL_VIEW_ACTIVE_SIZE,
+                                             config.PARTIAL_VIEW_PASSIVE_SIZE,
+                                             config.PARTIAL_VIEW_ACTIVE_WALK,
+                                             config.PARTIAL_VIEW_PASSIVE_WALK,
+                                             config.PARTIAL_VIEW_SHUFFLE_INTERVAL)
+
+        # Log every message sent, received and handled. Costly on the hot
+        # path, 'metrics' counts the same traffic.
+        self.log_messages = config.LOG_MESSAGES
+        self.metrics = metrics.NodeMetrics(self)
+
+        # asyncio driver state, see 'run' and 'stop'.
+        self.running = False
+        self.wakeup_event = None
+
         self.message_handler = message_handler_factory.MessageHandlerFactory.getInstance().getHandler()
         self.message_handler.set_service(self)
         self.message_handler.set_logger(self.logger)
         
-        self.messaging_service = message_service.UDPMessageService(self.logger)
+        # The transport, a UDP socket unless another MessageService is given.
+        if messaging_service is None:
+            messaging_service = message_service.UDPMessageService(self.logger)
+        self.messaging_service = messaging_service
         self.messaging_service.bind(self_address)
         self.logger.info("[GossipService] Service started.")
 
     # Send the message to the receipient
     def send(self):
         if (self.state != state.STATE_JOINING and self.state != state.STATE_CONNECTED):
-            self.logger.warning("[GossipService] Failed to send - not connected.")
+            if self.log_messages:
+                self.logger.warning("[GossipService] Failed to send - not connected.")
             return False
 
-        # get the first message from outbound message queue
-        msg_sent = 0
-        i = 0
-        self.logger.info("[GossipService] Messages to be dispatched are %s", len(self.outbound_messages))
-        while i < len(self.outbound_messages):
-            current_msg = self.outbound_messages[i]
-            i += 1
+        # Acknowledge the messages received since the last send.
+        self.flush_acks()
+        if self.epidemic_tree:
+            self.flush_tree()
+
+        # Collect the messages which are due, grouped by recipient.
+        current_ts = util.get_time()
+        due_messages = {}
+        if self.log_messages:
+            self.logger.info("[GossipService] Messages to be dispatched are %s", len(self.outbound_messages))
+        for current_msg in self.outbound_messages.due(current_ts):
+            recipient_key = current_msg.recipient.key()
+
+            # The message was dropped earlier in this round, with its unreachable recipient.
+            if self.outbound_messages.find(current_msg.sequence_num, recipient_key) is not current_msg:
+                continue
 
             # The message exceeded the maximum number of attempts.
             if (current_msg.attempt_num >= current_msg.max_attempts):
-                if (current_msg.max_attempts > 1):
+                if (current_msg.message_type == message.MESSAGE_HELLO_TYPE and self.state == state.STATE_JOINING):
+                    # Nobody welcomed us yet, keep saying Hello to the seed.
+                    if self.log_messages:
+                        self.logger.info("[GossipService] Hello to %s expired, retrying.", current_msg.recipient.to_multiaddr())
+                    self.enqueue_hello(current_msg.recipient)
+
+                elif (current_msg.max_attempts > 1 and self.is_probed(current_msg.recipient)):
+                    # The failure detector decides whether the recipient is
+                    # alive, a lossy link alone doesn't evict it.
+                    if self.log_messages:
+                        self.logger.info("[GossipService] Message %s to %s expired.",
+                                         current_msg.sequence_num, current_msg.recipient.to_multiaddr())
+                    self.metrics.dropped.inc(1, 'expired')
+
+                elif (current_msg.max_attempts > 1):
                     # If the number of maximum attempts is more than 1, then
                     # the message required acknowledgement but we've never received it.
                     # Remove node from the list since it's unreachable.
-                    self.members.remove_by_addr(current_msg.recipient)
+                    self.remove_member(current_msg.recipient)
+                    self.metrics.dropped.inc(1, 'expired')
 
                     # Quite often the same recipient has several messages in a row.
-                    # Check whether the next message should be removed as well.
-                    j = 1 + i
-                    while j < len(self.outbound_messages):
-                        next_msg = self.outbound_messages[j]
-                        j += 1
-                        if (current_msg.recipient == next_msg.recipient):
-                            self.dequeue_envolope(next_msg)
-                            continue
-                        
-                        break
+                    # Drop all of them once the recipient turned out to be unreachable.
+                    for next_msg in self.outbound_messages.find_by_recipient(recipient_key):
+                        self.dequeue_envolope(next_msg)
+                        self.metrics.dropped.inc(1, 'unreachable')
+                    due_messages.pop(recipient_key, None)
 
                 # Remove this message from the queue.
                 self.dequeue_envolope(current_msg)
                 continue
-            
-            current_ts = util.get_time()
 
-            # It's not yet time to retry this message.
-            if (current_msg.attempt_num != 0 and
-                (current_msg.attempt_ts + config.MESSAGE_RETRY_INTERVAL) > current_ts):
-                continue
-            
-            # Send to recipient
-            sent = self.messaging_service.send_to(current_msg.buffer, current_msg.recipient)
-            if not sent:
-                self.logger.warning("[GossipService] Failed to send %s - error in messaging service.", current_msg.recipient.to_multiaddr())
-                return False
-            
-            # increament the attempt counts
-            current_msg.attempt_ts = current_ts
-            current_msg.attempt_num += 1
-            msg_sent += 1
+            due_messages.setdefault(recipient_key, []).append(current_msg)
 
-            self.logger.info("[GossipService] %s Messages sent to %s", msg_sent, current_msg.recipient.to_multiaddr())
+        msg_sent = 0
+        pending = list(due_messages.values())
+        while pending:
+            messages = pending.pop()
+            recipient = messages[0].recipient
+            for buffer in self.pack_datagrams(messages, recipient):
+                # Send to recipient
+                sent = self.messaging_service.send_to(buffer, recipient)
+                if not sent:
+                    self.logger.warning("[GossipService] Failed to send %s - error in messaging service.", recipient.to_multiaddr())
+                    # Keep the messages which were not sent due.
+                    for unsent in [messages] + pending:
+                        for current_msg in unsent:
+                            self.outbound_messages.schedule(current_msg, current_ts)
+                    return False
 
-            # The message must be sent only once. Remove it immediately.
-            if (current_msg.max_attempts <= 1):
-                self.dequeue_envolope(current_msg)
+                self.metrics.datagrams_sent.inc()
+                self.metrics.bytes_sent.inc(len(buffer))
+
+            for current_msg in messages:
+                self.metrics.messages_sent.inc(1, current_msg.message_type)
+                if current_msg.attempt_num:
+                    self.metrics.retries.inc()
+
+                # increament the attempt counts
+                current_msg.attempt_ts = current_ts
+                current_msg.attempt_num += 1
+                msg_sent += 1
+
+                if (current_msg.max_attempts <= 1):
+                    # The message must be sent only once. Remove it immediately.
+                    self.dequeue_envolope(current_msg)
+                else:
+                    # Wait for the acknowledgement, then retry (or give up).
+                    self.outbound_messages.schedule(current_msg, current_ts + self.retry_interval(current_msg))
+
+            if self.log_messages:
+                self.logger.info("[GossipService] %s Messages sent to %s", msg_sent, recipient.to_multiaddr())
 
         return msg_sent
 
+    # Build the datagrams for messages addressed to the same recipient.
+    # When the recipient understands bundles, several messages share a
+    # single datagram of at most 'MESSAGE_MAX_SIZE' bytes. Without bundles
+    # the membership events are sent in datagrams of their own.
+    def pack_datagrams(self, messages, recipient):
+        buffers = [msg.buffer for msg in messages]
+        if self.peer_version(recipient) < config.PROTOCOL_VERSION_BUNDLE:
+            return buffers
+
+        if not self.coalesce_messages:
+            return buffers + self.piggyback_events([], recipient)
+
+        buffers += self.piggyback_events(buffers, recipient)
+        if len(buffers) < 2:
+            return buffers
+
+        return message.Bundle.pack(buffers, config.MESSAGE_MAX_SIZE, self.wire_version(recipient))
+
+    # The encoded membership events which fit into the room the 'buffers'
+    # leave in a single datagram for the recipient.
+    def piggyback_events(self, buffers, recipient):
+        if (not self.piggyback_membership or
+            not self.dissemination or
+            self.peer_version(recipient) < config.PROTOCOL_VERSION_PIGGYBACK):
+            return []
+
+        room = config.MESSAGE_MAX_SIZE - message.BUNDLE_HEADER_SIZE
+        room -= sum(message.BUNDLE_ENTRY_HEADER_SIZE + len(buffer) for buffer in buffers)
+
+        version = self.wire_version(recipient)
+        members_num = self.members.get_size()
+        piggybacked = []
+        transmitted = []
+        for event in self.dissemination.candidates():
+            if room <= message.BUNDLE_ENTRY_HEADER_SIZE + message.MESSAGE_MIN_SIZE:
+                break
+
+            buffer = event.buffers.get(version)
+            if buffer is None:
+                member_state_msg = message_factory.MessageFactory.getInstance().create(message.MESSAGE_MEMBER_STATE_TYPE,
+                                                                                      event.sequence_num)
+                member_state_msg.reserved = event.member_state
+                member_state_msg.member = event.member
+                member_state_msg.incarnation = event.incarnation
+                buffer = event.buffers[version] = self.encode_message(member_state_msg, version) or b''
+
+            if not buffer:
+                continue
+            if message.BUNDLE_ENTRY_HEADER_SIZE + len(buffer) > room:
+                break
+
+            room -= message.BUNDLE_ENTRY_HEADER_SIZE + len(buffer)
+            piggybacked.append(buffer)
+            transmitted.append(event)
+
+        for event in transmitted:
+            self.dissemination.transmitted(event, members_num)
+        self.metrics.piggybacked.inc(len(transmitted))
+        return piggybacked
+
+    # The protocol version spoken by the member with the given address.
+    # Peers we know nothing about are assumed to speak the first version.
+    def peer_version(self, address):
+        peer = self.members.find_by_addr(address)
+        if not peer:
+            return config.PROTOCOL_VERSION_MIN
+
+        return peer.version
+
     # Read the message from peer
     def receive(self):
         # Only receive iff node has requested to join or connected to the cluster.
         if (self.state != state.STATE_JOINING and self.state != state.STATE_CONNECTED):
-            self.logger.warning("[GossipService] Failed to receive - not connected.")
+            if self.log_messages:
+                self.logger.warning("[GossipService] Failed to receive - not connected.")
             return False
 
         # Read the payload from messaging service and add to envolope and dispatch
-        self.input_buffer, sender_address = self.messaging_service.recv_from()
-        self.logger.info("[GossipService] Message received from %s", sender_address.to_multiaddr())
+        buffer, sender_address = self.messaging_service.recv_from()
+        return self.handle_datagram(buffer, sender_address)
+
+    # Read all pending messages, up to 'budget', and dispatch them one by one.
+    # Returns the number of messages read, so the caller can flush the
+    # outbound queue once for the whole batch.
+    def receive_batch(self, budget=config.RECEIVE_BATCH_SIZE):
+        # Only receive iff node has requested to join or connected to the cluster.
+        if (self.state != state.STATE_JOINING and self.state != state.STATE_CONNECTED):
+            if self.log_messages:
+                self.logger.warning("[GossipService] Failed to receive - not connected.")
+            return False
+
+        datagrams = self.messaging_service.recv_many(budget)
+        for buffer, sender_address in datagrams:
+            if not self.handle_datagram(buffer, sender_address) and self.log_messages:
+                self.logger.warning("[GossipService] Message from %s was not handled.", sender_address.to_multiaddr())
+
+        return len(datagrams)
+
+    # Dispatch a datagram that was already read from the socket
+    def handle_datagram(self, buffer, sender_address):
+        self.input_buffer = buffer
+        if self.log_messages:
+            self.logger.info("[GossipService] Message received from %s", sender_address.to_multiaddr())
+
+        self.metrics.datagrams_received.inc()
+        self.metrics.bytes_received.inc(len(buffer))
+        start = time.perf_counter()
+        if codec.is_binary(buffer) and not self.members.find_by_addr(sender_address):
+            self.remember_binary_sender(sender_address)
 
         envolope_in = envolope.MessageEnvolopeIn(self.input_buffer, sender_address)
-        return self.message_handler.handle_new_message(envolope_in)
+        try:
+            result = self.message_handler.handle_new_message(envolope_in)
+        except (ValueError, IndexError, struct.error) as e:
+            # A malformed datagram must not take down the rest of the batch,
+            # but the bugs of the handlers are not hidden as malformed input.
+            self.logger.warning("[GossipService] Malformed message from %s - %s", sender_address.to_multiaddr(), str(e))
+            self.metrics.malformed.inc()
+            result = False
+        self.metrics.handler_latency.observe(time.perf_counter() - start)
+        if not result:
+            self.metrics.unhandled.inc()
+        return result
+
+    # Drive the node from the running asyncio event loop until 'stop' is called.
+    # Datagrams are dispatched as soon as they arrive, and in between the loop
+    # sleeps until the next gossip tick or retry deadline.
+    async def run(self):
+        if self.running:
+            self.logger.warning("[GossipService] Failed to run - already running.")
+            return False
+
+        self.running = True
+        self.wakeup_event = asyncio.Event()
+        transport = await self.messaging_service.attach(self.on_datagram)
+        self.logger.info("[GossipService] asyncio driver started.")
+
+        try:
+            while self.running:
+                if (self.state == state.STATE_CONNECTED):
+                    self.tick()
+
+                if (self.state == state.STATE_JOINING or self.state == state.STATE_CONNECTED):
+                    self.send()
+
+                self.wakeup_event.clear()
+                timeout = self.time_till_next_event()
+                try:
+                    await asyncio.wait_for(self.wakeup_event.wait(), timeout / 1000)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+            self.wakeup_event = None
+            transport.close()
+            self.logger.info("[GossipService] asyncio driver stopped.")
+
+        return True
+
+    # Stop the node. Wakes up the asyncio driver if it's running,
+    # otherwise closes the socket right away.
+    def stop(self):
+        self.state = state.STATE_DISCONNECTED
+        if self.delivery is not None:
+            self.delivery.close()
+
+        if self.running:
+            self.running = False
+            self.wakeup()
+            return True
+
+        self.messaging_service.close()
+        return True
+
+    # Callback for the datagrams delivered by the asyncio transport
+    def on_datagram(self, buffer, sender_address):
+        self.handle_datagram(buffer, sender_address)
+        self.wakeup()
+
+    # Make the asyncio driver flush the outbound queue on its next iteration
+    def wakeup(self):
+        if self.wakeup_event is not None:
+            self.wakeup_event.set()
+
+    # Time in milliseconds until either the next gossip tick or
+    # the next outbound message is due.
+    def time_till_next_event(self):
+        current_ts = util.get_time()
+        next_ts = current_ts + config.GOSSIP_TICK_INTERVAL
+        if (self.state == state.STATE_CONNECTED):
+            next_ts = min(next_ts, self.last_gossip_ts + config.GOSSIP_TICK_INTERVAL)
+
+        if self.pending_acks or self.plumtree.pending_ihaves:
+            return 0
+
+        next_deadlines = [self.outbound_messages.next_deadline(), self.plumtree.next_deadline()]
+        if (self.state == state.STATE_CONNECTED and self.failure_detection):
+            next_deadlines.append(self.failure_detector.next_deadline())
+        if self.pending_joins or self.pending_snapshots:
+            next_deadlines.append(self.join_batch_deadline)
+
+        for next_deadline in next_deadlines:
+            if next_deadline is not None:
+                next_ts = min(next_ts, next_deadline)
+
+        return max(0, next_ts - current_ts)
 
 
     # Join the cluster
@@ -146,18 +486,33 @@ class GossipService:
     def send_data(self, payload, recipient=None):
         # Only allowed to send data iff node has requested to join or connected to the cluster.
         if (self.state != state.STATE_JOINING and self.state != state.STATE_CONNECTED):
-            self.logger.warning("[GossipService] Failed to send_data - not connected.")
+            if self.log_messages:
+                self.logger.warning("[GossipService] Failed to send_data - not connected.")
             return False
 
-        return self.enqueue_data(payload, recipient)
+        # Don't take the data in if the outbound queue can't hold it.
+        if not self.outbound_messages.admits(message.MESSAGE_DATA_TYPE):
+            self.logger.warning("[GossipService] Failed to send_data - outbound message queue is full.")
+            return False
+
+        result = self.enqueue_data(payload, recipient)
+        self.wakeup()
+        return result
 
 
     # Time tickes before sending next data
     def tick(self):
         if (self.state != state.STATE_CONNECTED):
-            self.logger.warning("[GossipService] Failed to tick - not connected.")
+            if self.log_messages:
+                self.logger.warning("[GossipService] Failed to tick - not connected.")
             return False
 
+        if (self.pending_joins or self.pending_snapshots) and util.get_time() >= self.join_batch_deadline:
+            self.flush_joins()
+
+        if self.failure_detection:
+            self.detect_failures()
+
         next_gossip_ts = self.last_gossip_ts + config.GOSSIP_TICK_INTERVAL
         current_ts = util.get_time()
         if (next_gossip_ts > current_ts):
@@ -167,9 +522,220 @@ class GossipService:
         if (enqueued_result < 0):
             return enqueued_result
 
+        self.enqueue_hot_rumors()
+        if self.partial_view:
+            self.maintain_view()
+        if self.piggyback_membership and current_ts >= self.next_member_list_sync_ts:
+            self.sync_member_list(current_ts)
+
         self.last_gossip_ts = current_ts
         return True
 
+    # Run the SWIM failure detector: probe the next member once per protocol
+    # period, ask other members to probe it if the Ping timed out, suspect
+    # it if nobody got an answer, and declare the suspects which didn't
+    # refute the suspicion dead.
+    def detect_failures(self):
+        detector = self.failure_detector
+        current_ts = util.get_time()
+
+        if detector.is_ping_late(current_ts):
+            detector.probe.indirect = True
+            target = detector.probe.target
+            helpers = [member for member in self.members.random_members(detector.indirect_probes + 1) or []
+                       if not member.address.equals(target) and member.version >= config.PROTOCOL_VERSION_SWIM]
+            for helper in helpers[:detector.indirect_probes]:
+                sequence_num = self.enqueue_ping_req(helper.address, target)
+                if sequence_num:
+                    detector.probe.sequence_nums.add(sequence_num)
+
+        elif detector.is_probe_failed(current_ts):
+            target = detector.probe.target
+            detector.probe = None
+            suspect = self.members.find_by_addr(target)
+            if suspect:
+                self.logger.info("[GossipService] Member %s is a suspect.", target.to_multiaddr())
+                incarnation = detector.health_of(target.key()).incarnation
+                detector.update(target.key(), failure_detector.MEMBER_SUSPECT, incarnation, current_ts)
+                self.enqueue_member_state(failure_detector.MEMBER_SUSPECT, suspect, incarnation)
+
+        if current_ts >= detector.next_probe_ts and (detector.probe is None or detector.probe.acked):
+            target = detector.next_target(self.members, config.PROTOCOL_VERSION_SWIM)
+            sequence_num = self.enqueue_ping(target) if target is not None else False
+            if sequence_num:
+                detector.start_probe(target, sequence_num, current_ts)
+            else:
+                # Nobody to probe, try again in the next protocol period.
+                detector.next_probe_ts = current_ts + detector.probe_interval
+
+        for address_key in detector.expired_suspects(current_ts):
+            dead = self.members.find_by_key(address_key)
+            incarnation = detector.health_of(address_key).incarnation
+            detector.update(address_key, failure_detector.MEMBER_DEAD, incarnation, current_ts)
+            if dead:
+                self.logger.info("[GossipService] Member %s is dead.", dead.address.to_multiaddr())
+                self.enqueue_member_state(failure_detector.MEMBER_DEAD, dead, incarnation)
+                self.remove_member(dead.address)
+
+        return True
+
+    # Apply the news about the member's state from another member, and
+    # spread it further if it's news to us.
+    def apply_member_state(self, member_state, incarnation, news_member):
+        detector = self.failure_detector
+        current_ts = util.get_time()
+
+        if news_member.address.equals(self.self_address):
+            # Refute the suspicion with a higher incarnation number. A stale
+            # suspicion comes from members which never heard our current
+            # incarnation number (they joined later), announce it again.
+            if member_state != failure_detector.MEMBER_ALIVE:
+                if incarnation >= detector.incarnation:
+                    detector.incarnation = incarnation + 1
+                self.enqueue_member_state(failure_detector.MEMBER_ALIVE, self.this_member, detector.incarnation)
+            return True
+
+        address_key = news_member.address.key()
+        known = self.members.find_by_addr(news_member.address)
+        if not known and self.partial_view:
+            # Only the active view is tracked, other members are backups at most.
+            if member_state == failure_detector.MEMBER_ALIVE:
+                self.view.add_passive(news_member, self.self_address, self.members)
+            else:
+                self.view.remove_passive(address_key)
+            return True
+
+        if not known and member_state != failure_detector.MEMBER_ALIVE:
+            return True
+
+        if not detector.update(address_key, member_state, incarnation, current_ts):
+            return True
+
+        if member_state == failure_detector.MEMBER_ALIVE and not known:
+            self.members.put([news_member])
+        elif member_state == failure_detector.MEMBER_DEAD:
+            self.remove_member(news_member.address)
+
+        return self.enqueue_member_state(member_state, news_member, incarnation)
+
+    # The member is probed by the failure detector.
+    def is_probed(self, address):
+        return self.failure_detection and self.peer_version(address) >= config.PROTOCOL_VERSION_SWIM
+
+    # Forget the member and everything we keep about it.
+    def remove_member(self, address):
+        address_key = address.key()
+        self.members.remove_by_addr(address)
+        self.status_baselines.pop(address_key, None)
+        self.status_deltas.pop(address_key, None)
+        self.rtt.remove(address_key)
+        self.plumtree.remove_peer(address_key)
+        self.failure_detector.remove(address_key)
+        self.view.remove_passive(address_key)
+        self.view.neighbor_answered(address_key)
+
+    # Add the member to the active view. A full view makes room by moving
+    # a random active member to the passive view, and tells it so.
+    def add_active(self, new_member):
+        address_key = new_member.address.key()
+        self.view.neighbor_answered(address_key)
+        if new_member.address.equals(self.self_address):
+            return False
+
+        if not self.members.find_by_key(address_key) and self.view.is_active_full(self.members):
+            victim = random.choice(self.members.get_set())
+            self.logger.info("[GossipService] Member %s moved to the passive view.", victim.address.to_multiaddr())
+            self.enqueue_view(message.VIEW_DISCONNECT, victim)
+            self.remove_member(victim.address)
+            self.view.add_passive(victim, self.self_address, self.members)
+
+        self.view.remove_passive(address_key)
+        self.members.put([new_member])
+        return True
+
+    # The member joined through us: take it into the active view and
+    # start the random walks introducing it to other members.
+    def join_partial_view(self, new_member):
+        self.add_active(new_member)
+        for peer in list(self.members.get_set()):
+            if not peer.address.equals(new_member.address):
+                self.enqueue_view(message.VIEW_FORWARD_JOIN, peer, new_member, self.view.active_walk)
+
+        return True
+
+    # Next hop of the random walk introducing 'new_member'. The walk ends
+    # with the member taken into the active view, and on the way it's
+    # added to the passive view at the 'passive_walk' hop.
+    def forward_join(self, new_member, ttl, sender):
+        if new_member.address.equals(self.self_address) or self.members.find_by_addr(new_member.address):
+            return True
+
+        candidates = [peer for peer in self.members.get_set()
+                      if not peer.address.equals(sender) and not peer.address.equals(new_member.address) and
+                         peer.version >= config.PROTOCOL_VERSION_PARTIAL_VIEW]
+        if ttl == 0 or self.members.get_size() <= 1 or not candidates:
+            self.add_active(new_member)
+            return self.enqueue_view(message.VIEW_NEIGHBOR_ACCEPT, new_member)
+
+        if ttl == self.view.passive_walk:
+            self.view.add_passive(new_member, self.self_address, self.members)
+
+        return self.enqueue_view(message.VIEW_FORWARD_JOIN, random.choice(candidates), new_member, ttl - 1)
+
+    # The member asks to be taken into the active view. It's refused if the
+    # view is full, unless the member has no active members at all.
+    def accept_neighbor(self, requester, priority):
+        if priority or self.members.find_by_addr(requester.address) or not self.view.is_active_full(self.members):
+            self.add_active(requester)
+            return self.enqueue_view(message.VIEW_NEIGHBOR_ACCEPT, requester)
+
+        self.view.add_passive(requester, self.self_address, self.members)
+        return self.enqueue_view(message.VIEW_NEIGHBOR_REJECT, requester)
+
+    # Next hop of the random walk of a shuffle started by 'origin'. The
+    # member where the walk ends answers with as many passive members and
+    # keeps the ones it got.
+    def shuffle_view(self, origin, ttl, sample, sender):
+        if origin.address.equals(self.self_address):
+            return True
+
+        candidates = [peer for peer in self.members.get_set()
+                      if not peer.address.equals(sender) and not peer.address.equals(origin.address) and
+                         peer.version >= config.PROTOCOL_VERSION_PARTIAL_VIEW]
+        if ttl > 0 and candidates:
+            return self.enqueue_view(message.VIEW_SHUFFLE, random.choice(candidates), origin, ttl - 1, sample)
+
+        reply = self.view.random_passive(len(sample))
+        for sampled in sample + [origin]:
+            self.view.add_passive(sampled, self.self_address, self.members)
+
+        return self.enqueue_view(message.VIEW_SHUFFLE_REPLY, origin, None, 0, reply)
+
+    # Refill the active view from the passive view, and shuffle the passive
+    # view with a random walk once per 'PARTIAL_VIEW_SHUFFLE_INTERVAL'.
+    def maintain_view(self):
+        current_ts = util.get_time()
+        candidate = self.view.neighbor_candidate(self.members, current_ts)
+        if candidate is not None:
+            kind = message.VIEW_NEIGHBOR if self.members.get_size() else message.VIEW_NEIGHBOR_PRIORITY
+            if not self.enqueue_view(kind, candidate):
+                self.view.remove_passive(candidate.address.key())
+                self.view.neighbor_answered(candidate.address.key())
+
+        if current_ts < self.view.next_shuffle_ts:
+            return True
+
+        targets = self.members.random_members(1)
+        if not targets:
+            return True
+
+        sample = self.view.shuffle_sample(self.members,
+                                          config.PARTIAL_VIEW_SHUFFLE_ACTIVE,
+                                          config.PARTIAL_VIEW_SHUFFLE_PASSIVE,
+                                          current_ts)
+        sample = [sampled for sampled in sample if not sampled.address.equals(targets[0].address)]
+        return self.enqueue_view(message.VIEW_SHUFFLE, targets[0], self.this_member, self.view.active_walk, sample)
+
     # Current state of this node
     def current_state(self):
         return self.state
@@ -180,70 +746,335 @@ class GossipService:
 
     # Clear the outbound message queue
     def clear_envolope(self):
-        self.outbound_messages = []
+        self.outbound_messages.clear()
+        self.pending_rumors = {}
+        self.dissemination.clear()
 
     # Append the message to the outbound queue
     def enqueue_envolope(self, env):
-        self.outbound_messages.append(env)
+        return self.outbound_messages.enque(env)
 
     # Remove the message from the outbound queue
     def dequeue_envolope(self, env):
-        self.outbound_messages.remove(env)
-
-    # Find the message by it's 'sequence_num'
-    def find_envolope_by_sequence_num(self, sequence_num):
-        for env in self.outbound_messages:
-            if env.sequence_num == sequence_num:
-                return env
-
-        return False
+        self.outbound_messages.deque(env)
+        self.pending_statuses.pop((env.sequence_num, env.recipient.key()), None)
+        if not self.outbound_messages.has_sequence_num(env.sequence_num):
+            self.pending_rumors.pop(env.sequence_num, None)
+
+    # Remove the message acknowledged by its recipient from the outbound queue.
+    # 'duplicate' tells the recipient already had the acknowledged Data.
+    def acknowledge_envolope(self, env, duplicate=False):
+        recipient_key = env.recipient.key()
+        clock_idx = self.pending_statuses.pop((env.sequence_num, recipient_key), None)
+        if clock_idx is not None:
+            # The recipient knows our clock as of this version.
+            baseline = self.status_baselines.get(recipient_key, 0)
+            self.status_baselines[recipient_key] = max(baseline, clock_idx)
+
+        rumor_state = self.pending_rumors.get(env.sequence_num)
+        if duplicate and rumor_state is not None:
+            self.rumor_counters['feedback'] += 1
+            if rumor_state.feedback(self.rumor_stop, self.rumor_stop_k):
+                self.stop_rumor(rumor_state)
+
+        # The round trip is only known for sure if the message was sent once.
+        if env.attempt_num == 1:
+            self.rtt.add_sample(recipient_key, util.get_time() - env.attempt_ts)
+
+        self.dequeue_envolope(env)
+
+    # Time in milliseconds to wait for the acknowledgement of the message
+    # before it's sent again.
+    def retry_interval(self, env):
+        if not self.adaptive_retry:
+            return config.MESSAGE_RETRY_INTERVAL
+
+        return self.rtt.timeout(env.recipient.key(), env.attempt_num)
+
+    # Find the message by it's 'sequence_num'. All the envolopes of the same
+    # message share the sequence number, so the recipient tells them apart.
+    def find_envolope_by_sequence_num(self, sequence_num, recipient):
+        return self.outbound_messages.find(sequence_num, recipient.key())
 
     # Add the messages to the outbound queue
 
     # Hello message
     def enqueue_hello(self, recipient):
-        self.logger.info("[GossipService] Enque Hello message to %s", recipient.to_multiaddr())
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Hello message to %s", recipient.to_multiaddr())
         hello = message_factory.MessageFactory.getInstance().create(message.MESSAGE_HELLO_TYPE)
         hello.this_member = self.this_member
         return self.enqueue_message(hello, recipient, config.GOSSIP_DIRECT)
 
-    # Ack message
-    def enqueue_ack(self, sequence_num, recipient):
-        self.logger.info("[GossipService] Enque Ack message to %s", recipient.to_multiaddr())
+    # Ack message. Members which understand selective acknowledgements
+    # get a single Sack message for all messages on the next send.
+    # 'duplicate' tells the sender we already had the acknowledged Data.
+    def enqueue_ack(self, sequence_num, recipient, duplicate=False):
+        if self.aggregate_acks and self.peer_version(recipient) >= config.PROTOCOL_VERSION_SACK:
+            pending = self.pending_acks.setdefault(recipient.key(), (recipient, [], []))
+            pending[2 if duplicate else 1].append(sequence_num)
+            return True
+
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Ack message to %s", recipient.to_multiaddr())
         ack = message_factory.MessageFactory.getInstance().create(message.MESSAGE_ACK_TYPE)
-        ack.sequence_num = sequence_num
+        ack.ack_sequence_num = sequence_num
+        if duplicate:
+            ack.reserved |= message.ACK_FLAG_DUPLICATE
         return self.enqueue_message(ack, recipient, config.GOSSIP_DIRECT)
 
+    # Sack messages for all the acknowledgements owed to members
+    def flush_acks(self):
+        pending_acks = self.pending_acks
+        self.pending_acks = {}
+        for recipient, sequence_nums, duplicate_nums in pending_acks.values():
+            if self.log_messages:
+                self.logger.info("[GossipService] Enque Sack message to %s", recipient.to_multiaddr())
+            ranges = message.Sack.to_ranges(sequence_nums)
+            duplicates = message.Sack.to_ranges(duplicate_nums)
+            while ranges or duplicates:
+                sack = message_factory.MessageFactory.getInstance().create(message.MESSAGE_SACK_TYPE)
+                sack.ranges = ranges[:message.SACK_MAX_RANGES]
+                ranges = ranges[message.SACK_MAX_RANGES:]
+                room = message.SACK_MAX_RANGES - len(sack.ranges)
+                if room and duplicates:
+                    sack.duplicates = duplicates[:room]
+                    sack.reserved |= message.SACK_FLAG_DUPLICATES
+                    duplicates = duplicates[room:]
+
+                if not self.enqueue_message(sack, recipient, config.GOSSIP_DIRECT):
+                    return False
+
+        return True
+
+    # Ping message. Returns the sequence number of the message the Ack refers to.
+    def enqueue_ping(self, recipient):
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Ping message to %s", recipient.to_multiaddr())
+        ping = message_factory.MessageFactory.getInstance().create(message.MESSAGE_PING_TYPE)
+        if not self.enqueue_message(ping, recipient, config.GOSSIP_DIRECT):
+            return False
+
+        return ping.sequence_num
+
+    # PingReq message, asks the recipient to ping the 'target'.
+    def enqueue_ping_req(self, recipient, target):
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque PingReq message to %s", recipient.to_multiaddr())
+        ping_req = message_factory.MessageFactory.getInstance().create(message.MESSAGE_PING_REQ_TYPE)
+        ping_req.target = target
+        if not self.enqueue_message(ping_req, recipient, config.GOSSIP_DIRECT):
+            return False
+
+        return ping_req.sequence_num
+
+    # MemberState message, piggybacked on the outgoing datagrams or
+    # spread to random members. While some members understand MemberState
+    # messages but not piggybacked events, the message is spread as well.
+    def enqueue_member_state(self, member_state, news_member, incarnation):
+        if self.piggyback_membership:
+            self.dissemination.add(member_state, news_member, incarnation, self.next_sequence_num())
+            if not any(config.PROTOCOL_VERSION_SWIM <= version < config.PROTOCOL_VERSION_PIGGYBACK
+                       for version in self.members.versions):
+                return True
+
+        member_state_msg = message_factory.MessageFactory.getInstance().create(message.MESSAGE_MEMBER_STATE_TYPE)
+        member_state_msg.reserved = member_state
+        member_state_msg.member = news_member
+        member_state_msg.incarnation = incarnation
+        return self.enqueue_message(member_state_msg, None, config.GOSSIP_RANDOM)
+
+    # A member joined through us. Newcomers arriving within the join batch
+    # window are announced together, and share one encoded snapshot of the
+    # member list.
+    def add_newcomer(self, new_member):
+        if not self.pending_joins and not self.pending_snapshots:
+            self.join_batch_deadline = util.get_time() + self.join_batch_window
+
+        self.pending_joins[new_member.address.key()] = new_member
+        if self.join_batch_window <= 0:
+            return self.flush_joins()
+
+        return True
+
+    # Push a random sample of our members, this node included, to a random
+    # member in a single MemberList message. The member catches up on the
+    # piggybacked events it missed.
+    def sync_member_list(self, current_ts):
+        self.next_member_list_sync_ts = current_ts + config.MEMBER_LIST_SYNC_INTERVAL
+        targets = self.members.random_members(1)
+        if not targets:
+            return True
+
+        sample = self.members.random_members(config.MEMBER_LIST_SYNC_SIZE - 1)
+        return self.enqueue_member_list(targets[0].address, None, sample + [self.this_member])
+
+    # Announce the newcomers of the batch to the other members, and send
+    # them the list of all members, themselves included. Newcomers whose
+    # list doesn't fit into the outbound queue get it in the next window.
+    def flush_joins(self):
+        newcomers = list(self.pending_joins.values())
+        self.pending_joins = collections.OrderedDict()
+        if newcomers:
+            self.logger.info("[GossipService] %s members joined.", len(newcomers))
+            newcomer_keys = {newcomer.address.key() for newcomer in newcomers}
+            others = [peer for peer in self.members.get_set() if peer.address.key() not in newcomer_keys]
+            self.members.put(newcomers)
+            for newcomer in newcomers:
+                self.pending_snapshots[newcomer.address.key()] = newcomer
+
+            self.enqueue_join(newcomers, others)
+
+        snapshot = []
+        while self.pending_snapshots:
+            address_key, newcomer = next(iter(self.pending_snapshots.items()))
+            if (self.members.get_size() > 1 and
+                not self.enqueue_member_list(newcomer.address, snapshot)):
+                self.join_batch_deadline = util.get_time() + self.join_batch_window
+                return False
+
+            del self.pending_snapshots[address_key]
+
+        return True
+
+    # Spread the news about the members which joined through us to the
+    # 'peers'. Members taking piggybacked events get it with the outgoing
+    # datagrams, the other members get MemberList messages.
+    def enqueue_join(self, new_members, peers):
+        if self.piggyback_membership:
+            for new_member in new_members:
+                health = self.failure_detector.health_of(new_member.address.key())
+                incarnation = health.incarnation
+                if health.state == failure_detector.MEMBER_DEAD:
+                    # The member restarted, its news has to outrank the tombstone.
+                    incarnation += 1
+                self.failure_detector.update(new_member.address.key(), failure_detector.MEMBER_ALIVE, incarnation, util.get_time())
+                self.dissemination.add(failure_detector.MEMBER_ALIVE, new_member, incarnation, self.next_sequence_num())
+
+            peers = [peer for peer in peers if peer.version < config.PROTOCOL_VERSION_PIGGYBACK]
+
+        snapshot = []
+        for peer in peers:
+            if not self.enqueue_member_list(peer.address, snapshot, new_members):
+                return False
+
+        return True
+
+    # View message of the given kind. 'view_member' defaults to this node.
+    def enqueue_view(self, kind, recipient, view_member=None, ttl=0, members=()):
+        if recipient.version < config.PROTOCOL_VERSION_PARTIAL_VIEW:
+            return False
+
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque View message %s to %s", kind, recipient.address.to_multiaddr())
+        view = message_factory.MessageFactory.getInstance().create(message.MESSAGE_VIEW_TYPE)
+        view.reserved = kind
+        view.member = view_member if view_member is not None else self.this_member
+        view.ttl = ttl
+        view.members = list(members)
+        return self.enqueue_message(view, recipient.address, config.GOSSIP_DIRECT)
+
     # Welcome message
     def enqueue_welcome(self, hello_sequence_num, recipient):
-        self.logger.info("[GossipService] Enque Welcom message to %s", recipient.to_multiaddr())
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Welcom message to %s", recipient.to_multiaddr())
         welcome = message_factory.MessageFactory.getInstance().create(message.MESSAGE_WELCOME_TYPE)
         welcome.hello_sequence_num = hello_sequence_num
         welcome.this_member = self.this_member
         return self.enqueue_message(welcome, recipient, config.GOSSIP_DIRECT)
 
-    # Staus message
-    def enqueue_status(self, recipient):
+    # Staus message. 'data_version' overrides the clock to send,
+    # such a Status is marked as a delta. 'buckets' is the mask of the
+    # digest buckets whose records are all included in 'data_version'.
+    def enqueue_status(self, recipient, data_version=None, buckets=0):
         if recipient == None:
-            self.logger.info("[GossipService] Gossip the Status message.")
+            if self.log_messages:
+                self.logger.info("[GossipService] Gossip the Status message.")
+            if self.delta_status or self.digest_status:
+                return self.enqueue_status_gossip()
         else:
-            self.logger.info("[GossipService] Enque Status message to %s", recipient.to_multiaddr())
+            if self.log_messages:
+                self.logger.info("[GossipService] Enque Status message to %s", recipient.to_multiaddr())
 
         status = message_factory.MessageFactory.getInstance().create(message.MESSAGE_STATUS_TYPE)
-        status.data_version.copy(self.data_version)
+        if data_version is None:
+            status.data_version.copy(self.data_version)
+        else:
+            status.data_version = data_version
+            status.reserved |= message.STATUS_FLAG_DELTA
+
+        if buckets:
+            status.buckets = buckets
+            status.reserved |= message.STATUS_FLAG_BUCKETS
+
         spreading_type = config.GOSSIP_DIRECT
         if recipient == None:
            spreading_type = config.GOSSIP_RANDOM
 
         return self.enqueue_message(status, recipient, spreading_type)
 
+    # Gossip the Status message to random members. Members which acknowledged
+    # a Status before get only the records changed since then. Otherwise
+    # members get the digest of the clock, or the full clock if they don't
+    # understand digests. An acknowledged Status doesn't mean the member got
+    # the data it asked for, so every 'STATUS_FULL_INTERVAL'-th Status skips
+    # the delta.
+    def enqueue_status_gossip(self):
+        members = self.members.random_members(config.MESSAGE_RUMOR_FACTOR)
+        if not members:
+           self.logger.warning("[GossipService] Member list is empty.")
+           return False
+
+        for member in members:
+            recipient_key = member.address.key()
+            version = self.peer_version(member.address)
+            deltas = self.status_deltas.get(recipient_key, 0)
+            baseline = None
+            if (self.delta_status and version >= config.PROTOCOL_VERSION_DELTA and
+                deltas < config.STATUS_FULL_INTERVAL - 1):
+                baseline = self.status_baselines.get(recipient_key)
+
+            changes = None
+            if baseline is not None:
+                changes = self.data_version.changes_since(baseline)
+
+            status = message_factory.MessageFactory.getInstance().create(message.MESSAGE_STATUS_TYPE)
+            if changes is not None and changes.records:
+                # Only the records changed since the member's baseline.
+                status.data_version = changes
+                status.reserved |= message.STATUS_FLAG_DELTA
+
+            elif self.digest_status and version >= config.PROTOCOL_VERSION_DIGEST:
+                # Let the member check whether we are in sync.
+                status.digest = list(self.data_version.digest)
+                status.reserved |= message.STATUS_FLAG_DIGEST
+
+            elif changes is not None:
+                # Nothing changed since the member's baseline.
+                self.status_deltas[recipient_key] = deltas + 1
+                continue
+
+            else:
+                # The member's baseline is unknown, send the full clock.
+                status.data_version.copy(self.data_version)
+
+            # Count the deltas, so the member gets the digest or the full clock periodically.
+            self.status_deltas[recipient_key] = deltas + 1 if changes is not None else 0
+            if not self.enqueue_message(status, member.address, config.GOSSIP_DIRECT):
+                return False
+
+            self.pending_statuses[(status.sequence_num, recipient_key)] = self.data_version.current_idx
+
+        return True
+
     # Data message
     def enqueue_data(self, payload, recipient=None):
         spreading_type = config.GOSSIP_DIRECT
         if recipient is None:
             spreading_type = config.GOSSIP_RANDOM
 
-        self.logger.info("[GossipService] Enque Data message.")
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Data message.")
 
         # Update the local data version.
         self.data_counter += 1
@@ -252,133 +1083,349 @@ class GossipService:
         if not record:
             return False
 
+        if self.rumor_tracing:
+            self.tracer.originated(record, util.get_time())
+
         data = message_factory.MessageFactory.getInstance().create(message.MESSAGE_DATA_TYPE)
-        record.copy(data.data_version)
+        data.data_version.copy(record)
         data.data = payload
 
         # Add the data to our internal log.
-        self.data_log.add_data_log(data)
+        log_record = self.data_log.add_data_log(data)
+
+        # Enque the data to outbound message queue to be dispatched.
+        # The log keeps the encoded buffers for the later Status exchanges.
+        if spreading_type == config.GOSSIP_RANDOM:
+            return self.enqueue_rumor(log_record, 0)
+
+        return self.enqueue_message(data, recipient, spreading_type, log_record.buffers)
+
+    # Start spreading the data of the log 'record' to random members.
+    # 'hops' is the number of hops the data made to reach us. Unless the
+    # rumors stop right away, the rumor stays hot and it's pushed again
+    # on every Gossip tick, see 'enqueue_hot_rumors'.
+    def enqueue_rumor(self, record, hops, sender=None):
+        if self.rumor_max_hops and hops >= self.rumor_max_hops:
+            self.rumor_counters['expired'] += 1
+            return True
+
+        if self.epidemic_tree:
+            return self.enqueue_tree_data(record, hops, sender)
+
+        rumor_state = rumor.Rumor(record, hops)
+        if self.rumor_stop != config.RUMOR_STOP_NONE:
+            member_id = record.version.member_id
+            self.hot_rumors.pop(member_id, None)
+            self.hot_rumors[member_id] = rumor_state
+            while len(self.hot_rumors) > config.RUMOR_MAX_HOT:
+                self.hot_rumors.popitem(last=False)
+                self.rumor_counters['stopped'] += 1
+
+        return self.push_rumor(rumor_state)
+
+    # Push the hot rumors once more, and cool down the ones which were
+    # replaced by a newer data or pushed for too long.
+    def enqueue_hot_rumors(self):
+        for rumor_state in list(self.hot_rumors.values()):
+            if rumor_state.is_obsolete() or rumor_state.rounds >= self.rumor_max_rounds:
+                self.stop_rumor(rumor_state)
+                continue
+
+            rumor_state.rounds += 1
+            if not self.push_rumor(rumor_state):
+                return False
+
+        return True
 
-        # Enque the data to outbound message queue to be dispatched
-        return self.enqueue_message(data, recipient, spreading_type)
+    def stop_rumor(self, rumor_state):
+        member_id = rumor_state.record.version.member_id
+        if self.hot_rumors.get(member_id) is rumor_state:
+            del self.hot_rumors[member_id]
+            self.rumor_counters['stopped'] += 1
+
+    # Push the data of the log 'record' to the eager peers of the broadcast
+    # tree and announce it to the lazy ones. 'sender' is the member we
+    # received the data from, it's the parent of this node in the tree.
+    def enqueue_tree_data(self, record, hops, sender=None):
+        self.plumtree.refresh(self.members, config.PROTOCOL_VERSION_PLUMTREE)
+        sender_key = None
+        if sender is not None:
+            sender_key = sender.key()
+            self.plumtree.remove_missing(record.version)
+            self.plumtree.add_eager(sender)
+
+        data = record.create_data_message()
+        data.reserved = min(hops + 1, message.DATA_MAX_HOPS)
+        buffers = {version: message.stamp_reserved(buffer, data.reserved) for version, buffer in record.buffers.items()}
+        for address_key, address in list(self.plumtree.eager_peers.items()):
+            if address_key == sender_key:
+                continue
+
+            if not self.enqueue_message(data, address, config.GOSSIP_DIRECT, buffers):
+                return False
+
+        for version, buffer in buffers.items():
+            record.buffers.setdefault(version, buffer)
+
+        self.plumtree.announce(record.version, sender_key)
+        self.rumor_counters['pushed'] += 1
+        return True
 
-    # Data log message
-    def enqueue_data_log(self, recipient_version, recipient):
-        self.logger.info("[GossipService] Enque DataLog to %s", recipient.to_multiaddr())
+    # The 'sender' pushed the Data we already had, only announcements
+    # are needed from it.
+    def prune_tree_peer(self, sender):
+        if self.peer_version(sender) < config.PROTOCOL_VERSION_PLUMTREE:
+            return True
+
+        self.plumtree.add_lazy(sender)
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque Prune message to %s", sender.to_multiaddr())
+        prune = message_factory.MessageFactory.getInstance().create(message.MESSAGE_PRUNE_TYPE)
+        return self.enqueue_message(prune, sender, config.GOSSIP_DIRECT)
+
+    # IHave messages for the Data announced to the lazy peers, and Graft
+    # messages for the Data announced to us but not received in time.
+    def flush_tree(self):
+        for recipient, records in self.plumtree.take_ihaves():
+            if self.peer_version(recipient) < config.PROTOCOL_VERSION_PLUMTREE:
+                continue
+
+            for i in range(0, len(records), config.PLUMTREE_IHAVE_BATCH):
+                ihave = message_factory.MessageFactory.getInstance().create(message.MESSAGE_IHAVE_TYPE)
+                ihave.data_version = plumtree.records_clock(records[i:i + config.PLUMTREE_IHAVE_BATCH])
+                if not self.enqueue_message(ihave, recipient, config.GOSSIP_DIRECT):
+                    return False
+
+        grafts = {}  # map<address key, (address, list of VectorRecord)>
+        for announcer, record in self.plumtree.due_grafts(util.get_time(), config.PLUMTREE_GRAFT_TIMEOUT):
+            grafts.setdefault(announcer.key(), (announcer, []))[1].append(record)
+
+        for recipient, records in grafts.values():
+            # The announcer becomes our parent in the tree.
+            self.plumtree.add_eager(recipient)
+            if self.log_messages:
+                self.logger.info("[GossipService] Enque Graft message to %s", recipient.to_multiaddr())
+            graft = message_factory.MessageFactory.getInstance().create(message.MESSAGE_GRAFT_TYPE)
+            graft.data_version = plumtree.records_clock(records)
+            if not self.enqueue_message(graft, recipient, config.GOSSIP_DIRECT):
+                return False
+
+        return True
+
+    # Data message of the rumor to 'rumor_fanout' random members, with the hop count in 'reserved'.
+    def push_rumor(self, rumor_state):
+        record = rumor_state.record
+        data = record.create_data_message()
+        data.reserved = min(rumor_state.hops + 1, message.DATA_MAX_HOPS)
+        buffers = {version: message.stamp_reserved(buffer, data.reserved) for version, buffer in record.buffers.items()}
+        if not self.enqueue_message(data, None, config.GOSSIP_RANDOM, buffers, self.rumor_fanout):
+            return False
+
+        # Keep the buffers encoded for the new members' wire version.
+        for version, buffer in buffers.items():
+            record.buffers.setdefault(version, buffer)
+
+        self.pending_rumors[data.sequence_num] = rumor_state
+        self.rumor_counters['pushed'] += 1
+        return True
+
+    # Data log message. With 'partial' the recipient version is a delta,
+    # so only the records present in it, or belonging to the complete
+    # digest 'buckets' of it, are compared.
+    def enqueue_data_log(self, recipient_version, recipient, partial=False, buckets=0):
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque DataLog to %s", recipient.to_multiaddr())
         result = True
         for i in range(len(self.data_log.records)):
             record = self.data_log.records[i]
+            member_id = record.version.member_id
+            if (partial and
+                not recipient_version.find_by_member_id(member_id) and
+                not buckets & (1 << vector_clock.record_bucket(member_id))):
+                continue
+
             result = recipient_version.compare_with_record(record.version, False)
             if (result == vector_clock.VC_BEFORE):
-                # The recipient data version is behind. Enqueue this data payload.
-                data = record.create_data_message()
-                if not data:
-                    return False
-
-                result = self.enqueue_message(data, recipient, config.GOSSIP_DIRECT)
+                # The recipient data version is behind. Enqueue this data payload,
+                # reusing the buffer encoded (or received) earlier.
+                result = self.enqueue_repair(record, recipient)
                 if not result:
                     break
 
         return result
 
-    # MemberList message
-    def enqueue_member_list(self, recipient):
-        self.logger.info("[GossipService] Enque MemberList message to %s", recipient.to_multiaddr())
-        member_list = message_factory.MessageFactory.getInstance().create(message.MESSAGE_MEMBER_LIST_TYPE)
+    # Data of the log record sent straight to a member which missed it.
+    # The hop count starts over, the cached buffers still carry the one of
+    # the member we got the Data from.
+    def enqueue_repair(self, record, recipient):
+        buffers = {version: message.stamp_reserved(buffer, 0) for version, buffer in record.buffers.items()}
+        if not self.enqueue_message(record.create_data_message(), recipient, config.GOSSIP_DIRECT, buffers):
+            return False
 
-        members_num = self.members.get_size()
-        if (members_num == 0):
-            return True
-        
-        # Send the list of all known members to a recipient.
-        # The list can be pretty big, so we split it into multiple messages.
-        total = 0
-        count = 0
-        members_to_send = []
-        for member in self.members.set:
-            total += 1
+        for version, buffer in buffers.items():
+            record.buffers.setdefault(version, buffer)
+        return True
 
-            if (count == config.MEMBER_LIST_SYNC_SIZE or total == members_num):
-                member_list.members = members_to_send
-                member_list.members_n = count
+    # MemberList messages with the 'members' (all known members by default),
+    # split into chunks of 'MEMBER_LIST_SYNC_SIZE'. 'snapshot' is an optional
+    # cache of the encoded chunks, shared by the recipients of the same list.
+    def enqueue_member_list(self, recipient, snapshot=None, members=None):
+        if self.log_messages:
+            self.logger.info("[GossipService] Enque MemberList message to %s", recipient.to_multiaddr())
+        if members is None:
+            members = self.members.get_set()
 
-                result = self.enqueue_message(member_list, recipient, config.GOSSIP_DIRECT)
-                if not result:
-                    return False
+        if snapshot is None:
+            snapshot = []
+
+        # The list can be pretty big, so we split it into multiple messages.
+        for chunk_num, offset in enumerate(range(0, len(members), config.MEMBER_LIST_SYNC_SIZE)):
+            if chunk_num == len(snapshot):
+                snapshot.append({})
+
+            member_list = message_factory.MessageFactory.getInstance().create(message.MESSAGE_MEMBER_LIST_TYPE)
+            member_list.members = members[offset:offset + config.MEMBER_LIST_SYNC_SIZE]
+            if not self.enqueue_message(member_list, recipient, config.GOSSIP_DIRECT, snapshot[chunk_num]):
+                return False
 
-                # reset                
-                count = 0
-                members_to_send = []
-                continue
-            
-            count += 1
-            members_to_send.append(member)
-            
         return True
 
 
     # Helper to enque mesage to the outbound queue
-    def enqueue_message(self, msg, recipient, spreading_type):
-        encoded_msg, max_attempts = self.encode_message(msg)
-        if not encoded_msg:
-            self.logger.warning("[GossipService] Failed to enque message - encode error.")
-            return False
-
+    # 'encoded_msgs' is an optional cache of the message buffers by wire
+    # version. Cached buffers are sent as is, only with a new sequence number.
+    def enqueue_message(self, msg, recipient, spreading_type, encoded_msgs=None, fanout=config.MESSAGE_RUMOR_FACTOR):
         # Distribute the message.
         if spreading_type == config.GOSSIP_DIRECT:
             # Send message to a single recipient.
-            return self.enqueue_to_outbound(encoded_msg, max_attempts, recipient)
+            recipients = [recipient]
 
-        if spreading_type == config.GOSSIP_RANDOM:
-            # Choose some number of random members to distribute the message.
-            members = self.members.random_members(config.MESSAGE_RUMOR_FACTOR)
+        elif spreading_type == config.GOSSIP_RANDOM:
+            # Choose 'fanout' random members to distribute the message.
+            members = self.members.random_members(fanout)
             if not members:
                self.logger.warning("[GossipService] Member list is empty.")
                return False
 
-            for member in members:
-                # Create a new envolope for each recipient.
-                # Note: all created envolopes share the same buffer.
-                result = self.enqueue_to_outbound(encoded_msg, max_attempts, member.address)
-                if not result:
-                    self.logger.warning("[GossipService] Failed to enque message - enque to outbound queue - GOSSIP_RANDOM.")
-                    return result
+            recipients = [member.address for member in members]
 
-        if spreading_type == config.GOSSIP_BROADCAST:
+        elif spreading_type == config.GOSSIP_BROADCAST:
             # Distribute the message to all known members.
-            for member in self.members.get_set():
-                # Create a new envolope for each recipient.
-                # Note: all created envolopes share the same buffer.
-                result = self.enqueue_to_outbound(encoded_msg, max_attempts, member.address)
-                if not result:
-                    self.logger.warning("[GossipService] Failed to enque message - enque to outbound queue - GOSSIP_BROADCAST")
-                    return result
-    
+            recipients = [member.address for member in self.members.get_set()]
+
+        else:
+            return False
+
+        # All envolopes of the message share its sequence number.
+        text_codec = any(self.wire_version(address) < config.PROTOCOL_VERSION_BINARY for address in recipients)
+        msg.sequence_num = self.next_sequence_num(text_codec)
+        max_attempts = self.max_attempts(msg)
+
+        # Create a new envolope for each recipient.
+        # Note: all created envolopes with the same wire version share the same buffer.
+        buffers = {}
+        for address in recipients:
+            version = self.wire_version(address)
+            if version not in buffers:
+                if encoded_msgs is not None and version in encoded_msgs:
+                    buffers[version] = message.stamp_sequence_num(encoded_msgs[version], msg.sequence_num)
+                else:
+                    buffers[version] = self.encode_message(msg, version)
+                    if encoded_msgs is not None:
+                        encoded_msgs[version] = buffers[version]
+
+            encoded_msg = buffers[version]
+            if not encoded_msg:
+                self.logger.warning("[GossipService] Failed to enque message - encode error.")
+                return False
+
+            result = self.enqueue_to_outbound(encoded_msg, max_attempts, address, msg.sequence_num, msg.message_type)
+            if not result:
+                self.logger.warning("[GossipService] Failed to enque message - enque to outbound queue.")
+                return result
+
         return True
 
+    # The protocol version used to encode messages for the given address.
+    # Senders we don't know yet are answered in the codec they used.
+    def wire_version(self, address):
+        if (self.binary_codec and
+            (self.peer_version(address) >= config.PROTOCOL_VERSION_BINARY or
+             address.key() in self.binary_senders)):
+            return config.PROTOCOL_VERSION_BINARY
+
+        return config.PROTOCOL_VERSION_MIN
+
+    # The sender isn't a member, but it speaks the binary codec.
+    def remember_binary_sender(self, address):
+        address_key = address.key()
+        self.binary_senders.pop(address_key, None)
+        self.binary_senders[address_key] = True
+        if len(self.binary_senders) > config.BINARY_SENDERS_SIZE:
+            self.binary_senders.popitem(last=False)
+
 
     # Helper function to enque the encoded 'buffer' to the outbound queue
-    def enqueue_to_outbound(self, buffer, max_attempts, receiver):
-        self.sequence_num += 1
-        seq_num = self.sequence_num
+    def enqueue_to_outbound(self, buffer, max_attempts, receiver, seq_num, message_type=message.MESSAGE_DATA_TYPE):
         new_envolope = envolope.MessageEnvolopeOut(seq_num,
                                                    buffer,
                                                    max_attempts,
-                                                   receiver)
-        self.outbound_messages.append(new_envolope)
+                                                   receiver,
+                                                   message_type,
+                                                   message_queue.message_priority(message_type))
+
+        # The queue is bounded, make room for the message if the overflow policy allows.
+        for dropped_envolope in self.outbound_messages.make_room(new_envolope):
+            if self.log_messages:
+                self.logger.info("[GossipService] Dropped message %s to %s - outbound message queue is full.",
+                                 dropped_envolope.sequence_num, dropped_envolope.recipient.to_multiaddr())
+            self.dequeue_envolope(dropped_envolope)
+            self.metrics.dropped.inc(1, 'overflow')
+
+        if not self.outbound_messages.enque(new_envolope):
+            self.metrics.dropped.inc(1, 'rejected')
+            self.logger.warning("[GossipService] Outbound message queue is full - %s", self.outbound_messages.stats())
+            return False
+
         return True
 
-    # Helper to encode a message
-    def encode_message(self, msg):
-        max_attempts = config.MESSAGE_RETRY_ATTEMPTS
+    # Helper to generate the sequence number of the next message. It wraps
+    # at the 4-digit text field while the message or any member needs the
+    # text codec, binary peers get the varint range.
+    def next_sequence_num(self, text_codec=False):
+        max_sequence_num = message.MESSAGE_MAX_BINARY_SEQUENCE_NUM
+        min_version = self.members.min_version()
+        if (text_codec or not self.binary_codec or
+            (min_version is not None and min_version < config.PROTOCOL_VERSION_BINARY)):
+            max_sequence_num = message.MESSAGE_MAX_SEQUENCE_NUM
 
-        # Serialize the message.
-        encoded_msg = msg.encode()
-        self.logger.info('[GossipService] Serialized message %s of size %s', msg.message_type, len(encoded_msg))
-        if (msg.message_type == message.MESSAGE_WELCOME_TYPE or msg.message_type == message.MESSAGE_ACK_TYPE):
-            max_attempts = 1
+        self.sequence_num = self.sequence_num % max_sequence_num + 1
+        return self.sequence_num
 
-        return encoded_msg, max_attempts
+    # Helper to encode a message
+    def encode_message(self, msg, version=config.PROTOCOL_VERSION_MIN):
+        # Serialize the message. A value which doesn't fit into its text field is refused.
+        try:
+            encoded_msg = message.encode_message(msg, version)
+        except ValueError as e:
+            self.logger.warning('[GossipService] Failed to encode message %s. %s', msg.message_type, str(e))
+            return None
+
+        if self.log_messages:
+            self.logger.info('[GossipService] Serialized message %s of size %s', msg.message_type, len(encoded_msg))
+        return encoded_msg
+
+    # Welcome, Ack, Sack and the broadcast tree messages are never
+    # acknowledged, send them only once.
+    def max_attempts(self, msg):
+        if (msg.message_type == message.MESSAGE_WELCOME_TYPE or msg.message_type == message.MESSAGE_ACK_TYPE or
+            msg.message_type == message.MESSAGE_SACK_TYPE or msg.message_type == message.MESSAGE_IHAVE_TYPE or
+            msg.message_type == message.MESSAGE_GRAFT_TYPE or msg.message_type == message.MESSAGE_PRUNE_TYPE or
+            msg.message_type == message.MESSAGE_PING_TYPE or msg.message_type == message.MESSAGE_PING_REQ_TYPE or
+            msg.message_type == message.MESSAGE_MEMBER_STATE_TYPE):
+            return 1
+
+        return config.MESSAGE_RETRY_ATTEMPTS
 
     def data_log_create_message(self, record, msg):
         data = message.Data(message.MESSAGE_DATA_TYPE, 0)
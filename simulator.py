@@ -0,0 +1,208 @@
+import heapq
+import logging
+import random
+import sys
+import time
+
+import config
+import member_address
+import message_service
+import service
+import state
+import util
+
+# Virtual time in milliseconds, only the simulator moves it.
+class VirtualClock:
+    def __init__(self, start_ts):
+        self.now = start_ts
+
+    def __call__(self):
+        return self.now
+
+# Discrete-event driver running many GossipService instances in one process,
+# connected by a LoopbackNetwork. Nothing sleeps: the virtual clock jumps
+# to the next datagram delivery or the next timer of a node, so the cluster
+# runs much faster than real time. The nodes draw from the 'random' module,
+# which is seeded with 'seed', so a run is reproducible. With 'partial_view'
+# the nodes keep a partial view of the cluster, see 'partial_view.py'.
+class Simulator:
+    def __init__(self, seed=0, loss=0.0, latency=(1, 5), logger=None, start_ts=1000000, partial_view=False):
+        random.seed(seed)
+        self.partial_view = partial_view
+        self.clock = VirtualClock(start_ts)
+        util.set_clock(self.clock)
+        self.network = message_service.LoopbackNetwork(loss, latency, random.Random(seed))
+
+        if logger is None:
+            logger = logging.getLogger('simulator')
+            logger.setLevel(logging.ERROR)
+        self.logger = logger
+
+        self.nodes = []        # GossipService
+        self.wake_ts = []      # the time each node runs next
+        self.wakeups = []      # heap of (ts, node index), stale entries are skipped
+        self.indexes = {}      # map<LoopbackMessageService, node index>
+        self.received = []     # Data payloads received by each node
+
+    # Stop all the nodes and restore the wall clock.
+    def close(self):
+        for node in self.nodes:
+            node.stop()
+        util.set_clock(None)
+
+    def now(self):
+        return self.clock.now
+
+    # Add a node joining through the 'seeds' (GossipService or Address),
+    # or a seed node itself without them.
+    def add_node(self, seeds=()):
+        index = len(self.nodes)
+        address = member_address.Address.from_string(f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}:7000')
+        endpoint = message_service.LoopbackMessageService(self.network, self.logger)
+        self.received.append([])
+        node = service.GossipService(address, self.received[index].append, self.logger, endpoint)
+        node.partial_view = self.partial_view
+        node.join([seed.self_address if isinstance(seed, service.GossipService) else seed for seed in seeds])
+
+        self.nodes.append(node)
+        self.wake_ts.append(float('inf'))
+        self.indexes[endpoint] = index
+        self.schedule(index, self.clock.now)
+        return node
+
+    # Crash the node, it stops answering right away.
+    def remove_node(self, node):
+        node.stop()
+        self.wake_ts[self.nodes.index(node)] = float('inf')
+
+    def schedule(self, index, ts):
+        if ts < self.wake_ts[index]:
+            self.wake_ts[index] = ts
+            heapq.heappush(self.wakeups, (ts, index))
+
+    # Process the next event. Returns False when nothing is left to do.
+    def step(self):
+        while self.wakeups and self.wakeups[0][0] != self.wake_ts[self.wakeups[0][1]]:
+            heapq.heappop(self.wakeups)
+
+        next_events = [self.network.next_delivery(), self.wakeups[0][0] if self.wakeups else None]
+        next_events = [next_ts for next_ts in next_events if next_ts is not None]
+        if not next_events:
+            return False
+
+        self.clock.now = max(self.clock.now, min(next_events))
+        for endpoint in self.network.deliver(self.clock.now):
+            self.schedule(self.indexes[endpoint], self.clock.now)
+
+        while self.wakeups and self.wakeups[0][0] <= self.clock.now:
+            ts, index = heapq.heappop(self.wakeups)
+            if ts == self.wake_ts[index]:
+                self.run_node(index)
+
+        return True
+
+    # Receive the pending datagrams of the node, run its Gossip tick and
+    # flush its outbound queue, then sleep till its next event.
+    def run_node(self, index):
+        node = self.nodes[index]
+        self.wake_ts[index] = float('inf')
+        if node.current_state() != state.STATE_JOINING and node.current_state() != state.STATE_CONNECTED:
+            return
+
+        if node.messaging_service.inbox:
+            node.receive_batch()
+        if node.current_state() == state.STATE_CONNECTED:
+            node.tick()
+        node.send()
+
+        if node.messaging_service.inbox:
+            self.schedule(index, self.clock.now)
+        else:
+            self.schedule(index, self.clock.now + max(1, node.time_till_next_event()))
+
+    # Whether every node is reachable from the first one over the members
+    # the nodes know, i.e. the active views form a connected overlay.
+    def is_connected(self):
+        indexes = {node.self_address.key(): index for index, node in enumerate(self.nodes)}
+        reached = {0}
+        pending = [0]
+        while pending:
+            node = self.nodes[pending.pop()]
+            for peer in node.members.get_set():
+                index = indexes.get(peer.address.key())
+                if index is not None and index not in reached:
+                    reached.add(index)
+                    pending.append(index)
+
+        return len(reached) == len(self.nodes)
+
+    # Run for 'duration' milliseconds of virtual time.
+    def run(self, duration):
+        end_ts = self.clock.now + duration
+        while self.step() and self.clock.now < end_ts:
+            pass
+
+        self.clock.now = max(self.clock.now, end_ts)
+
+    # Run until 'predicate()' holds, checked every 'check_interval'
+    # milliseconds of virtual time. Returns the virtual time it took, or
+    # None if it didn't hold within 'timeout' milliseconds.
+    def run_until(self, predicate, timeout, check_interval=10):
+        start_ts = self.clock.now
+        while self.clock.now - start_ts < timeout:
+            if predicate():
+                return self.clock.now - start_ts
+            self.run(check_interval)
+
+        return None
+
+# Start a cluster of 'size' nodes, wait for the membership to converge,
+# then spread a Data message from one node to all others. With a partial
+# view every node joins through a random node started before it, and the
+# membership converged once the active views form a connected overlay.
+# Otherwise all of them join through the seed at once, and every node has
+# to know all others. Both are measured from the first join.
+def main(size=300, loss=0.0, partial=False, timeout=120000):
+    simulator = Simulator(loss=loss, partial_view=partial)
+    started = time.time()
+
+    seed = simulator.add_node()
+    first_join_ts = simulator.now()
+    for i in range(1, size):
+        if partial:
+            simulator.add_node([random.choice(simulator.nodes[:i])])
+            simulator.run(10)
+        else:
+            simulator.add_node([seed])
+
+    if partial:
+        converged = lambda: (all(node.current_state() == state.STATE_CONNECTED for node in simulator.nodes) and
+                             simulator.is_connected())
+    else:
+        converged = lambda: all(node.members.get_size() == size - 1 for node in simulator.nodes)
+    joined = simulator.run_until(converged, timeout, 100)
+    if joined is not None:
+        joined = simulator.now() - first_join_ts
+    join_counters = dict(simulator.network.counters)
+    coverage = sum(node.members.get_size() for node in simulator.nodes) / size
+    print(f'{size} nodes, loss {loss}, partial view {partial}: membership converged after {joined} ms, '
+          f'{coverage:.1f} members per node, {join_counters["sent"]} datagrams, {join_counters["bytes"]} bytes')
+
+    origin = simulator.nodes[size // 2]
+    origin.send_data(bytes('simulated', config.FORMAT))
+    spread = simulator.run_until(lambda: all(simulator.received[i] for i in range(size) if simulator.nodes[i] is not origin),
+                                 timeout)
+    sent = simulator.network.counters['sent'] - join_counters['sent']
+    print(f'data spread after {spread} ms, {sent} datagrams, {time.time() - started:.1f} s of wall time')
+    simulator.close()
+
+# Usage:
+#   python simulator.py [nodes [loss [partial]]]
+# Every node of a full membership learns about every other node, so the
+# work grows with the square of the cluster size: 300 nodes take about 20 s
+# of wall time, 1000 nodes about 6 minutes. A partial view keeps it linear,
+# 1000 nodes take about 15 s.
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.0,
+         len(sys.argv) > 3 and sys.argv[3] == 'partial')
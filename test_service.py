@@ -0,0 +1,643 @@
+import asyncio
+import logging
+import random
+import unittest
+
+import config
+import delivery
+import dissemination
+import envolope
+import failure_detector
+import member
+import member_address
+import message
+import message_factory
+import message_queue
+import message_service
+import plumtree
+import service
+import simulator
+import state
+import vector_clock
+
+def create_service(network, address):
+    logger = logging.getLogger('test')
+    logger.setLevel(logging.CRITICAL)
+    endpoint = message_service.LoopbackMessageService(network, logger)
+    return service.GossipService(member_address.Address.from_string(address), None, logger, endpoint)
+
+def encode_hello(address):
+    hello = message_factory.MessageFactory.getInstance().create(message.MESSAGE_HELLO_TYPE)
+    hello.this_member = member.Member.create(member_address.Address.from_string(address))
+    return message.encode_message(hello, config.PROTOCOL_VERSION_MIN)
+
+class LoggingTest(unittest.TestCase):
+    def test_joining_node_does_not_log_every_iteration(self):
+        network = message_service.LoopbackNetwork()
+        node = create_service(network, '10.0.0.2:7000')
+        node.logger.setLevel(logging.WARNING)
+        node.join([member_address.Address.from_string('10.0.0.1:7000')])
+        with self.assertNoLogs(node.logger, logging.WARNING):
+            for _ in range(3):
+                node.receive_batch()
+                node.tick()
+                node.send()
+        node.stop()
+
+class FailureDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = failure_detector.FailureDetector(1000, 300, 3, 3000, 60000)
+        self.detector.next_probe_ts = 100000
+
+    def test_stale_news_does_not_revive_a_dead_member(self):
+        self.assertTrue(self.detector.update('a', failure_detector.MEMBER_SUSPECT, 0, 0))
+        self.assertTrue(self.detector.update('a', failure_detector.MEMBER_DEAD, 0, 0))
+        self.detector.remove('a')
+        self.assertFalse(self.detector.update('a', failure_detector.MEMBER_ALIVE, 0, 10))
+        self.assertFalse(self.detector.update('a', failure_detector.MEMBER_DEAD, 0, 10))
+        self.assertTrue(self.detector.is_dead('a'))
+
+        self.assertTrue(self.detector.update('a', failure_detector.MEMBER_ALIVE, 1, 20))
+        self.assertFalse(self.detector.is_dead('a'))
+
+    def test_tombstones_expire(self):
+        self.detector.update('a', failure_detector.MEMBER_DEAD, 0, 0)
+        self.assertEqual(self.detector.next_deadline(), 60000)
+        self.assertEqual(self.detector.expired_suspects(60000), [])
+        self.assertFalse(self.detector.is_dead('a'))
+        self.assertTrue(self.detector.update('a', failure_detector.MEMBER_ALIVE, 0, 60001))
+
+    def test_suspects_expire_unless_refuted(self):
+        self.detector.update('a', failure_detector.MEMBER_SUSPECT, 0, 0)
+        self.detector.update('b', failure_detector.MEMBER_SUSPECT, 0, 100)
+        self.detector.update('b', failure_detector.MEMBER_ALIVE, 1, 200)
+        self.assertEqual(self.detector.next_deadline(), 3000)
+        self.assertEqual(self.detector.expired_suspects(2999), [])
+        self.assertEqual(self.detector.expired_suspects(5000), ['a'])
+        self.assertEqual(self.detector.next_deadline(), 100000)
+
+def start_cluster(size, seed=1):
+    cluster = simulator.Simulator(seed=seed)
+    seed_node = cluster.add_node()
+    for _ in range(size - 1):
+        cluster.add_node([seed_node])
+    return cluster
+
+class SwimTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = start_cluster(5)
+        self.nodes = self.simulator.nodes
+        joined = self.simulator.run_until(lambda: all(node.members.get_size() == 4 for node in self.nodes), 10000)
+        self.assertIsNotNone(joined)
+
+    def tearDown(self):
+        self.simulator.close()
+
+    def test_crashed_member_is_declared_dead(self):
+        crashed = self.nodes[4]
+        self.simulator.remove_node(crashed)
+        alive = self.nodes[:4]
+        detected = self.simulator.run_until(
+            lambda: all(not node.members.find_by_addr(crashed.self_address) for node in alive), 30000)
+
+        self.assertIsNotNone(detected)
+        for node in alive:
+            self.assertEqual(node.members.get_size(), 3)
+            self.assertTrue(node.failure_detector.is_dead(crashed.self_address.key()))
+
+    def test_live_member_refutes_a_suspicion(self):
+        suspect = self.nodes[3]
+        self.nodes[0].apply_member_state(failure_detector.MEMBER_SUSPECT, 0, suspect.this_member)
+        self.simulator.run(3 * config.SWIM_SUSPECT_TIMEOUT)
+
+        self.assertEqual(suspect.failure_detector.incarnation, 1)
+        for node in self.nodes:
+            self.assertEqual(node.members.get_size(), 4)
+            self.assertEqual(node.failure_detector.health_of(suspect.self_address.key()).state,
+                             failure_detector.MEMBER_ALIVE)
+
+class PlumtreeTest(unittest.TestCase):
+    def test_old_members_are_never_lazy(self):
+        members = member.MemberList()
+        for i in range(4):
+            members.put([member.Member(i, config.PROTOCOL_VERSION_SWIM - 2,
+                                       member_address.Address.from_string(f'10.0.0.{i + 2}:7000'))])
+        members.put([member.Member(9, config.PROTOCOL_VERSION, member_address.Address.from_string('10.0.0.9:7000'))])
+
+        tree = plumtree.Plumtree(eager_size=1, lazy_size=4)
+        tree.refresh(members, config.PROTOCOL_VERSION_PLUMTREE)
+        for address in tree.lazy_peers.values():
+            self.assertGreaterEqual(members.find_by_addr(address).version, config.PROTOCOL_VERSION_PLUMTREE)
+
+class PlumtreeClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = start_cluster(8)
+        self.nodes = self.simulator.nodes
+        joined = self.simulator.run_until(lambda: all(node.members.get_size() == 7 for node in self.nodes), 10000)
+        self.assertIsNotNone(joined)
+        for node in self.nodes:
+            node.epidemic_tree = True
+
+    def tearDown(self):
+        self.simulator.close()
+
+    def spread(self, sender, payload):
+        sender.send_data(payload)
+        delivered = self.simulator.run_until(
+            lambda: all(payload in received for node, received in zip(self.nodes, self.simulator.received)
+                        if node is not sender), 5000)
+        self.assertIsNotNone(delivered)
+
+    def test_duplicates_prune_the_tree(self):
+        for i in range(5):
+            self.spread(self.nodes[i % 2], b'tree-%d' % i)
+
+        for received in self.simulator.received:
+            self.assertLessEqual(len(received), 5)
+        self.assertTrue(any(node.plumtree.lazy_peers for node in self.nodes))
+
+    def test_missing_data_is_grafted_from_the_announcer(self):
+        victim = self.nodes[7]
+        announcer = next(node for node in self.nodes[1:7] if victim.self_address.key() not in node.plumtree.eager_peers)
+        grafts = []
+        for node in self.nodes:
+            node.coalesce_messages = False
+        network = self.simulator.network
+        transmit = network.transmit
+
+        # The Data to the victim is lost, but the answer to its Graft.
+        def filtered_transmit(buffer, sender, recipient):
+            message_type = message.decode_type(buffer)
+            if recipient.key() == victim.self_address.key() and message_type == message.MESSAGE_DATA_TYPE:
+                if sender.key() not in grafts:
+                    return
+            if sender.key() == victim.self_address.key() and message_type == message.MESSAGE_GRAFT_TYPE:
+                grafts.append(recipient.key())
+            transmit(buffer, sender, recipient)
+
+        network.transmit = filtered_transmit
+        self.nodes[0].send_data(b'grafted')
+        delivered = self.simulator.run_until(lambda: all(b'grafted' in received for received in self.simulator.received[1:7]), 1000)
+        self.assertIsNotNone(delivered)
+        self.assertNotIn(b'grafted', self.simulator.received[7])
+
+        ihave = message_factory.MessageFactory.getInstance().create(message.MESSAGE_IHAVE_TYPE)
+        ihave.data_version.add_record(announcer.data_version.find_record(self.nodes[0].this_member))
+        transmit(message.encode_message(ihave, config.PROTOCOL_VERSION_PLUMTREE), announcer.self_address, victim.self_address)
+
+        self.simulator.run(config.PLUMTREE_GRAFT_TIMEOUT + 100)
+        self.assertIn(b'grafted', self.simulator.received[7])
+        self.assertIn(announcer.self_address.key(), grafts)
+        self.assertIn(victim.self_address.key(), announcer.plumtree.eager_peers)
+        self.assertIn(announcer.self_address.key(), victim.plumtree.eager_peers)
+
+class PartialViewTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = simulator.Simulator(seed=1, partial_view=True)
+        self.nodes = self.simulator.nodes
+        self.simulator.add_node()
+        for i in range(1, 20):
+            self.simulator.add_node([random.choice(self.nodes[:i])])
+            self.simulator.run(10)
+
+    def tearDown(self):
+        self.simulator.close()
+
+    def test_joins_build_a_connected_overlay_of_bounded_views(self):
+        connected = self.simulator.run_until(self.simulator.is_connected, 5000)
+        self.assertIsNotNone(connected)
+        for node in self.nodes:
+            self.assertGreater(node.members.get_size(), 0)
+            self.assertLessEqual(node.members.get_size(), config.PARTIAL_VIEW_ACTIVE_SIZE)
+
+    def test_shuffles_fill_the_views(self):
+        self.simulator.run(2 * config.PARTIAL_VIEW_SHUFFLE_INTERVAL)
+        for node in self.nodes:
+            self.assertEqual(node.members.get_size(), config.PARTIAL_VIEW_ACTIVE_SIZE)
+            self.assertGreater(len(node.view.passive), config.PARTIAL_VIEW_SHUFFLE_PASSIVE)
+            self.assertLessEqual(len(node.view.passive), config.PARTIAL_VIEW_PASSIVE_SIZE)
+            for address_key in node.view.passive:
+                self.assertFalse(node.members.find_by_key(address_key))
+
+    def test_full_view_disconnects_a_member(self):
+        self.simulator.run(2 * config.PARTIAL_VIEW_SHUFFLE_INTERVAL)
+        node = self.nodes[0]
+        newcomer = next(other for other in self.nodes[1:] if not node.members.find_by_addr(other.self_address))
+        active = [peer.address for peer in node.members.get_set()]
+
+        node.add_active(newcomer.this_member)
+        self.simulator.run(50)
+        self.assertTrue(node.members.find_by_addr(newcomer.self_address))
+        self.assertEqual(node.members.get_size(), config.PARTIAL_VIEW_ACTIVE_SIZE)
+        disconnected = next(address for address in active if not node.members.find_by_addr(address))
+        self.assertIn(disconnected.key(), node.view.passive)
+
+        peer = self.nodes[[other.self_address.key() for other in self.nodes].index(disconnected.key())]
+        self.assertFalse(peer.members.find_by_addr(node.self_address))
+        self.assertIn(node.self_address.key(), peer.view.passive)
+
+    def test_crashed_member_is_replaced_from_the_passive_view(self):
+        self.simulator.run(2 * config.PARTIAL_VIEW_SHUFFLE_INTERVAL)
+        crashed = self.nodes[5]
+        neighbors = [node for node in self.nodes if node.members.find_by_addr(crashed.self_address)]
+        self.simulator.remove_node(crashed)
+
+        alive = [node for node in self.nodes if node is not crashed]
+        replaced = self.simulator.run_until(
+            lambda: all(not node.members.find_by_addr(crashed.self_address) for node in alive) and
+                    all(node.members.get_size() >= config.PARTIAL_VIEW_ACTIVE_SIZE - 1 for node in neighbors), 30000)
+        self.assertIsNotNone(replaced)
+
+def create_envolope(sequence_num, message_type):
+    return envolope.MessageEnvolopeOut(sequence_num, b'', config.MESSAGE_RETRY_ATTEMPTS,
+                                       member_address.Address.from_string('10.0.0.2:7000'),
+                                       message_type, message_queue.message_priority(message_type))
+
+class OverflowPolicyTest(unittest.TestCase):
+    def fill(self, policy, message_types):
+        queue = message_queue.MessageQueue(len(message_types), policy)
+        for sequence_num, message_type in enumerate(message_types, 1):
+            self.assertTrue(queue.enque(create_envolope(sequence_num, message_type)))
+        return queue
+
+    def test_drop_oldest_rumor(self):
+        queue = self.fill(config.OVERFLOW_DROP_OLDEST_RUMOR,
+                          [message.MESSAGE_HELLO_TYPE, message.MESSAGE_STATUS_TYPE, message.MESSAGE_DATA_TYPE])
+        env = create_envolope(4, message.MESSAGE_ACK_TYPE)
+        self.assertEqual([dropped.sequence_num for dropped in queue.make_room(env)], [2])
+        self.assertTrue(queue.enque(env))
+
+        queue = self.fill(config.OVERFLOW_DROP_OLDEST_RUMOR, [message.MESSAGE_HELLO_TYPE, message.MESSAGE_ACK_TYPE])
+        env = create_envolope(3, message.MESSAGE_DATA_TYPE)
+        self.assertEqual(queue.make_room(env), [])
+        self.assertFalse(queue.enque(env))
+        self.assertEqual(queue.stats()['rejected'], 1)
+
+    def test_drop_lowest_priority(self):
+        queue = self.fill(config.OVERFLOW_DROP_LOWEST_PRIORITY,
+                          [message.MESSAGE_DATA_TYPE, message.MESSAGE_STATUS_TYPE, message.MESSAGE_HELLO_TYPE])
+        env = create_envolope(4, message.MESSAGE_DATA_TYPE)
+        self.assertEqual([dropped.sequence_num for dropped in queue.make_room(env)], [2])
+        self.assertTrue(queue.enque(env))
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+        # Nothing queued is less important than another Data message.
+        self.assertFalse(queue.admits(message.MESSAGE_DATA_TYPE))
+        self.assertTrue(queue.admits(message.MESSAGE_ACK_TYPE))
+        env = create_envolope(5, message.MESSAGE_ACK_TYPE)
+        self.assertEqual([dropped.sequence_num for dropped in queue.make_room(env)], [1])
+
+    def test_reject(self):
+        queue = self.fill(config.OVERFLOW_REJECT, [message.MESSAGE_STATUS_TYPE, message.MESSAGE_DATA_TYPE])
+        env = create_envolope(3, message.MESSAGE_ACK_TYPE)
+        self.assertFalse(queue.admits(message.MESSAGE_ACK_TYPE))
+        self.assertEqual(queue.make_room(env), [])
+        self.assertFalse(queue.enque(env))
+
+        # More recipients of a queued message still fit.
+        env = create_envolope(2, message.MESSAGE_DATA_TYPE)
+        env.recipient = member_address.Address.from_string('10.0.0.3:7000')
+        self.assertTrue(queue.enque(env))
+        self.assertEqual(len(queue), 3)
+
+class ReceiveBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_malformed_datagram_does_not_drop_the_batch(self):
+        sender = member_address.Address.from_string('10.0.0.9:7000')
+        inbox = self.seed.messaging_service.inbox
+        inbox.append((encode_hello('10.0.0.2:7000'), sender))
+        inbox.append((b'GET / HTTP/1.1\r\n\r\n', sender))
+        inbox.append((encode_hello('10.0.0.3:7000'), sender))
+
+        self.assertEqual(self.seed.receive_batch(), 3)
+        self.assertEqual(self.seed.current_state(), state.STATE_CONNECTED)
+        self.assertEqual(self.seed.metrics.malformed.snapshot(), 1)
+        self.assertEqual(self.seed.metrics.unhandled.snapshot(), 1)
+
+        self.seed.flush_joins()
+        joined = {peer.address.to_string() for peer in self.seed.members.get_set()}
+        self.assertEqual(joined, {'10.0.0.2:7000', '10.0.0.3:7000'})
+
+    def test_nested_bundles_are_dropped(self):
+        sender = member_address.Address.from_string('10.0.0.9:7000')
+        inner = message.Bundle.pack([encode_hello('10.0.0.2:7000'), encode_hello('10.0.0.3:7000')], config.MESSAGE_MAX_SIZE)
+        self.assertEqual(len(inner), 1)
+        outer = message.Bundle.pack([inner[0], encode_hello('10.0.0.4:7000')], config.MESSAGE_MAX_SIZE)
+        self.assertEqual(len(outer), 1)
+
+        self.assertTrue(self.seed.handle_datagram(outer[0], sender))
+        self.seed.flush_joins()
+        joined = {peer.address.to_string() for peer in self.seed.members.get_set()}
+        self.assertEqual(joined, {'10.0.0.4:7000'})
+
+    def test_handler_bug_is_not_counted_as_malformed(self):
+        def broken_handler(envelope_in):
+            raise RuntimeError('handler bug')
+
+        self.seed.message_handler.handle_new_message = broken_handler
+        with self.assertRaises(RuntimeError):
+            self.seed.handle_datagram(encode_hello('10.0.0.2:7000'), member_address.Address.from_string('10.0.0.9:7000'))
+        self.assertEqual(self.seed.metrics.malformed.snapshot(), 0)
+
+class HandleDataTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+        self.received = []
+        self.seed.data_receiver = self.received.append
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_truncated_payload_is_not_marked_as_seen(self):
+        sender = member_address.Address.from_string('10.0.0.2:7000')
+        data = message_factory.MessageFactory.getInstance().create(message.MESSAGE_DATA_TYPE, 1)
+        data.data_version = vector_clock.VectorRecord(1, sender.to_string())
+        data.data = b'payload'
+        for version in (config.PROTOCOL_VERSION_MIN, config.PROTOCOL_VERSION_BINARY):
+            data.data_version.member_id = f'{sender.to_string()}/{version}'
+            buffer = message.encode_message(data, version)
+            inbox = self.seed.messaging_service.inbox
+
+            inbox.append((buffer[:-3], sender))
+            self.seed.receive_batch()
+            self.assertFalse(self.seed.data_version.find_by_member_id(data.data_version.member_id))
+            self.assertEqual(self.received, [])
+
+            inbox.append((buffer, sender))
+            self.seed.receive_batch()
+            self.assertEqual(self.seed.data_version.find_by_member_id(data.data_version.member_id).sequence_number, 1)
+            self.assertEqual(self.received, [b'payload'])
+            self.received.clear()
+
+    def test_repairs_restart_the_hop_count(self):
+        sender = member_address.Address.from_string('10.0.0.2:7000')
+        peer = member.Member(1, config.PROTOCOL_VERSION, member_address.Address.from_string('10.0.0.3:7000'))
+        data = message_factory.MessageFactory.getInstance().create(message.MESSAGE_DATA_TYPE, 1)
+        data.data_version = vector_clock.VectorRecord(1, sender.to_string())
+        data.data = b'payload'
+        data.reserved = 5
+        self.seed.messaging_service.inbox.append((message.encode_message(data, config.PROTOCOL_VERSION), sender))
+        self.seed.receive_batch()
+        self.seed.members.put([peer])
+
+        graft = message_factory.MessageFactory.getInstance().create(message.MESSAGE_GRAFT_TYPE, 2)
+        graft.data_version.add_record(data.data_version)
+        repairs = [lambda: self.seed.enqueue_data_log(vector_clock.VectorClock(), peer.address),
+                   lambda: self.seed.handle_datagram(message.encode_message(graft, config.PROTOCOL_VERSION), peer.address)]
+        for repair in repairs:
+            self.seed.clear_envolope()
+            repair()
+            sent = [env for env in self.seed.outbound_messages if env.message_type == message.MESSAGE_DATA_TYPE]
+            self.assertEqual(len(sent), 1)
+            repaired = message.Data(message.MESSAGE_DATA_TYPE, 0)
+            self.assertTrue(message.decode_message(repaired, sent[0].buffer))
+            self.assertEqual(repaired.data, b'payload')
+            self.assertEqual(repaired.reserved, 0)
+
+class SendTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_unreachable_recipient_gets_none_of_its_due_messages(self):
+        peer = member.Member(1, config.PROTOCOL_VERSION_BUNDLE, member_address.Address.from_string('10.0.0.2:7000'))
+        self.seed.members.put([peer])
+        self.seed.enqueue_status(peer.address)
+        self.seed.enqueue_status(peer.address)
+        expired = self.seed.outbound_messages.find(self.seed.sequence_num - 1, peer.address.key())
+        expired.attempt_num = expired.max_attempts
+
+        self.seed.send()
+        self.assertEqual(self.seed.metrics.datagrams_sent.snapshot(), 0)
+        self.assertEqual(len(self.seed.outbound_messages), 0)
+        self.assertFalse(self.seed.members.find_by_addr(peer.address))
+
+class SackTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+        self.peer = member.Member(1, config.PROTOCOL_VERSION_SACK, member_address.Address.from_string('10.0.0.2:7000'))
+        self.seed.members.put([self.peer])
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_sequence_numbers_collapse_into_ranges(self):
+        self.assertEqual(message.Sack.to_ranges([5, 3, 4, 9, 1, 1, 10]), [(1, 1), (3, 5), (9, 10)])
+        self.assertEqual(message.Sack.to_ranges([]), [])
+
+    def test_ranges_survive_both_codecs(self):
+        sack = message_factory.MessageFactory.getInstance().create(message.MESSAGE_SACK_TYPE)
+        sack.ranges = [(1, 1), (3, 5)]
+        sack.duplicates = [(7, 8)]
+        sack.reserved |= message.SACK_FLAG_DUPLICATES
+        for version in (config.PROTOCOL_VERSION_SACK - 3, config.PROTOCOL_VERSION_SACK):
+            decoded = message.Sack(message.MESSAGE_SACK_TYPE, 0)
+            self.assertTrue(message.decode_message(decoded, message.encode_message(sack, version)))
+            self.assertEqual(decoded.ranges, sack.ranges)
+            self.assertEqual(list(decoded.sequence_nums()),
+                             [(1, False), (3, False), (4, False), (5, False), (7, True), (8, True)])
+
+    def test_acks_are_aggregated_into_ranges(self):
+        for sequence_num in [4, 2, 3, 9]:
+            self.seed.enqueue_ack(sequence_num, self.peer.address)
+        self.seed.enqueue_ack(12, self.peer.address, True)
+        self.seed.flush_acks()
+
+        sacks = list(self.seed.outbound_messages)
+        self.assertEqual(len(sacks), 1)
+        sack = message.Sack(message.MESSAGE_SACK_TYPE, 0)
+        self.assertTrue(message.decode_message(sack, sacks[0].buffer))
+        self.assertEqual(sack.ranges, [(2, 4), (9, 9)])
+        self.assertEqual(sack.duplicates, [(12, 12)])
+
+    def test_sack_acknowledges_the_queued_messages(self):
+        for _ in range(3):
+            self.seed.enqueue_status(self.peer.address)
+        last = self.seed.sequence_num
+        self.assertEqual(len(self.seed.outbound_messages), 3)
+
+        sack = message_factory.MessageFactory.getInstance().create(message.MESSAGE_SACK_TYPE)
+        sack.ranges = [(last - 2, last - 1), (last, last)]
+        self.seed.handle_datagram(message.encode_message(sack, config.PROTOCOL_VERSION_SACK), self.peer.address)
+        self.assertEqual(len(self.seed.outbound_messages), 0)
+
+class DisseminationTest(unittest.TestCase):
+    def test_least_transmitted_events_come_first(self):
+        buffer = dissemination.DisseminationBuffer(retransmit_factor=2, max_events=3)
+        news = [member.Member.create(member_address.Address.from_string(f'10.0.0.{i}:7000')) for i in range(4)]
+        for i, news_member in enumerate(news[:3]):
+            buffer.add(failure_detector.MEMBER_ALIVE, news_member, 0, i)
+
+        first = next(buffer.candidates())
+        buffer.transmitted(first, 1)
+        self.assertEqual([event.member for event in buffer.candidates()], [news[1], news[2], news[0]])
+
+        buffer.transmitted(first, 1)
+        self.assertEqual([event.member for event in buffer.candidates()], [news[1], news[2]])
+
+        buffer.add(failure_detector.MEMBER_SUSPECT, news[1], 1, 3)
+        buffer.add(failure_detector.MEMBER_ALIVE, news[3], 0, 4)
+        self.assertEqual([event.member for event in buffer.candidates()], [news[2], news[1], news[3]])
+
+class MembershipTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+        self.peer = member.Member.create(member_address.Address.from_string('10.0.0.2:7000'))
+        self.seed.members.put([self.peer])
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_events_are_sent_on_their_own_without_bundles(self):
+        self.seed.coalesce_messages = False
+        newcomer = member.Member.create(member_address.Address.from_string('10.0.0.3:7000'))
+        self.seed.enqueue_member_state(failure_detector.MEMBER_ALIVE, newcomer, 0)
+
+        datagrams = self.seed.pack_datagrams([], self.peer.address)
+        self.assertEqual(len(datagrams), 1)
+        member_state = message.MemberState(message.MESSAGE_MEMBER_STATE_TYPE, 0)
+        message.decode_message(member_state, datagrams[0])
+        self.assertTrue(member_state.member.address.equals(newcomer.address))
+
+    def test_member_list_leaves_out_dead_members(self):
+        dead = member.Member.create(member_address.Address.from_string('10.0.0.3:7000'))
+        self.seed.failure_detector.update(dead.address.key(), failure_detector.MEMBER_DEAD, 0, 0)
+        member_list = message.MemberList(message.MESSAGE_MEMBER_LIST_TYPE, 1)
+        member_list.members = [dead]
+        self.seed.messaging_service.inbox.append((message.encode_message(member_list, config.PROTOCOL_VERSION_MIN),
+                                                  self.peer.address))
+        self.seed.receive_batch()
+        self.assertFalse(self.seed.members.find_by_addr(dead.address))
+
+    def test_member_list_is_pushed_to_a_random_member(self):
+        self.seed.sync_member_list(0)
+        self.assertEqual(self.seed.next_member_list_sync_ts, config.MEMBER_LIST_SYNC_INTERVAL)
+
+        env = self.seed.outbound_messages.find(self.seed.sequence_num, self.peer.address.key())
+        member_list = message.MemberList(message.MESSAGE_MEMBER_LIST_TYPE, 0)
+        message.decode_message(member_list, env.buffer)
+        pushed = {pushed_member.address.to_string() for pushed_member in member_list.members}
+        self.assertEqual(pushed, {'10.0.0.1:7000', '10.0.0.2:7000'})
+
+class StatusGossipTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+        self.peer = member.Member.create(member_address.Address.from_string('10.0.0.2:7000'))
+        self.seed.members.put([self.peer])
+        self.seed.data_version.set_sequence_number_by_id('10.0.0.3:7000', 1)
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def gossip_status(self):
+        self.seed.enqueue_status_gossip()
+        env = self.seed.outbound_messages.find(self.seed.sequence_num, self.peer.address.key())
+        status = message.Status(message.MESSAGE_STATUS_TYPE, 0)
+        message.decode_message(status, env.buffer)
+        self.seed.acknowledge_envolope(env)
+        return status.reserved
+
+    def test_acknowledged_deltas_are_followed_by_the_digest(self):
+        # The first Status has no baseline, later ones carry the changed record.
+        self.assertEqual(self.gossip_status(), message.STATUS_FLAG_DIGEST)
+        flags = []
+        for _ in range(config.STATUS_FULL_INTERVAL):
+            self.seed.data_version.set_sequence_number_by_id('10.0.0.3:7000', len(flags) + 2)
+            flags.append(self.gossip_status())
+
+        deltas = [message.STATUS_FLAG_DELTA] * (config.STATUS_FULL_INTERVAL - 1)
+        self.assertEqual(flags, deltas + [message.STATUS_FLAG_DIGEST])
+
+class UnknownSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_binary_sender_is_acknowledged_in_binary(self):
+        sender = member_address.Address.from_string('10.0.0.9:7000')
+        data = message_factory.MessageFactory.getInstance().create(message.MESSAGE_DATA_TYPE, 12345)
+        data.data_version = vector_clock.VectorRecord(12345, sender.to_string())
+        data.data = b'payload'
+        self.seed.messaging_service.inbox.append((message.encode_message(data, config.PROTOCOL_VERSION_BINARY), sender))
+        self.seed.receive_batch()
+
+        envs = self.seed.outbound_messages.find_by_recipient(sender.key())
+        self.assertEqual([env.message_type for env in envs], [message.MESSAGE_ACK_TYPE])
+        ack = message.Ack(message.MESSAGE_ACK_TYPE, 0)
+        message.decode_message(ack, envs[0].buffer)
+        self.assertEqual(ack.ack_sequence_num, 12345)
+
+class SequenceNumTest(unittest.TestCase):
+    def setUp(self):
+        self.network = message_service.LoopbackNetwork()
+        self.seed = create_service(self.network, '10.0.0.1:7000')
+        self.seed.join([])
+        self.seed.members.put([member.Member.create(member_address.Address.from_string('10.0.0.2:7000'))])
+        self.seed.sequence_num = message.MESSAGE_MAX_SEQUENCE_NUM
+
+    def tearDown(self):
+        self.seed.stop()
+
+    def test_binary_peers_do_not_wrap_at_the_text_field(self):
+        self.assertEqual(self.seed.next_sequence_num(), message.MESSAGE_MAX_SEQUENCE_NUM + 1)
+
+    def test_text_peers_wrap_at_the_text_field(self):
+        text_peer = member.Member(1, config.PROTOCOL_VERSION_BUNDLE, member_address.Address.from_string('10.0.0.3:7000'))
+        self.seed.members.put([text_peer])
+        self.assertEqual(self.seed.next_sequence_num(), 1)
+
+        self.seed.members.remove(text_peer)
+        self.seed.sequence_num = message.MESSAGE_MAX_SEQUENCE_NUM
+        self.assertEqual(self.seed.next_sequence_num(text_codec=True), 1)
+
+    def test_text_codec_refuses_values_out_of_its_fields(self):
+        ack = message_factory.MessageFactory.getInstance().create(message.MESSAGE_ACK_TYPE, 1)
+        ack.ack_sequence_num = message.MESSAGE_MAX_SEQUENCE_NUM + 1
+        self.assertRaises(ValueError, ack.encode)
+        self.assertTrue(ack.encode_binary())
+
+        record = vector_clock.VectorRecord(message.MESSAGE_MAX_SEQUENCE_NUM + 1, '10.0.0.1:7000')
+        self.assertRaises(ValueError, record.encode)
+
+class AsyncioDeliveryTest(unittest.TestCase):
+    def test_fails_fast_without_a_running_loop(self):
+        logger = logging.getLogger('test')
+        self.assertRaises(RuntimeError, delivery.create, config.DELIVERY_ASYNCIO, print, logger)
+
+    def test_delivers_on_the_running_loop(self):
+        received = []
+
+        async def main():
+            asyncio_delivery = delivery.create(config.DELIVERY_ASYNCIO, received.append, logging.getLogger('test'))
+            self.assertTrue(asyncio_delivery.offer(b'payload'))
+            await asyncio.sleep(0)
+            asyncio_delivery.close()
+
+        asyncio.run(main())
+        self.assertEqual(received, [b'payload'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import collections
+import json
+import sys
+
+import config
+import metrics
+
+# Infection latency buckets, in milliseconds.
+INFECTION_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+# What a node saw of a single rumor (a Data message).
+class RumorTrace:
+    def __init__(self, first_seen_ts, hops, sender, origin=False):
+        self.first_seen_ts = first_seen_ts
+        self.hops = hops          # hops the first copy made, 0 at the origin
+        self.sender = sender      # who sent the first copy, None at the origin
+        self.origin = origin      # the rumor was created by this node
+        self.duplicates = 0       # copies received after the first one
+
+# Opt-in tracing of the rumors a node sees, keyed by the Data version
+# (member id, sequence number). The traces of all nodes are dumped as JSON
+# lines and merged offline into infection curves, see 'merge'. At most
+# 'capacity' rumors are traced, the oldest are forgotten first.
+class RumorTracer:
+    def __init__(self, capacity=config.RUMOR_TRACE_SIZE):
+        self.capacity = capacity
+        self.traces = collections.OrderedDict()  # map<(member id, sequence number), RumorTrace>, oldest first
+
+    def add(self, key, trace):
+        self.traces[key] = trace
+        while len(self.traces) > self.capacity:
+            self.traces.popitem(last=False)
+
+    # This node created the data of the 'data_version' record.
+    def originated(self, data_version, current_ts):
+        self.add((data_version.member_id, data_version.sequence_number), RumorTrace(current_ts, 0, None, True))
+
+    # A copy of the data arrived from the 'sender' after 'hops' hops.
+    def seen(self, data_version, hops, sender, current_ts):
+        key = (data_version.member_id, data_version.sequence_number)
+        trace = self.traces.get(key)
+        if trace is None:
+            self.add(key, RumorTrace(current_ts, hops, sender.to_string() if sender else None))
+        else:
+            trace.duplicates += 1
+
+    # The traces as dicts, tagged with the 'node' they come from.
+    def records(self, node):
+        return [{
+            'node': node,
+            'member_id': member_id,
+            'sequence_number': sequence_number,
+            'first_seen_ts': trace.first_seen_ts,
+            'hops': trace.hops,
+            'sender': trace.sender,
+            'origin': trace.origin,
+            'duplicates': trace.duplicates,
+        } for (member_id, sequence_number), trace in self.traces.items()]
+
+    # Write the traces to 'path', one JSON object per line.
+    def dump(self, path, node):
+        with open(path, 'w') as output:
+            for record in self.records(node):
+                output.write(json.dumps(record) + '\n')
+
+    def clear(self):
+        self.traces.clear()
+
+def load(paths):
+    records = []
+    for path in paths:
+        with open(path) as trace_file:
+            records.extend(json.loads(line) for line in trace_file if line.strip())
+
+    return records
+
+# Merge the trace records of all the nodes into one summary per rumor: the
+# infection curve (milliseconds since the origin created it, and the number
+# of nodes which had it by then), the hop counts and the duplicates. Rumors
+# whose origin wasn't traced start at their earliest sighting. With the
+# 'cluster_size', the coverage of every rumor is reported as well.
+def merge(records, cluster_size=None):
+    by_rumor = collections.defaultdict(list)
+    for record in records:
+        by_rumor[(record['member_id'], record['sequence_number'])].append(record)
+
+    infection = metrics.Histogram('rumor_infection_ms', 'Time for a rumor to reach a node.', INFECTION_BUCKETS)
+    rumors = []
+    for (member_id, sequence_number), sightings in by_rumor.items():
+        origins = [record['first_seen_ts'] for record in sightings if record['origin']]
+        start_ts = min(origins) if origins else min(record['first_seen_ts'] for record in sightings)
+        receivers = sorted((record for record in sightings if not record['origin']),
+                           key=lambda record: record['first_seen_ts'])
+
+        curve = []
+        for infected, record in enumerate(receivers, 1):
+            latency = record['first_seen_ts'] - start_ts
+            infection.observe(latency)
+            curve.append((latency, infected))
+
+        summary = {
+            'member_id': member_id,
+            'sequence_number': sequence_number,
+            'start_ts': start_ts,
+            'origin_traced': bool(origins),
+            'receivers': len(receivers),
+            'last_ms': curve[-1][0] if curve else 0,
+            'curve': curve,
+            'hops': dict(collections.Counter(record['hops'] for record in receivers)),
+            'duplicates': sum(record['duplicates'] for record in sightings),
+        }
+        if cluster_size:
+            summary['coverage'] = (len(receivers) + bool(origins)) / cluster_size
+        rumors.append(summary)
+
+    rumors.sort(key=lambda summary: summary['start_ts'])
+    return {'rumors': rumors, 'infection_ms': infection.snapshot()}
+
+# Usage:
+#   python tracing.py trace.jsonl [trace.jsonl ...]
+#
+# Prints the merged summary of the traces as JSON.
+if __name__ == "__main__":
+    json.dump(merge(load(sys.argv[1:])), sys.stdout, indent=2)
+    print()
@@ -5,9 +5,22 @@ import re
 import socket
 import logging
 
-def get_time():
+def wall_clock():
     return int(time.time() * 1000)   # in milliseconds
 
+# The clock behind 'get_time'. The simulator replaces it with a virtual
+# clock, see 'set_clock'.
+clock = wall_clock
+
+def get_time():
+    return clock()
+
+# Use 'new_clock', a callable returning the time in milliseconds, for
+# all the timers. None restores the wall clock.
+def set_clock(new_clock):
+    global clock
+    clock = new_clock if new_clock is not None else wall_clock
+
 def is_valid_ipv4_address(address):
     try:
         socket.inet_pton(socket.AF_INET, address)
@@ -32,10 +45,10 @@ def is_valid_ipv6_address(address):
 def is_valid_ip_address(address):
     return is_valid_ipv4_address(address) or is_valid_ipv6_address(address)
 
-def create_logger(formatter, path_to_file):
+def create_logger(formatter, path_to_file, level=logging.INFO):
     logger = logging.getLogger()
     file_handler = logging.FileHandler(path_to_file, mode='w')
     file_handler.setFormatter(logging.Formatter(formatter))
     logger.addHandler(file_handler)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(level)
     return logger
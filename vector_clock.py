@@ -1,5 +1,8 @@
+import collections
 import sys
+import zlib
 
+import codec
 import config
 import member_address
 import member
@@ -9,26 +12,38 @@ VC_AFTER  = 1
 VC_EQUAL  = 2
 VC_CONFLICT  = 3
 
+# The number of buckets in the vector clock digest.
+DIGEST_BUCKETS = 16
+
 class VectorRecord:
     def __init__(self, sequence_number = 0, member_id = ''):
         self.sequence_number = sequence_number
         self.member_id = member_id
+        self.clock_idx = 0  # clock version of the last update, never encoded
 
     def size(self):
         return sys.getsizeof(self.sequence_number) + len(self.member_id)
 
     def decode(self, buffer):
-        self.sequence_number = int(buffer[:4].decode(config.FORMAT).strip()) # 4-bytes
-        member_id_length = int(buffer[4:8].decode(config.FORMAT).strip())    # 4-bytes
-        self.member_id = buffer[8:member_id_length+8].decode(config.FORMAT)
+        self.sequence_number = int(str(buffer[:4], config.FORMAT).strip()) # 4-bytes
+        member_id_length = int(str(buffer[4:8], config.FORMAT).strip())    # 4-bytes
+        self.member_id = str(buffer[8:member_id_length+8], config.FORMAT)
         return 8 + member_id_length
 
     def encode(self):
-        encoded_sequence_number = bytes(f'{self.sequence_number:>04}', config.FORMAT)  # 4-byte
+        encoded_sequence_number = codec.encode_text_number(self.sequence_number)  # 4-byte
         encoded_member_id_length = bytes(f'{len(self.member_id):>04}', config.FORMAT)  # 4-byte
         encoded_member_id = bytes(f'{self.member_id}', config.FORMAT)                  # member_id_length-bytes
         return encoded_sequence_number + encoded_member_id_length + encoded_member_id
 
+    def decode_binary(self, buffer):
+        self.sequence_number, offset = codec.decode_varint(buffer, 0)
+        self.member_id, offset = codec.decode_string(buffer, offset)
+        return offset
+
+    def encode_binary(self):
+        return codec.encode_varint(self.sequence_number) + codec.encode_string(self.member_id)
+
     def to_string(self):
         return f'(sequence_number: {self.sequence_number}, member_id: {self.member_id})'
 
@@ -38,27 +53,21 @@ class VectorRecord:
 
 class VectorClock:
     def __init__(self):
-        self.current_idx = 0
-        self.records = []  # VectorRecord
-        self.cache = {}    # map<member_id, VectorRecord>
+        self.current_idx = 0  # incremented on every update
+        self.records = collections.OrderedDict()  # map<member_id, VectorRecord>, least recently updated first
         self.capacity = config.MESSAGE_MAX_SIZE
-    
-    def size(self):
-        total_size = 0
-        for record in self.records:
-           total_size += record.size()
+        self.total_size = 0  # sum of the record sizes
+        self.digest = [0] * DIGEST_BUCKETS  # xor of the record hashes per bucket
 
-        return total_size
+    def size(self):
+        return self.total_size
 
     def find_record(self, member):
         member_id = create_member_id(member)
         if not member_id:
             return False
 
-        if not member_id in self.cache:
-            return False
-
-        return self.cache[member_id]
+        return self.records.get(member_id, False)
 
     def set_sequence_number_for_member(self, member, seq_num):
         member_id = create_member_id(member)
@@ -66,49 +75,82 @@ class VectorClock:
         
     def set_sequence_number_by_id(self, member_id, sequence_number):
         # insert (or override) the latest record with the new record.
-        if not member_id in self.cache:
+        self.current_idx += 1
+        record = self.records.get(member_id)
+        if record is None:
             # Add the entry to records
             record = VectorRecord(sequence_number, member_id)
-            
-            # capacity full
-            if self.size() >= self.capacity:
-                self.records.pop()
+            self.add_record(record)
+
+            # capacity full, evict the least recently updated records.
+            while self.total_size > self.capacity and len(self.records) > 1:
+                _, evicted = self.records.popitem(last=False)
+                self.total_size -= evicted.size()
+                self.digest[record_bucket(evicted.member_id)] ^= record_hash(evicted)
 
         else:
-            record = self.cache[member_id]
-            self.records.remove(record)
+            old_size = record.size()
+            old_hash = record_hash(record)
             record.sequence_number = sequence_number
+            self.total_size += record.size() - old_size
+            self.digest[record_bucket(member_id)] ^= old_hash ^ record_hash(record)
+            self.records.move_to_end(member_id)
 
-        self.cache[member_id] = record
-        self.records.insert(0, record)
+        record.clock_idx = self.current_idx
         return record
 
+    # The clock with only the records updated after the clock version 'clock_idx'.
+    # Records are kept in the update order, so only the changed ones are visited.
+    def changes_since(self, clock_idx):
+        changes = VectorClock()
+        changes.current_idx = self.current_idx
+        for record in reversed(self.records.values()):
+            if record.clock_idx <= clock_idx:
+                break
+            changes.add_record(record)
+
+        return changes
+
+    # Bit mask of the buckets which differ from the other digest.
+    def digest_mask(self, other_digest):
+        mask = 0
+        for bucket in range(DIGEST_BUCKETS):
+            if self.digest[bucket] != other_digest[bucket]:
+                mask |= 1 << bucket
+
+        return mask
+
+    # The clock with only the records of the buckets in the 'mask'.
+    def records_in_buckets(self, mask):
+        subset = VectorClock()
+        subset.current_idx = self.current_idx
+        for record in self.records.values():
+            if mask & (1 << record_bucket(record.member_id)):
+                subset.add_record(record)
+
+        return subset
+
 
     def increment_sequence_number_for_member(self, member):
-        member_id = create_member_id(member)
         record = self.find_record(member)
         if not record:
             return False
-        
-        del self.records[record]
-        record.sequence_number += 1
-        self.cache[member_id] = record
-        self.records.insert(0, record)
-        return record
+
+        return self.set_sequence_number_by_id(record.member_id, record.sequence_number + 1)
 
     def to_string(self):
         str = f'current_idx: {self.current_idx}, records: ['
-        for record in self.records:
+        for record in self.records.values():
             str += record.to_string()
             str += ', '
         
         return str + ' ]'
 
     def copy(self, other):
-        self.records = []
+        self.records = other.records.copy()
         self.current_idx = other.current_idx
-        for record in other.records:
-            self.records.append(record)
+        self.total_size = other.total_size
+        self.digest = list(other.digest)
 
     def resolve_comp_result(self, old, new):
         if old != VC_EQUAL and new != old:
@@ -117,11 +159,14 @@ class VectorClock:
 
     def compare(self, other, merge):
         result = VC_EQUAL
-        for record in self.records:
+        found_num = 0
+        merged = []
+        for record in self.records.values():
             found = other.find_by_member_id(record.member_id)
             if not found:
                 result = self.resolve_comp_result(result, VC_AFTER)
             else:
+                found_num += 1
                 first_seq_num = record.sequence_number
                 second_seq_num = found.sequence_number
                 if (first_seq_num > second_seq_num):
@@ -130,7 +175,14 @@ class VectorClock:
                     if (second_seq_num > first_seq_num):
                         result = self.resolve_comp_result(result, VC_BEFORE)
                         if merge:
-                            record.sequence_number = second_seq_num
+                            merged.append(found)
+
+        # The other clock has records we've never seen.
+        if found_num < len(other.records):
+            result = self.resolve_comp_result(result, VC_BEFORE)
+
+        for found in merged:
+            self.set_sequence_number_by_id(found.member_id, found.sequence_number)
 
         return result
 
@@ -150,14 +202,19 @@ class VectorClock:
                 if (first_seq_num < second_seq_num):
                     result = VC_BEFORE
                     if merge:
-                        found.sequence_number = second_seq_num
+                        self.set_sequence_number_by_id(record.member_id, second_seq_num)
 
 
         return result
 
+    def add_record(self, record):
+        self.records[record.member_id] = record
+        self.total_size += record.size()
+        self.digest[record_bucket(record.member_id)] ^= record_hash(record)
+
     def decode(self, buffer):
-        self.current_idx = int(buffer[:4].decode(config.FORMAT).strip()) # 4-bytes
-        size = int(buffer[4:8].decode(config.FORMAT).strip())            # 4-bytes
+        self.current_idx = int(str(buffer[:4], config.FORMAT).strip()) # 4-bytes
+        size = int(str(buffer[4:8], config.FORMAT).strip())            # 4-bytes
 
         bytes_decoded = 8
         i = 0
@@ -165,25 +222,46 @@ class VectorClock:
             i += 1
             record = VectorRecord()
             bytes_decoded += record.decode(buffer[bytes_decoded:])
-            self.records.append(record)
+            self.add_record(record)
         
         return bytes_decoded
 
     def encode(self):
-        encoded_current_idx = bytes(f'{self.current_idx:>04}', config.FORMAT)  # 4-byte
+        encoded_current_idx = bytes(f'{self.current_idx % 10000:>04}', config.FORMAT)  # 4-byte
         encoded_size = bytes(f'{len(self.records):>04}', config.FORMAT)        # 4-byte
         composit_encoded_message = encoded_current_idx + encoded_size
-        for record in self.records:
+        for record in self.records.values():
             encoded_record = record.encode()
             composit_encoded_message += encoded_record
         
         return composit_encoded_message
 
+    def decode_binary(self, buffer):
+        self.current_idx, offset = codec.decode_varint(buffer, 0)
+        size, offset = codec.decode_varint(buffer, offset)
+        for _ in range(size):
+            record = VectorRecord()
+            offset += record.decode_binary(buffer[offset:])
+            self.add_record(record)
+
+        return offset
+
+    def encode_binary(self):
+        composit_encoded_message = codec.encode_varint(self.current_idx) + codec.encode_varint(len(self.records))
+        for record in self.records.values():
+            composit_encoded_message += record.encode_binary()
+
+        return composit_encoded_message
+
     def find_by_member_id(self, member_id):
-        for member in self.records:
-            if (member.member_id == member_id):
-                return member
-        return False
+        return self.records.get(member_id, False)
+
+# The digest bucket of the records from the originator.
+def record_bucket(member_id):
+    return zlib.crc32(bytes(member_id, config.FORMAT)) % DIGEST_BUCKETS
+
+def record_hash(record):
+    return zlib.crc32(bytes(f'{record.member_id}/{record.sequence_number}', config.FORMAT))
 
 # multi addrs format member-id
 def create_member_id(member):